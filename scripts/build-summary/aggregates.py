@@ -0,0 +1,90 @@
+# Stdlib import
+import collections
+import datetime
+import re
+
+# What the summary tables count for each build. The counts are kept for
+# each hour in the build cache, see BuildCache.add_to_aggregates.
+
+# remove 'task failed' if 'too many retries' also exists for same task
+task_failed_re = re.compile('Task Failed: (?P<task>.*)')
+
+# One of the builds of a failure, as the template needs it
+BuildRef = collections.namedtuple(
+    'BuildRef', ['job_name', 'build_num', 'timestamp'])
+
+
+def reported_failures(failures):
+    """failures without any Task Failed that was retried"""
+    def retried(failure):
+        match = task_failed_re.search(failure)
+        return match and 'Too many retries. PrevTask: {task}'.format(
+            task=match.groupdict()['task']) in failures
+    return frozenset(failure for failure in failures if not retried(failure))
+
+
+class TSF(object):
+    """Total, Success, Failure """
+    def __init__(self, t=0, s=0):
+        self.t = int(t)
+        self.s = int(s)
+
+    @property
+    def f(self):
+        return self.t - self.s
+
+    @property
+    def s_percent(self):
+        try:
+            return (float(self.s)/float(self.t))*100.0
+        except ZeroDivisionError:
+            return 0
+
+    def success(self):
+        self.t += 1
+        self.s += 1
+
+    def failure(self):
+        self.t += 1
+
+    def b(self, build):
+        if build.result == "SUCCESS":
+            self.success()
+        else:
+            self.failure()
+
+
+def build_names(record):
+    """The buildcount keys a build is counted under"""
+    return ['all', record.series, record.trigger, record.btype,
+            '{series}_{btype}_{trigger}'.format(
+                series=record.series,
+                btype=record.btype,
+                trigger=record.trigger)]
+
+
+def periodic_key(record):
+    """The periodichistogram key base and result of a periodic build"""
+    # count aborts as failure for the sake of graphs
+    result = record.result
+    if result == 'ABORTED':
+        result = 'FAILURE'
+    return '{series}_{btype}_{trigger}'.format(
+        series=record.series,
+        btype=record.btype,
+        trigger=record.trigger), result
+
+
+def hour_of(timestamp):
+    """The hour a build started, in hours from the first day of year 1
+
+    The summary tables are counted by this, so that they can be summed into
+    histograms of hours, days or weeks, see histograms.py.
+    """
+    return timestamp.toordinal() * 24 + timestamp.hour
+
+
+def hour_start(hour):
+    """The local time hour starts at, hour being from hour_of"""
+    return (datetime.datetime.fromordinal(hour // 24) +
+            datetime.timedelta(hours=hour % 24))
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+# Stdlib import
+import collections
+import datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+# 3rd Party imports
+import click
+
+# Project imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aggregates import reported_failures  # noqa
+from aggregates import TSF  # noqa
+from build import BuildRecord  # noqa
+from build import Cause  # noqa
+from buildcache import BuildCache  # noqa
+import histograms  # noqa
+
+# # Summary Aggregates Benchmark
+# Compares the summary tables read from the hourly counters in BuildCache
+# against a full pass over every build, which is how print_html made them
+# before. The full pass is run with now at the end of today, when its 24hr
+# bins line up with the days of the counters, and the tables must be
+# identical. The script exits non zero if they aren't, or if a query sorted
+# by build_num doesn't put 10 after 9. The time to read the counters into
+# histograms of each bucket width is reported too.
+
+FAILURES = [
+    'Task Failed: Install packages / os_{word} / Install {word} packages',
+    'Too many retries. PrevTask: Install packages / os_{word} / Install '
+    '{word} packages',
+    'Tempest Test Failed: tempest.api.{word}.test_{n}',
+    'Build Timeout: Setup / {word} / Wait for {word}',
+    'Traceback. KeyError: {word} Previous Task {word} / wait',
+    'Unknown Failure',
+]
+WORDS = ['nova', 'neutron', 'glance', 'keystone', 'cinder', 'heat', 'swift']
+RESULTS = ['SUCCESS', 'SUCCESS', 'FAILURE', 'FAILURE', 'ABORTED', 'UNSTABLE']
+
+
+def random_records(rand, count, days, distinct):
+    pool = set()
+    while len(pool) < distinct:
+        pool.add(rand.choice(FAILURES).format(
+            word=rand.choice(WORDS), n=rand.randint(0, distinct)))
+    pool = sorted(pool)
+    now = datetime.datetime.now()
+    records = collections.OrderedDict()
+    for build_num in range(count):
+        result = rand.choice(RESULTS)
+        failures = frozenset()
+        if result != 'SUCCESS':
+            failures = frozenset(rand.sample(pool, rand.randint(1, 4)))
+        job_name = 'JJB-RPC-AIO_{branch}-xenial-{btype}-{trigger}'.format(
+            branch=rand.choice(['master', 'newton-14.0', 'mitaka-13.1']),
+            btype=rand.choice(['full', 'ceph', 'upgrade']),
+            trigger=rand.choice(['periodic', 'pr']))
+        records['{job}_{num}'.format(job=job_name, num=build_num)] = \
+            BuildRecord(
+                result=result,
+                timestamp=now - datetime.timedelta(
+                    seconds=rand.random() * days * 86400),
+                job_name=job_name,
+                build_num=str(build_num),
+                branch=rand.choice(['master', 'newton_14_0']),
+                series=rand.choice(['master', 'newton', 'mitaka']),
+                btype=rand.choice(['full', 'ceph', 'upgrade']),
+                trigger=rand.choice(['periodic', 'periodic', 'pr', 'user']),
+                build_hierachy=(Cause(job_name, str(build_num), '#'),),
+                failures=failures,
+                building=rand.random() < 0.01,
+                scan_state=None)
+    return records
+
+
+def full_pass(buildobjs, now, histogram_length):
+    """The summary tables as print_html made them from every build"""
+    buildobjs = [
+        build._replace(failures=reported_failures(build.failures))
+        for build in buildobjs.values() if not build.building]
+    failcount = collections.defaultdict(dict)
+    for build in buildobjs:
+        for failure in sorted(build.failures):
+            d = failcount[failure]
+            if 'count' not in d:
+                d['count'] = 0
+            d['count'] += 1
+            if 'builds' not in d:
+                d['builds'] = []
+            d['builds'].append(build)
+            if 'oldest' not in d or d['oldest'] > build.timestamp:
+                d['oldest'] = build.timestamp
+                d['oldest_job'] = build.build_num
+                d['oldest_bobj'] = build
+            if 'newest' not in d or d['newest'] < build.timestamp:
+                d['newest'] = build.timestamp
+                d['newest_job'] = build.build_num
+                d['newest_bobj'] = build
+    for failure, fdict in failcount.items():
+        fdict['histogram'] = [0] * histogram_length
+        for build in fdict['builds']:
+            age_days = (now - build.timestamp).days
+            if age_days < histogram_length:
+                fdict['histogram'][histogram_length - age_days - 1] += 1
+    if 'Unknown Failure' in failcount:
+        del failcount['Unknown Failure']
+
+    buildcount = collections.defaultdict(TSF)
+    twodaysago = now - datetime.timedelta(days=2)
+    for build in [b for b in buildobjs if b.timestamp > twodaysago]:
+        buildcount['all'].b(build)
+        buildcount[build.series].b(build)
+        buildcount[build.trigger].b(build)
+        buildcount[build.btype].b(build)
+        buildcount['{series}_{btype}_{trigger}'.format(
+                   series=build.series,
+                   btype=build.btype,
+                   trigger=build.trigger)].b(build)
+    periodichistogram = {}
+    for build in buildobjs:
+        result = build.result
+        if result == 'ABORTED':
+            result = 'FAILURE'
+        if build.trigger != 'periodic':
+            continue
+        key_base = '{series}_{btype}_{trigger}'.format(
+            series=build.series,
+            btype=build.btype,
+            trigger=build.trigger)
+        key = '{base}_{result}'.format(
+            base=key_base,
+            result=result)
+        stats_key = '{base}_stats'.format(base=key_base)
+        if key not in periodichistogram:
+            periodichistogram[key] = [0] * histogram_length
+        # print_html reset the stats when the second result of a build type
+        # was seen, losing the max of the first. The counters don't.
+        if stats_key not in periodichistogram:
+            periodichistogram[stats_key] = dict(max=0)
+        age_days = (now - build.timestamp).days
+        if age_days < histogram_length:
+            if result == "SUCCESS":
+                inc = 1
+            else:
+                inc = -1
+            periodichistogram[key][histogram_length - age_days - 1] += inc
+            value = abs(
+                periodichistogram[key][histogram_length - age_days - 1])
+            stats = periodichistogram[stats_key]
+            if value > stats['max']:
+                stats['max'] = value
+    return failcount, buildcount, periodichistogram
+
+
+def comparable(failcount, buildcount, periodichistogram):
+    failures = dict(
+        (failure, (d['count'], d['histogram'], d['oldest'], d['oldest_job'],
+                   d['oldest_bobj'].job_name, d['newest'], d['newest_job'],
+                   d['newest_bobj'].job_name, d['newest_bobj'].timestamp))
+        for failure, d in failcount.items())
+    builds = dict((name, (tsf.t, tsf.s)) for name, tsf in buildcount.items())
+    return failures, builds, periodichistogram
+
+
+@click.command(help='Benchmark the summary tables')
+@click.option('--builds', default=20000, help='Number of builds')
+@click.option('--days', default=30, help='Days the builds are spread over')
+@click.option('--distinct', default=2000, help='Number of distinct failures')
+@click.option('--seed', default=0)
+def bench(builds, days, distinct, seed):
+    rand = random.Random(seed)
+    records = random_records(rand, builds, days, distinct)
+    workdir = tempfile.mkdtemp()
+    try:
+        build_cache = BuildCache(os.path.join(workdir, 'cache'))
+        for key, record in records.items():
+            build_cache.put(key, record)
+        build_cache.commit()
+
+        today = datetime.date.today()
+        end_of_today = datetime.datetime.combine(
+            today + datetime.timedelta(days=1), datetime.time())
+
+        def counters(bucket='day'):
+            return (build_cache.failcount(today, days, bucket),
+                    build_cache.buildcount(today, 2),
+                    build_cache.periodichistogram(today, days, bucket))
+
+        full = comparable(*full_pass(records, end_of_today, days))
+        same = full == comparable(*counters())
+        print("{builds} builds over {days} days, {distinct} failures,"
+              " tables {same}".format(builds=builds, days=days,
+                                      distinct=len(full[0]),
+                                      same='same' if same else 'DIFFER'))
+        # Build numbers are text in the cache, but sort as numbers.
+        build_nums = [int(record.build_num) for key, record in
+                      build_cache.query(order_by='build_num',
+                                        descending=False)]
+        sorted_nums = build_nums == sorted(build_nums)
+        print("builds by build_num {sorted}".format(
+            sorted='sorted' if sorted_nums else 'NOT SORTED'))
+        same = same and sorted_nums
+        full_seconds = min(timeit.repeat(
+            lambda: full_pass(records, end_of_today, days),
+            number=1, repeat=3))
+        counter_seconds = collections.OrderedDict(
+            (bucket, min(timeit.repeat(lambda: counters(bucket),
+                                       number=1, repeat=3)))
+            for bucket in histograms.BUCKETS)
+        # The old cache had to be loaded before the full pass
+        load_seconds = min(timeit.repeat(build_cache.load, number=1,
+                                         repeat=3))
+        build_cache.close()
+    finally:
+        shutil.rmtree(workdir)
+    print("full pass: {0:.3f}s, after loading the cache: {1:.3f}s".format(
+        full_seconds, full_seconds + load_seconds))
+    for bucket, seconds in counter_seconds.items():
+        print("hourly counters by {bucket}{numpy}: {seconds:.3f}s".format(
+            bucket=bucket, seconds=seconds,
+            numpy=' with NumPy' if histograms.numpy else ''))
+    sys.exit(0 if same else 1)
+
+
+if __name__ == '__main__':
+    bench()
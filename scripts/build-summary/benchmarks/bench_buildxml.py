@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+# Stdlib import
+import ast
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# 3rd Party imports
+import click
+from lxml import etree
+
+# Project imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from buildxml import parse_build_xml  # noqa
+
+# # build.xml Parse Benchmark
+# Compares buildxml.parse_build_xml against parsing the whole of build.xml
+# with etree.parse and reading it from the tree, which is how Build read it
+# before. Both must find the same values, the script exits non zero if
+# they don't. Each file is parsed in a forked child so that the max RSS of
+# each parser can be reported.
+
+BUILD_XML = """<?xml version='1.0' encoding='UTF-8'?>
+<build>
+  <actions>
+    <hudson.model.CauseAction>
+      <causeBag class="linked-hash-map">
+        <entry>
+          <hudson.model.Cause_-UpstreamCause>
+            <upstreamProject>RPC-Upgrade-Matrix</upstreamProject>
+            <upstreamUrl>job/RPC-Upgrade-Matrix/</upstreamUrl>
+            <upstreamBuild>{n}</upstreamBuild>
+            <upstreamCauses>
+              <hudson.triggers.TimerTrigger_-TimerTriggerCause/>
+            </upstreamCauses>
+          </hudson.model.Cause_-UpstreamCause>
+          <int>1</int>
+        </entry>
+      </causeBag>
+    </hudson.model.CauseAction>
+    <hudson.tasks.junit.TestResultAction>
+      <result>
+        <suites>
+{suites}
+        </suites>
+        <duration>{n}.0</duration>
+      </result>
+    </hudson.tasks.junit.TestResultAction>
+  </actions>
+  <number>{n}</number>
+  <startTime>{start_time}</startTime>
+  <result>FAILURE</result>
+  <duration>{duration}</duration>
+  <builtOn>aio1</builtOn>
+  <changeSet>
+{changes}
+  </changeSet>
+</build>
+"""
+
+SUITE = """          <suite>
+            <name>tempest.api.{word}</name>
+            <duration>{n}.{n}</duration>
+            <cases>
+{cases}
+            </cases>
+          </suite>"""
+
+CASE = """              <case>
+                <duration>{n}.{n}</duration>
+                <className>tempest.api.{word}.Test{n}</className>
+                <testName>test_{word}_{n}</testName>
+                <skipped>false</skipped>
+                <failedSince>0</failedSince>
+              </case>"""
+
+CHANGE = """    <item>
+      <commitId>{hex}</commitId>
+      <msg>Update {word} to {n}</msg>
+      <author>{word}</author>
+    </item>"""
+
+WORDS = ['nova', 'neutron', 'glance', 'keystone', 'cinder', 'heat', 'swift']
+
+
+def fill(rand, template, **kwargs):
+    return template.format(n=rand.randint(1, 999), word=rand.choice(WORDS),
+                           hex='{0:040x}'.format(rand.getrandbits(160)),
+                           **kwargs)
+
+
+def write_build_xml(path, rand, cases, changes):
+    suites = []
+    for _ in range(max(cases // 100, 1)):
+        suites.append(fill(rand, SUITE, cases='\n'.join(
+            fill(rand, CASE) for _ in range(min(cases, 100)))))
+    with open(path, 'w') as f:
+        f.write(fill(rand, BUILD_XML,
+                     suites='\n'.join(suites),
+                     changes='\n'.join(
+                         fill(rand, CHANGE) for _ in range(changes)),
+                     start_time=rand.randint(1400000000, 1500000000) * 1000,
+                     duration=rand.randint(600, 18000) * 1000))
+
+
+def full_parse(path):
+    tree = etree.parse(path)
+    cause = tree.xpath('//causes | //causeBag/entry')[0].getchildren()[0]
+    result = tree.find('./result')
+    duration = tree.find('./duration')
+    return (None if result is None else result.text,
+            tree.find('startTime').text,
+            None if duration is None else duration.text,
+            etree.tostring(cause))
+
+
+def streaming_parse(path):
+    build_xml = parse_build_xml(path)
+    return (build_xml.result, build_xml.start_time, build_xml.duration,
+            etree.tostring(build_xml.cause))
+
+
+def run(func, path, repeat):
+    """Time func in a forked child, returns (seconds, max rss MB, values)"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            values = func(path)
+            times.append(time.time() - start)
+        os.write(write_fd, repr((min(times), values)).encode('utf-8'))
+        os._exit(0)
+    os.close(write_fd)
+    output = b''
+    while True:
+        data = os.read(read_fd, 65536)
+        if not data:
+            break
+        output += data
+    os.close(read_fd)
+    _, _, rusage = os.wait4(pid, 0)
+    seconds, values = ast.literal_eval(output.decode('utf-8'))
+    # ru_maxrss is in KB on linux
+    return seconds, rusage.ru_maxrss / 1024.0, values
+
+
+@click.command(help='Benchmark reading large build.xml files')
+@click.option('--cases', 'case_counts', default='1000,10000,100000',
+              help='Comma separated test case counts, one file for each')
+@click.option('--changes', default=1000,
+              help='Change set entries after the needed elements')
+@click.option('--repeat', default=3, help='Parses of each file, best counts')
+@click.option('--seed', default=0)
+def bench(case_counts, changes, repeat, seed):
+    rand = random.Random(seed)
+    workdir = tempfile.mkdtemp()
+    differ = 0
+    try:
+        for cases in [int(count) for count in case_counts.split(',')]:
+            path = os.path.join(workdir, 'build.xml')
+            write_build_xml(path, rand, cases, changes)
+            size = os.path.getsize(path) / 2.0 ** 20
+            full = run(full_parse, path, repeat)
+            streaming = run(streaming_parse, path, repeat)
+            if full[2] != streaming[2]:
+                differ += 1
+                print("DIFFER: {full!r} {streaming!r}".format(
+                    full=full[2], streaming=streaming[2]))
+            for name, (seconds, rss, _) in [('full', full),
+                                            ('streaming', streaming)]:
+                print("{cases} cases, {size:.1f}MB, {name}: {seconds:.3f}s,"
+                      " max rss {rss:.0f}MB".format(
+                          cases=cases, size=size, name=name,
+                          seconds=seconds, rss=rss))
+    finally:
+        shutil.rmtree(workdir)
+    sys.exit(1 if differ else 0)
+
+
+if __name__ == '__main__':
+    bench()
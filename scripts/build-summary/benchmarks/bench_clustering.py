@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+# Stdlib import
+import collections
+import os
+import random
+import string
+import sys
+import time
+
+# 3rd Party imports
+import click
+
+# Project imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from clustering import cluster  # noqa
+from clustering import jaccard  # noqa
+from clustering import shingles  # noqa
+
+# # Failure Clustering Benchmark
+# Clusters distinct failures made from templates that have a word, a
+# hostname and a counter filled in, and some have a random word added to the
+# end. Failures from the same template and word only differ by identifiers
+# and that word, so should share a cluster: groups that were split are
+# reported. The time to compare every pair of failures is
+# measured on a sample and scaled up, as it is too slow to run for them all,
+# and the sample's clusters are checked against those pairs.
+
+TEMPLATES = [
+    'Task Failed: Install packages / os_{word} / Install {word} packages '
+    'on {host}',
+    'Traceback. ConnectionError: HTTPConnectionPool(host={host}, port=8774): '
+    'Max retries exceeded with url: /v2.1/{word} (attempt {n})',
+    'Build Timeout: Setup / {word} / Wait for {word} on {host} after {n}s',
+    'Tempest Test Failed: tempest.api.{word}.test_servers.ServersTest.'
+    'test_{word}_{n}',
+    'Too many retries. PrevTask: Deploy {word} / Restart {word} services '
+    '/ {host}',
+    'Failed to connect to the host via ssh: {host} port 22: Connection '
+    'timed out ({word})',
+]
+WORDS = ['nova', 'neutron', 'glance', 'keystone', 'cinder', 'heat', 'swift',
+         'horizon', 'ceilometer', 'aodh', 'gnocchi', 'ironic', 'magnum',
+         'designate', 'octavia', 'barbican', 'trove', 'sahara', 'zaqar',
+         'senlin']
+
+
+def random_failures(rand, count, noise):
+    """count distinct failures, and the group each was made from
+
+    noise is the fraction of failures with a random word at the end.
+    """
+    failures = {}
+    while len(failures) < count:
+        template = rand.randrange(len(TEMPLATES))
+        word = rand.choice(WORDS)
+        host = 'aio{n}_{word}_container-{hex:08x}'.format(
+            n=rand.randint(1, 9), word=word, hex=rand.getrandbits(32))
+        failure = TEMPLATES[template].format(
+            word=word, host=host, n=rand.randint(0, 100000))
+        if rand.random() < noise:
+            failure += ' ' + ''.join(rand.choice(string.ascii_lowercase)
+                                     for _ in range(6))
+        failures[failure] = (template, word)
+    return failures
+
+
+def pairwise(failures, threshold):
+    """Pairs of failures that are at least threshold similar"""
+    sets = [shingles(failure) for failure in failures]
+    return [(failures[i], failures[j])
+            for i in range(len(failures))
+            for j in range(i + 1, len(failures))
+            if sets[i] and sets[j] and
+            jaccard(sets[i], sets[j]) >= threshold]
+
+
+@click.command(help='Benchmark near duplicate failure clustering')
+@click.option('--failures', default=100000,
+              help='Number of distinct failures')
+@click.option('--threshold', default=0.8)
+@click.option('--noise', default=0.5,
+              help='Fraction of failures with a random word added')
+@click.option('--sample', default=2000,
+              help='Number of failures to compare every pair of')
+@click.option('--seed', default=0)
+def bench(failures, threshold, noise, sample, seed):
+    rand = random.Random(seed)
+    groups = random_failures(rand, failures, noise)
+
+    start = time.time()
+    clusters = cluster(groups, threshold)
+    cluster_seconds = time.time() - start
+    cluster_groups = collections.defaultdict(set)
+    for i, members in enumerate(clusters):
+        for failure in members:
+            cluster_groups[groups[failure]].add(i)
+    split = sum(1 for ids in cluster_groups.values() if len(ids) > 1)
+    print("{failures} failures, {sets} distinct shingle sets, from {groups}"
+          " groups: {clusters} clusters in {seconds:.2f}s, {split} groups"
+          " split".format(
+              failures=failures,
+              sets=len(set(shingles(failure) for failure in groups)),
+              groups=len(cluster_groups),
+              clusters=len(clusters), seconds=cluster_seconds, split=split))
+
+    sample_failures = sorted(rand.sample(sorted(groups), sample))
+    start = time.time()
+    pairs = pairwise(sample_failures, threshold)
+    pairwise_seconds = time.time() - start
+    clustered = dict((failure, i)
+                     for i, members in enumerate(
+                         cluster(sample_failures, threshold))
+                     for failure in members)
+    missed = sum(1 for a, b in pairs if clustered[a] != clustered[b])
+    scale = (float(failures) / sample) ** 2
+    print("every pair of {sample}: {seconds:.2f}s, {estimate:.0f}s"
+          " estimated for {failures}, {missed} of {pairs} similar pairs"
+          " not clustered".format(
+              sample=sample, seconds=pairwise_seconds,
+              estimate=pairwise_seconds * scale, failures=failures,
+              missed=missed, pairs=len(pairs)))
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# Stdlib import
+import os
+import random
+import sys
+import timeit
+
+# 3rd Party imports
+import click
+
+# Project imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from buildcache import BuildCache  # noqa
+import normalise  # noqa
+
+# # Failure Normalisation Benchmark
+# Compares normalise.normalise against applying each of the NORMALISERS in
+# turn, which is how failures were normalised before. The outputs must be
+# identical, the script exits non zero if any differ.
+
+# Failures as found by the rules, {n} and {h} are filled in with random
+# numbers and hex so that each build's copy of a failure is different.
+TEMPLATES = [
+    'Task Failed: Install pip packages / pip_install / Install pip packages',
+    'Too many retries. PrevTask: Setup hosts / lxc_hosts / Wait for cache',
+    'Tempest Test Failed: tempest.api.compute.servers.test_create_server'
+    '.ServersTestJSON.test_list_servers[id-{h}{h}-{n}]',
+    'Build Timeout: Install Openstack / os_nova / Ensure nova api is up',
+    'Heat Resource Fail: Resource CREATE failed: Server {h}{h}-{h}-{h}-'
+    '{h}-{h}{h}{h} in ERROR state',
+    'Apt Fetch Fail: http://10.{n}.{n}.{n}/ubuntu/pool/main/p/pkg.deb',
+    'Traceback. ConnectionError: HTTPConnectionPool(host=\'172.29.{n}.{n}'
+    '\', port=35357) Previous Task Keystone / os_keystone / Ensure service',
+    'Traceback. OSError: No such file /root/.ansible/tmp/ansible-tmp-{n}.'
+    '{n}-{n}/command Previous Task Setup infrastructure / memcached',
+    'Task Failed: \x1b[8mha:{h}AAA=\x1b[0mSetup / rabbitmq / Join cluster',
+    'Traceback. ClientException: https://{h}.k1k.me/v1.0/{n}/entities/{h}'
+    ' {{\'httpdTxnId\': \'{h}-{n}\'}} Previous Task Maas / rpc_maas / Check',
+    'gcc fail: Python.h: No such file or directory',
+    "Can't find pip package: python-novaclient==7.1.{n}",
+]
+
+
+def random_failure(rand):
+    template = rand.choice(TEMPLATES)
+    while '{n}' in template or '{h}' in template:
+        template = template.replace(
+            '{n}', str(rand.randint(0, 255)), 1).replace(
+            '{h}', '{0:x}'.format(rand.getrandbits(16)), 1)
+    return template.replace('{{', '{').replace('}}', '}')
+
+
+def seven_pass(failure):
+    for pattern, sub in normalise.NORMALISERS:
+        failure = pattern.sub(sub, failure)
+    return failure
+
+
+@click.command(help='Benchmark failure normalisation')
+@click.option('--cache', default=None,
+              help='Also normalise the failures in a build-summary cache')
+@click.option('--count', default=100000,
+              help='Number of failures to normalise')
+@click.option('--distinct', default=2000,
+              help='Number of distinct failures among them')
+@click.option('--seed', default=0)
+def bench(cache, count, distinct, seed):
+    rand = random.Random(seed)
+    pool = [random_failure(rand) for _ in range(distinct)]
+    if cache:
+        build_cache = BuildCache(cache)
+        for build in build_cache.load().values():
+            pool.extend(build.failures)
+        build_cache.close()
+    failures = [rand.choice(pool) for _ in range(count)]
+
+    mismatches = [failure for failure in set(failures)
+                  if normalise.normalise(failure) != seven_pass(failure)]
+    for failure in mismatches:
+        print("MISMATCH: {failure!r}".format(failure=failure))
+    print("{count} failures, {distinct} distinct, {bad} differ".format(
+        count=len(failures), distinct=len(set(failures)),
+        bad=len(mismatches)))
+
+    def run(func):
+        return min(timeit.repeat(lambda: [func(f) for f in failures],
+                                 number=1, repeat=3))
+    seven = run(seven_pass)
+    normalise._cache = normalise.LRUCache(normalise._cache.size)
+    cold = timeit.timeit(lambda: [normalise.normalise(f) for f in failures],
+                         number=1)
+    warm = run(normalise.normalise)
+    print("seven pass: {0:.3f}s".format(seven))
+    print("normalise, empty cache: {0:.3f}s".format(cold))
+    print("normalise, warm cache: {0:.3f}s".format(warm))
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# Stdlib import
+import glob
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# 3rd Party imports
+import click
+
+# Project imports
+SUMMARY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SUMMARY_DIR)
+from build import Build  # noqa
+
+# # build-summary Benchmark
+# Times Build construction for every build in a corpus, see make_corpus.py,
+# then full build-summary-gh.py runs with an empty cache (cold) and with the
+# cache the cold run wrote (warm). Peak memory is the max RSS of this
+# process for Build construction, and of each summary process.
+
+
+def build_folders(corpus):
+    return sorted(os.path.dirname(path) for path in glob.glob(
+        os.path.join(os.path.abspath(corpus), 'jobs', '*', 'builds', '*',
+                     'build.xml')))
+
+
+def log_bytes(build):
+    total = 0
+    for log in build.logs():
+        if os.path.exists(log.path):
+            total += os.path.getsize(log.path)
+    return total
+
+
+def max_rss_mb(rusage):
+    # ru_maxrss is in KB on linux
+    return rusage.ru_maxrss / 1024.0
+
+
+def bench_builds(folders):
+    times = []
+    errors = 0
+    built = []
+    start = time.time()
+    for build_folder in folders:
+        parts = build_folder.split(os.sep)
+        build_start = time.time()
+        try:
+            build = Build(build_folder=build_folder,
+                          job_name=parts[-3],
+                          build_num=parts[-1])
+        except Exception:
+            errors += 1
+        else:
+            built.append(build)
+        times.append(time.time() - build_start)
+    total = time.time() - start
+    size = sum(log_bytes(build) for build in built)
+    return {
+        'builds': len(folders),
+        'errors': errors,
+        'seconds': total,
+        'mean_seconds': total / max(len(folders), 1),
+        'max_seconds': max(times or [0]),
+        'log_mb': size / 2.0 ** 20,
+        'mb_per_second': size / 2.0 ** 20 / total if total else 0,
+        'max_rss_mb': max_rss_mb(
+            resource.getrusage(resource.RUSAGE_SELF)),
+    }
+
+
+def bench_summary(folders, cache, jobs):
+    # The page and its data are written next to the cache
+    command = [sys.executable, 'build-summary-gh.py', '--cache', cache,
+               '--output', os.path.join(os.path.dirname(cache), 'index.html'),
+               '--jobs', str(jobs)]
+    command.extend(os.path.join(build_folder, 'build.xml')
+                   for build_folder in folders)
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        # buildsummary.j2 is read from the current directory
+        process = subprocess.Popen(command, cwd=SUMMARY_DIR,
+                                   stdout=devnull, stderr=devnull)
+        # wait4 gives the usage of this child alone
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = status
+        return {
+            'seconds': time.time() - start,
+            'status': status,
+            'max_rss_mb': max_rss_mb(rusage),
+        }
+
+
+@click.command(help='Benchmark build-summary against the corpus in CORPUS')
+@click.argument('corpus')
+@click.option('--jobs', default=1,
+              help='--jobs for the summary runs')
+@click.option('--json', 'json_file', default=None,
+              help='Also write the results to this file as JSON')
+def bench(corpus, jobs, json_file):
+    folders = build_folders(corpus)
+    if not folders:
+        raise click.ClickException(
+            "No builds found in {corpus}".format(corpus=corpus))
+    results = {}
+    workdir = tempfile.mkdtemp()
+    try:
+        cache = os.path.join(workdir, 'cache')
+        results['summary_cold'] = bench_summary(folders, cache, jobs)
+        results['summary_warm'] = bench_summary(folders, cache, jobs)
+    finally:
+        shutil.rmtree(workdir)
+    # Last, as it grows this process.
+    results['build'] = bench_builds(folders)
+
+    build = results['build']
+    print("Build: {builds} builds, {log_mb:.1f}MB of logs in {seconds:.2f}s"
+          " ({mb_per_second:.1f}MB/s), slowest {max_seconds:.2f}s,"
+          " {errors} errors, max rss {max_rss_mb:.0f}MB".format(**build))
+    for name in ['summary_cold', 'summary_warm']:
+        print("{name}: {seconds:.2f}s, max rss {max_rss_mb:.0f}MB,"
+              " status {status}".format(name=name, **results[name]))
+    if json_file:
+        with open(json_file, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Stdlib import
+import os
+import shutil
+import sys
+import tempfile
+
+# 3rd Party imports
+import click
+
+# Project imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logreader import BuildLog  # noqa
+from scanner import load_rules  # noqa
+from scanner import Scanner  # noqa
+
+# # Log Sources Check
+# Scans the ansible logs of two hosts, as logs.yaml lists them for
+# multinode builds, and checks that each is indexed on its own: a failure
+# before the first task of the second log has no task rather than the last
+# task of the first, and an '...ignoring' at the start of the second log
+# doesn't hide a failure at the end of the first. The script exits non
+# zero if the failures found aren't the expected ones.
+
+LOGS = [
+    ('archive/openstack/host1/ansible.log',
+     'Starting ansible\n'
+     'PLAY [Install nova] ***\n'
+     'TASK [os_nova : Install nova packages] ***\n'
+     'fatal: [host1]: FAILED! => {"msg": "No package matching nova"}\n'),
+    ('archive/openstack/host2/ansible.log',
+     'Starting ansible\n'
+     '...ignoring\n'
+     'fatal: [host2]: UNREACHABLE! => {"msg": "ssh failed"}\n'
+     'PLAY [Install glance] ***\n'
+     'TASK [os_glance : Check glance] ***\n'
+     'fatal: [host2]: FAILED! => {"msg": "glance is down"}\n'
+     '...ignoring\n'
+     'TASK [os_glance : Install glance packages] ***\n'
+     'fatal: [host2]: FAILED! => {"msg": "No package matching glance"}\n'),
+]
+
+# (log, failure) of the failures that must be found
+EXPECTED = set([
+    ('archive/openstack/host1/ansible.log',
+     'Task Failed: Install nova / os_nova : Install nova packages'),
+    ('archive/openstack/host2/ansible.log', 'Task Failed: '),
+    ('archive/openstack/host2/ansible.log',
+     'Task Failed: Install glance / os_glance : Install glance packages'),
+])
+
+
+class Failures(object):
+    """The failures a Scanner adds, with the logs they were found in"""
+    def __init__(self):
+        self.failures = set()
+
+    def add_failure(self, failure, rule='', origin=None):
+        self.failures.add((origin.source, failure))
+
+
+@click.command(help='Check that the logs of a build are indexed apart')
+def check():
+    ruleset = load_rules().subset(['ansible_task_fail'])
+    workdir = tempfile.mkdtemp()
+    try:
+        paths = []
+        for name, text in LOGS:
+            path = os.path.join(workdir, name)
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(text)
+            paths.append(path)
+        target = Failures()
+        with BuildLog(paths, names=[name for name, _ in LOGS]) as build_log:
+            Scanner(ruleset, target).scan(build_log)
+    finally:
+        shutil.rmtree(workdir)
+    for log, failure in sorted(EXPECTED - target.failures):
+        print("missing: {log}: {failure}".format(log=log, failure=failure))
+    for log, failure in sorted(target.failures - EXPECTED):
+        print("unexpected: {log}: {failure}".format(log=log,
+                                                    failure=failure))
+    same = target.failures == EXPECTED
+    print("{logs} logs, failures {same}".format(
+        logs=len(LOGS), same='as expected' if same else 'DIFFER'))
+    sys.exit(0 if same else 1)
+
+
+if __name__ == '__main__':
+    check()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+# Stdlib import
+import os
+import random
+import time
+
+# 3rd Party imports
+import click
+
+# # Synthetic Jenkins Corpus Generator
+# Writes a jenkins job tree like the one build-summary-gh.py reads:
+# jobs/<job>/builds/<n>/ with build.xml, injectedEnvVars.txt, log and the
+# archived runcmd-bash.log and deploy.sh.log. Everything is random but
+# seeded, so a corpus can be recreated exactly to compare two versions of
+# the code.
+
+BUILD_XML = """<?xml version='1.0' encoding='UTF-8'?>
+<build>
+  <actions>
+    <hudson.model.CauseAction>
+      {causes}
+    </hudson.model.CauseAction>
+  </actions>
+  <number>{build_num}</number>
+  <startTime>{start_time}</startTime>
+  {result}<duration>{duration}</duration>
+</build>
+"""
+
+# Causes are wrapped in either of these, see Build.get_parent_info.
+CAUSE_CONTAINERS = [
+    '<causes>{cause}</causes>',
+    '<causeBag class="linked-hash-map"><entry>{cause}<int>1</int></entry>'
+    '</causeBag>',
+]
+
+TIMER_CAUSE = '<hudson.triggers.TimerTrigger_-TimerTriggerCause/>'
+USER_CAUSE = """<hudson.model.Cause_-UserIdCause>
+        <userId>{user}</userId>
+      </hudson.model.Cause_-UserIdCause>"""
+PR_CAUSE = """<org.jenkinsci.plugins.ghprb.GhprbCause>
+        <pullID>{pull}</pullID>
+        <title>Fix {title}</title>
+        <url>https://github.com/rcbops/rpc-openstack/pull/{pull}</url>
+        <targetBranch>{branch}</targetBranch>
+      </org.jenkinsci.plugins.ghprb.GhprbCause>"""
+UPSTREAM_CAUSE = """<hudson.model.Cause_-UpstreamCause>
+        <upstreamProject>{project}</upstreamProject>
+        <upstreamUrl>job/{project}/</upstreamUrl>
+        <upstreamBuild>{build}</upstreamBuild>
+        <upstreamCauses>{upstream}</upstreamCauses>
+      </hudson.model.Cause_-UpstreamCause>"""
+UNKNOWN_CAUSE = '<hudson.model.Cause_-RemoteCause><addr>10.0.0.1</addr>' \
+                '</hudson.model.Cause_-RemoteCause>'
+
+BRANCHES = ['master', 'newton-14.0', 'mitaka-13.1', 'liberty-12.2']
+RESULTS = ['SUCCESS', 'SUCCESS', 'FAILURE', 'FAILURE', 'ABORTED', 'UNSTABLE']
+
+# Lines that make up most of a log
+NOISE = [
+    'ok: [aio1_nova_api_container-{hex}]\n',
+    'changed: [aio1] => (item={word})\n',
+    'skipping: [aio1]\n',
+    'Collecting {word}==1.{n}.0 (from -r requirements.txt (line {n}))\n',
+    '  Downloading {word}-1.{n}.tar.gz ({n}kB)\n',
+    'Get:{n} http://mirror.rackspace.com/ubuntu xenial/main amd64 {word} '
+    'amd64 1.{n} [{n} kB]\n',
+    'Setting up {word} (1.{n}) ...\n',
+    '{time} | +++ echo {word}\n',
+    '\n',
+]
+
+# Failure snippets, by the density option that controls them
+SNIPPETS = {
+    'traceback': [
+        ['{time} | Traceback (most recent call last):\n',
+         '{time} |   File "/opt/{word}/{word}.py", line {n}, in <module>\n',
+         '{time} |     {word}()\n',
+         '{time} | ValueError: bad {word} {uuid}\n'],
+        ['Traceback (most recent call last):\n',
+         '  File "/usr/lib/python2.7/{word}.py", line {n}, in {word}\n',
+         '    raise KeyError(key)\n',
+         "KeyError: '{word}'\n"],
+    ],
+    'failed': [
+        ['fatal: [aio1_{word}_container-{hex}]: FAILED! => {{"changed": '
+         'false, "msg": "{word} failed on {ip}"}}\n'],
+        ['failed: [aio1] => (item={word}) => {{"failed": true, "rc": 1}}\n'],
+    ],
+    'tempest': [
+        ['{{0}} tempest.api.compute.servers.test_{word}.ServersTest'
+         '.test_{word} [{n}.0s] ... FAILED\n'],
+    ],
+    'ignoring': [
+        ['failed: [aio1] => {{"msg": "{word}"}}\n', '...ignoring\n'],
+    ],
+    'other': [
+        ['Build timed out (after 180 minutes). Marking the build as '
+         'aborted.\n'],
+        ['msg: Task failed as maximum retries was encountered\n'],
+        ['Could not find a version that satisfies the requirement '
+         '{word}==9.{n} (from versions: )\n'],
+        ['W: Failed to fetch http://mirror.rackspace.com/{word} 404\n'],
+        ['CREATE_FAILED  Resource CREATE failed: {word} quota exceeded\n'],
+        ['mysqldump: {word} failed\n', 'HOLLAND_RC=1\n'],
+        ["Build step 'Archive the artifacts' changed build result to "
+         "FAILURE\n"],
+    ],
+}
+
+WORDS = ['nova', 'neutron', 'glance', 'keystone', 'cinder', 'heat', 'swift',
+         'horizon', 'rabbitmq', 'galera', 'memcached', 'elasticsearch',
+         'kibana', 'logstash', 'haproxy', 'utility', 'repo', 'tempest']
+
+
+class LogWriter(object):
+    """Log Writer
+
+    Writes random log lines. densities are failure snippets per thousand
+    lines, by SNIPPETS key. task_density is TASK headers per thousand lines.
+    """
+    def __init__(self, rand, densities, task_density):
+        self.rand = rand
+        self.densities = densities
+        self.task_density = task_density
+        # Filling in every line is slow, noise and headers come from a pool
+        # of filled in lines instead.
+        self.noise = [self.fill(rand.choice(NOISE)) for _ in range(5000)]
+        self.plays = [self.fill('PLAY [Install {word}] ' + '*' * 40 + '\n')
+                      for _ in range(100)]
+        self.tasks = [self.fill('TASK [os_{word} : Install {word} packages] '
+                                + '*' * 40 + '\n')
+                      for _ in range(500)]
+
+    def fill(self, template):
+        rand = self.rand
+        return template.format(
+            hex='{0:08x}'.format(rand.getrandbits(32)),
+            uuid='{0:08x}-{1:04x}-{2:04x}-{3:04x}-{4:012x}'.format(
+                rand.getrandbits(32), rand.getrandbits(16),
+                rand.getrandbits(16), rand.getrandbits(16),
+                rand.getrandbits(48)),
+            ip='172.29.{0}.{1}'.format(rand.randint(0, 255),
+                                       rand.randint(0, 255)),
+            n=rand.randint(1, 999),
+            time=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(
+                rand.randint(1400000000, 1500000000))),
+            word=rand.choice(WORDS))
+
+    def lines(self):
+        rand = self.rand
+        thresholds = []
+        total = self.task_density / 1000.0
+        thresholds.append((total, None))
+        for name, density in sorted(self.densities.items()):
+            total += density / 1000.0
+            thresholds.append((total, name))
+        while True:
+            r = rand.random()
+            for threshold, name in thresholds:
+                if r < threshold:
+                    break
+            else:
+                yield rand.choice(self.noise)
+                continue
+            if name is None:
+                if rand.random() < 0.1:
+                    yield rand.choice(self.plays)
+                yield rand.choice(self.tasks)
+            else:
+                for line in rand.choice(SNIPPETS[name]):
+                    yield self.fill(line)
+
+    def write(self, path, size):
+        with open(path, 'w') as log:
+            written = 0
+            chunk = []
+            for line in self.lines():
+                chunk.append(line)
+                written += len(line)
+                if written >= size:
+                    break
+                if len(chunk) == 10000:
+                    log.write(''.join(chunk))
+                    chunk = []
+            log.write(''.join(chunk))
+            if self.rand.random() < 0.5:
+                log.write('[PostBuildScript] - Execution post build '
+                          'scripts.\n')
+                log.write('Traceback (most recent call last):\n')
+
+
+def makedirs(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+def cause(rand, depth=0):
+    kind = rand.random()
+    if kind < 0.3 and depth < 3:
+        return UPSTREAM_CAUSE.format(
+            project=rand.choice(['RPC-Upgrade-Matrix', 'JJB-RPC-Periodic',
+                                 'RPC-Gate']),
+            build=rand.randint(1, 999),
+            upstream=cause(rand, depth + 1))
+    elif kind < 0.55:
+        return PR_CAUSE.format(pull=rand.randint(1, 2000),
+                               title=rand.choice(WORDS),
+                               branch=rand.choice(BRANCHES))
+    elif kind < 0.85:
+        return TIMER_CAUSE
+    elif kind < 0.95:
+        return USER_CAUSE.format(user=rand.choice(['alice', 'bob']))
+    return UNKNOWN_CAUSE
+
+
+@click.command(help='Write a synthetic jenkins job tree to ROOT')
+@click.argument('root')
+@click.option('--builds', default=100, help='Number of builds')
+@click.option('--jobs', 'job_count', default=4, help='Number of jobs')
+@click.option('--min-size', default=1.0, help='Smallest log, MB')
+@click.option('--max-size', default=5.0, help='Largest log, MB')
+@click.option('--traceback-density', default=0.5,
+              help='Tracebacks per thousand lines')
+@click.option('--failed-density', default=1.0,
+              help='"failed: ... =>" lines per thousand lines')
+@click.option('--tempest-density', default=0.2,
+              help='Tempest failures per thousand lines')
+@click.option('--ignoring-density', default=1.0,
+              help='Ignored failures per thousand lines')
+@click.option('--other-density', default=0.2,
+              help='Other rule matches per thousand lines')
+@click.option('--task-density', default=30.0,
+              help='TASK headers per thousand lines')
+@click.option('--running', default=0.0,
+              help='Fraction of builds that are still running')
+@click.option('--seed', default=0)
+def make_corpus(root, builds, job_count, min_size, max_size,
+                traceback_density, failed_density, tempest_density,
+                ignoring_density, other_density, task_density, running,
+                seed):
+    rand = random.Random(seed)
+    writer = LogWriter(rand, {'traceback': traceback_density,
+                              'failed': failed_density,
+                              'tempest': tempest_density,
+                              'ignoring': ignoring_density,
+                              'other': other_density},
+                       task_density)
+    jobs = ['JJB-RPC-AIO_{branch}-xenial-{btype}-{trigger}'.format(
+        branch=rand.choice(BRANCHES),
+        btype=rand.choice(['full', 'ceph', 'upgrade']),
+        trigger=rand.choice(['periodic', 'pr']))
+        for _ in range(job_count)]
+    now = time.time()
+    for build_num in range(1, builds + 1):
+        build_folder = os.path.join(
+            root, 'jobs', rand.choice(jobs), 'builds', str(build_num))
+        makedirs(os.path.join(build_folder, 'archive', 'artifacts'))
+        result = rand.choice(RESULTS)
+        if rand.random() < running:
+            result = None
+        with open(os.path.join(build_folder, 'build.xml'), 'w') as f:
+            f.write(BUILD_XML.format(
+                causes=rand.choice(CAUSE_CONTAINERS).format(
+                    cause=cause(rand)),
+                build_num=build_num,
+                start_time=int((now - rand.random() * 29 * 86400) * 1000),
+                result='<result>{result}</result>\n  '.format(
+                    result=result) if result else '',
+                duration=rand.randint(600, 18000) * 1000))
+        with open(os.path.join(build_folder, 'injectedEnvVars.txt'),
+                  'w') as f:
+            branch = rand.choice(BRANCHES)
+            f.write('ghprbTargetBranch={branch}\n'
+                    'RPC_RELEASE={branch}\n'
+                    'UPGRADE={upgrade}\n'
+                    'DEPLOY_CEPH={ceph}\n'
+                    'ghprbActualCommit={commit:040x}\n'.format(
+                        branch=branch,
+                        upgrade=rand.choice(['yes', 'no', 'no']),
+                        ceph=rand.choice(['yes', 'no', 'no']),
+                        commit=rand.getrandbits(160)))
+        size = rand.uniform(min_size, max_size) * 2 ** 20
+        writer.write(os.path.join(build_folder, 'log'), size)
+        for name in ['runcmd-bash.log', 'deploy.sh.log']:
+            if result and rand.random() < 0.7:
+                writer.write(
+                    os.path.join(build_folder, 'archive', 'artifacts', name),
+                    size / 10)
+
+
+if __name__ == '__main__':
+    make_corpus()
@@ -2,21 +2,42 @@
 
 # Stdlib import
 import collections
-import copy
 import datetime
+import io
+import itertools
+import json
+import multiprocessing
 import os
-import pickle
-import re
 import sys
+import time
 import traceback
 
 # 3rd Party imports
 import click
-import humanize
 import jinja2
 
 # Project imports
+from aggregates import reported_failures
 from build import Build
+from buildcache import BuildCache
+from buildfinder import find_builds
+from buildfinder import match_build_paths
+from clustering import cluster_failcount
+from histograms import BUCKETS
+from histograms import window
+from logsources import load_log_sources
+from logsources import LOG_SOURCES_FILE
+from profiling import phase
+from profiling import Profile
+from reclassify import changed_rules
+from reclassify import needs_reclassify
+from reclassify import reclassify
+from scanner import load_rules
+from scanner import RULES_FILE
+from shards import build_rows
+from shards import failure_rows
+from shards import periodic_cells
+from shards import ShardWriter
 
 # # Jenkins Build Summary Script
 # This script reads all the build.xml files specified and prints a summary of
@@ -29,198 +50,309 @@ from build import Build
 RETENTION_DAYS = 30
 
 
-class TSF(object):
-    """Total, Success, Failure """
-    def __init__(self, t=0, s=0):
-        self.t = int(t)
-        self.s = int(s)
+def day_shard(day):
+    """Name of the builds table shard of day, a date or ISO date string"""
+    return 'builds-{day}.json'.format(day=day)
 
-    @property
-    def f(self):
-        return self.t - self.s
 
-    @property
-    def s_percent(self):
-        try:
-            return (float(self.s)/float(self.t))*100.0
-        except ZeroDivisionError:
-            return 0
+def write_html(build_cache, output, data_dir, data_url,
+               cluster_threshold=0, bucket='day', profile=None):
+    """Write the summary page of the cached builds to output, a file object
 
-    def success(self):
-        self.t += 1
-        self.s += 1
+    The tables are loaded by the page from JSON shards written to data_dir,
+    data_url is the URL of data_dir relative to the page. See shards.py.
+    Failures at least cluster_threshold similar share a row of the failure
+    table, 0 to keep every failure separate. See clustering.py. The
+    sparklines have a point for each bucket, a name from BUCKETS. Only the
+    builds of days that changed since the shards were last written are
+    read from build_cache.
+    """
+    writer = ShardWriter(data_dir, data_url)
+    days = sorted(build_cache.days(), reverse=True)
+    # Running builds are only cached so that their logs don't need to be
+    # scanned from the start next time.
+    with phase(profile, 'cache_load'):
+        changed = [day for day in days
+                   if day in build_cache.changed_days or
+                   not writer.keep(day_shard(day))]
+        buildobjs = [
+            build._replace(failures=reported_failures(build.failures))
+            for build in build_cache.load_days(changed).values()]
 
-    def failure(self):
-        self.t += 1
+    aggregation_start = time.time()
 
-    def b(self, build):
-        if build.result == "SUCCESS":
-            self.success()
-        else:
-            self.failure()
-
-
-def print_html(buildobjs):
-    buildobjs = buildobjs.values()
-    failcount = collections.defaultdict(dict)
-
-    # remove 'task failed' if 'too many retries' also exists for same task
-    task_failed_re = re.compile('Task Failed: (?P<task>.*)')
-    for build in buildobjs:
-        for failure in copy.copy(build.failures):
-            match = task_failed_re.search(failure)
-            if match and 'Too many retries. PrevTask: {task}'.format(
-                    task=match.groupdict()['task']) in build.failures:
-                build.failures.remove(failure)
-
-    for build in buildobjs:
-        for failure in build.failures:
-            d = failcount[failure]
-            if 'count' not in d:
-                d['count'] = 0
-            d['count'] += 1
-            if 'builds' not in d:
-                d['builds'] = []
-            d['builds'].append(build)
-            if 'oldest' not in d or d['oldest'] > build.timestamp:
-                d['oldest'] = build.timestamp
-                d['oldest_job'] = build.build_num
-                d['oldest_bobj'] = build
-            if 'newest' not in d or d['newest'] < build.timestamp:
-                d['newest'] = build.timestamp
-                d['newest_job'] = build.build_num
-                d['newest_bobj'] = build
-
-    # Organise the builds for each failure into 24hr bins for sparklines
-    histogram_length = RETENTION_DAYS
-    now = datetime.datetime.now()
-    for failure, fdict in failcount.items():
-        fdict['histogram'] = [0] * histogram_length
-        for build in fdict['builds']:
-            age_days = (now - build.timestamp).days
-            if age_days < histogram_length:
-                fdict['histogram'][histogram_length - age_days - 1] += 1
-
-    if 'Unknown Failure' in failcount:
-        del failcount['Unknown Failure']
+    # The failure table, with a bin of the sparklines for each bucket
+    today = datetime.date.today()
+    failcount = build_cache.failcount(today, RETENTION_DAYS, bucket)
 
     # data for periodic build success
-    buildcount = collections.defaultdict(TSF)
-    twodaysago = datetime.datetime.now() - datetime.timedelta(days=2)
-    for build in [b for b in buildobjs if b.timestamp > twodaysago]:
-        buildcount['all'].b(build)
-        buildcount[build.series].b(build)
-        buildcount[build.trigger].b(build)
-        buildcount[build.btype].b(build)
-        buildcount['{series}_{btype}_{trigger}'.format(
-                   series=build.series,
-                   btype=build.btype,
-                   trigger=build.trigger)].b(build)
-    periodichistogram = {}
-    for build in buildobjs:
-        # count aborts as failure for the sake of graphs
-        result = build.result
-        if result == 'ABORTED':
-            result = 'FAILURE'
-        if build.trigger != 'periodic':
-            continue
-        key_base = '{series}_{btype}_{trigger}'.format(
-            series=build.series,
-            btype=build.btype,
-            trigger=build.trigger)
-        key = '{base}_{result}'.format(
-            base=key_base,
-            result=result)
-        stats_key = '{base}_stats'.format(base=key_base)
-        if key not in periodichistogram:
-            periodichistogram[key] = [0] * histogram_length
-            periodichistogram[stats_key] = dict(max=0)
-        age_days = (now - build.timestamp).days
-        if age_days < histogram_length:
-            if result == "SUCCESS":
-                inc = 1
+    buildcount = build_cache.buildcount(today, 2)
+    periodichistogram = build_cache.periodichistogram(
+        today, RETENTION_DAYS, bucket)
+
+    if profile is not None:
+        profile.add_time('aggregation', time.time() - aggregation_start)
+
+    if cluster_threshold:
+        with phase(profile, 'clustering'):
+            failcount = cluster_failcount(failcount, cluster_threshold)
+
+    with phase(profile, 'shard_write'):
+        writer.write('failures.json', dict(data=failure_rows(failcount)))
+        writer.write('periodic.json', periodic_cells(
+            buildcount, periodichistogram,
+            window(today, RETENTION_DAYS, BUCKETS[bucket])[1]))
+        rows = build_rows(buildobjs)
+        for day in sorted(rows, reverse=True):
+            writer.write(day_shard(day), dict(data=rows[day]))
+        writer.finish()
+        shard_urls = dict(
+            failures=writer.url('failures.json'),
+            periodic=writer.url('periodic.json'),
+            builds=[writer.url(day_shard(day)) for day in days])
+
+    with phase(profile, 'template_render'):
+        jenv = jinja2.Environment()
+        template = jenv.from_string(open("buildsummary.j2", "r").read())
+        for chunk in template.generate(
+                shards=shard_urls,
+                bucket=bucket,
+                timestamp=datetime.datetime.now()):
+            output.write(chunk)
+
+
+def parse_build(job):
+    """Create a Build, run by summary in a worker process if --jobs > 1
+
+    job is (key, build_folder, job_name, build_num, rules file, log
+    sources file, cached, excerpt, window, profile), cached is the cached
+    BuildRecord of a build that was still running, its logs are scanned
+    from where that stopped, or of a finished build to reclassify with its
+    cached excerpt, see reclassify.py. window is passed on to Build.
+    profile is True to profile the build. Returns (key, record, excerpt,
+    error, traceback, profile), record is None if parsing failed and
+    excerpt is the new Excerpt of a failed build. Errors are returned
+    rather than raised so that a bad build doesn't stop the pool, and so
+    that they are reported in the same order as builds.
+    """
+    (key, build_folder, job_name, build_num, rules, log_sources, cached,
+     excerpt, window, profile) = job
+    build_profile = Profile() if profile else None
+    try:
+        with phase(build_profile, 'build'):
+            if cached is not None and not cached.building:
+                record = reclassify(build_folder, load_rules(rules), cached,
+                                    build_profile, excerpt,
+                                    load_log_sources(log_sources))
+                excerpt = None
             else:
-                inc = -1
-            periodichistogram[key][histogram_length - age_days - 1] += inc
-            value = abs(
-                periodichistogram[key][histogram_length - age_days - 1])
-            stats = periodichistogram[stats_key]
-            if value > stats['max']:
-                stats['max'] = value
-
-    def dt_filter(date):
-        """Date time filter
-
-        Returns a human readable string for a datetime object.
-        """
-        return '{time} {date}'.format(
-            time=date.strftime('%H:%M'),
-            date=humanize.naturalday(date)
-        )
-
-    jenv = jinja2.Environment()
-    jenv.filters['hdate'] = dt_filter
-    template = jenv.from_string(open("buildsummary.j2", "r").read())
-    print(template.render(
-        buildcount=buildcount,
-        buildobjs=buildobjs,
-        timestamp=datetime.datetime.now(),
-        failcount=failcount,
-        periodichistogram=periodichistogram))
+                build = Build(
+                    build_folder=build_folder,
+                    job_name=job_name,
+                    build_num=build_num,
+                    rules=load_rules(rules),
+                    previous=cached,
+                    profile=build_profile,
+                    window=window,
+                    log_sources=load_log_sources(log_sources))
+                record = build.record()
+                excerpt = build.excerpt
+        return key, record, excerpt, None, None, build_profile
+    except Exception as e:
+        return (key, None, None, e, traceback.format_exc(),
+                build_profile)
 
 
 @click.command(help='args are paths to jenkins build.xml files')
 @click.argument('builds', nargs=-1)
+@click.option('--jobs-root', default=None,
+              help='Also parse the builds of the jobs in this jenkins jobs '
+                   'folder, instead of listing every build.xml')
+@click.option('--job-pattern', 'job_patterns', multiple=True,
+              help='Glob for the names of jobs in --jobs-root, may be '
+                   'given more than once. Default all jobs')
 @click.option('--newerthan', default=0,
-              help='Build IDs older than this will not be shown')
+              help='Build IDs older than this will not be parsed')
 @click.option('--cache', default='/opt/jenkins/www/.cache')
-def summary(builds, newerthan, cache):
+@click.option('--output', default=None,
+              help='Write the summary page to this file rather than stdout')
+@click.option('--data-dir', default='data',
+              help='Folder for the JSON data the page loads, relative to '
+                   'the --output folder, or the current folder')
+@click.option('--rules', default=RULES_FILE,
+              help='yaml or json file of failure rules')
+@click.option('--log-sources', default=LOG_SOURCES_FILE,
+              help='yaml or json file of the logs to scan for each job')
+@click.option('--reclassify', 'reclassify_builds', is_flag=True,
+              help='Find the failures of cached failed builds again, with '
+                   'the rules that changed since they were parsed')
+@click.option('--tail-window', default=0,
+              help='MiB at the end of each log to scan for failures first, '
+                   'the whole log is only scanned if none are found. 0 to '
+                   'always scan whole logs')
+@click.option('--head-window', default=1,
+              help='MiB at the start of each log scanned with '
+                   '--tail-window')
+@click.option('--jobs', default=1,
+              help='Number of processes used to parse uncached builds')
+@click.option('--cluster-threshold', default=0.0,
+              help='Similarity at which failures share a row of the failure '
+                   'table, eg 0.8. Default 0, failures aren\'t grouped')
+@click.option('--bucket', default='day', type=click.Choice(list(BUCKETS)),
+              help='Time each point of the sparklines covers')
+@click.option('--profile', 'profile_file', default=None,
+              help='Write timings for each phase, rule and build to this '
+                   'file as JSON')
+@click.option('--profile-top', default=10,
+              help='Number of slowest builds to include in the profile')
+def summary(builds, jobs_root, job_patterns, newerthan, cache, output,
+            data_dir, rules, log_sources, reclassify_builds, tail_window,
+            head_window,
+            jobs, cluster_threshold, bucket, profile_file, profile_top):
+    profile = Profile() if profile_file else None
+    start = time.time()
 
-    buildobjs = {}
-    if os.path.exists(cache):
+    # Fail early on a bad rules or log sources file rather than once per
+    # build.
+    ruleset = load_rules(rules)
+    load_log_sources(log_sources).check_rules(ruleset)
+    window = None
+    if tail_window:
+        window = (head_window * 2 ** 20, tail_window * 2 ** 20)
+    # and on a missing output folder, rather than after parsing, when the
+    # parsed builds would be lost as the cache isn't committed.
+    output_dir = os.path.dirname(os.path.abspath(output)) if output else '.'
+    if not os.path.isdir(output_dir):
+        raise click.BadParameter(
+            "folder {folder} doesn't exist".format(folder=output_dir),
+            param_hint='--output')
+
+    with phase(profile, 'cache_load'):
         try:
-            with open(cache, 'rb') as f:
-                buildobjs = pickle.load(f)
-        except Exception as e:
-            buildobjs = {}
+            build_cache = BuildCache(cache)
+            # Only what skip_build needs, the BuildRecords of the builds
+            # that are parsed or reclassified are loaded with get.
+            index = build_cache.index()
+        except Exception:
             sys.stderr.write(
                 "Failed to read cache file: {cache}".format(cache=cache))
             traceback.print_exc(file=sys.stderr)
+            if os.path.exists(cache):
+                os.remove(cache)
+            build_cache = BuildCache(cache)
+            index = {}
+
+    # Builds older than this aren't parsed and are removed from the cache.
+    # It is a midnight, so that the summary tables cover whole days.
+    age_limit = datetime.datetime.combine(
+        datetime.date.today() - datetime.timedelta(days=RETENTION_DAYS - 1),
+        datetime.time())
+
+    def skip_build(key, build_num):
+        """Is there no need to parse or reclassify this build?"""
+        cached = index.get(key)
+        return (int(build_num) < newerthan or
+                (cached is not None and not cached.building and
+                 not (reclassify_builds and
+                      needs_reclassify(ruleset, cached))))
+
+    path_matching_start = time.time()
+    found = match_build_paths(builds)
+    if jobs_root:
+        found = itertools.chain(found, find_builds(
+            jobs_root, job_patterns or ['*'], age_limit, skip=skip_build))
+    queued = collections.OrderedDict()
+    for key, build_folder, job_name, build_num in found:
+        if key in queued or skip_build(key, build_num):
+            continue
+        queued[key] = (build_folder, job_name, build_num)
+    previous = build_cache.get(key for key in queued if key in index)
+    todo = []
+    for key, (build_folder, job_name, build_num) in queued.items():
+        cached = previous.get(key)
+        excerpt = None
+        if cached is not None and not cached.building:
+            excerpt = build_cache.excerpt(key)
+        todo.append((key,
+                     build_folder,
+                     job_name,
+                     build_num,
+                     rules,
+                     log_sources,
+                     cached,
+                     excerpt,
+                     window,
+                     profile is not None))
+    if profile is not None:
+        profile.add_time('path_matching', time.time() - path_matching_start)
 
-    for build in builds:
-        path_groups_match = re.search(
-            ('^(?P<build_folder>.*/(?P<job_name>[^/]+)/'
-             'builds/(?P<build_num>[0-9]+))/'), build)
-        if path_groups_match:
-            path_groups = path_groups_match.groupdict()
-            key = "{job_name}_{build_num}".format(
-                job_name=path_groups['job_name'],
-                build_num=path_groups['build_num']
-            )
-            if key in buildobjs:
+    parse_start = time.time()
+    pool = None
+    if jobs > 1 and len(todo) > 1:
+        pool = multiprocessing.Pool(jobs)
+        # imap returns results in the order of todo, whichever worker
+        # finishes first, so output is the same as a serial run.
+        results = pool.imap(parse_build, todo,
+                            chunksize=max(1, len(todo) // (jobs * 4)))
+    else:
+        results = (parse_build(job) for job in todo)
+    for key, build, excerpt, e, tb, build_profile in results:
+        if build_profile is not None:
+            profile.add(build_profile, key)
+        cached = previous.get(key)
+        if build is not None and cached is not None and not cached.building:
+            # Rules that needed logs that are gone are left as they were.
+            _, unscanned = changed_rules(ruleset, build)
+            if unscanned:
+                sys.stderr.write(
+                    "LOGS MISSING: {key} not reclassified with {rules}\n"
+                    .format(key=key, rules=', '.join(sorted(unscanned))))
+            if build == cached:
+                sys.stderr.write("SKIPPED: {key}\n".format(key=key))
                 continue
-            try:
-                buildobjs[key] = Build(
-                    build_folder=path_groups['build_folder'],
-                    job_name=path_groups['job_name'],
-                    build_num=path_groups['build_num'])
-                sys.stderr.write("OK: {key}\n".format(key=key))
-            except Exception as e:
-                sys.stderr.write("FAIL: {key} {e}\n".format(key=key, e=e))
-                traceback.print_exc(file=sys.stderr)
-
-    print_html(buildobjs)
-
-    # Pickle build objs newer than RETENTION_DAYS to the cache file, so those
+            build_cache.reclassify(key, build)
+            sys.stderr.write("RECLASSIFIED: {key}\n".format(key=key))
+        elif build is not None:
+            build_cache.put(key, build, excerpt)
+            sys.stderr.write("OK: {key}\n".format(key=key))
+        else:
+            sys.stderr.write("FAIL: {key} {e}\n".format(key=key, e=e))
+            sys.stderr.write(tb)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if profile is not None:
+        # Wall time, the per build phases add up the time in each worker.
+        profile.add_time('parse_builds', time.time() - parse_start)
+
+    # The page is written next to the output and renamed over it when it
+    # is complete, so the web server never serves half a page. The cache is
+    # only committed after it, so that if writing it fails the builds of
+    # this run, and the days they changed, are parsed again next time.
+    data_path = os.path.join(output_dir, data_dir)
+    data_url = '{path}/'.format(path=os.path.relpath(data_path, output_dir))
+    if output:
+        tmp_output = '{output}.tmp'.format(output=output)
+        with io.open(tmp_output, 'w', encoding='utf-8') as f:
+            write_html(build_cache, f, data_path, data_url,
+                       cluster_threshold, bucket, profile)
+        os.rename(tmp_output, output)
+    else:
+        write_html(build_cache, sys.stdout, data_path, data_url,
+                   cluster_threshold, bucket, profile)
+
+    # Only builds newer than RETENTION_DAYS are kept in the cache, so those
     # logs don't need to be reprocessed on the next run.
-    age_limit = (datetime.datetime.now()
-                 - datetime.timedelta(days=RETENTION_DAYS))
-    cache_dict = {}
-    for key, build in buildobjs.items():
-        if build.timestamp > age_limit:
-            cache_dict[key] = build
-    with open(cache, 'wb') as f:
-        pickle.dump(cache_dict, f, pickle.HIGHEST_PROTOCOL)
+    with phase(profile, 'cache_save'):
+        build_cache.expire(age_limit)
+        build_cache.commit()
+        build_cache.close()
+
+    if profile is not None:
+        profile.add_time('total', time.time() - start)
+        with open(profile_file, 'w') as f:
+            json.dump(profile.report(profile_top), f, indent=2,
+                      sort_keys=True)
 
 if __name__ == '__main__':
     summary()
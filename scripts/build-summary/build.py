@@ -1,50 +1,97 @@
 # Stdlib import
+import collections
+import copy
 import datetime
 import re
 import sys
 
-# 3rd Party imports
-# Imports with C deps
-# remember to install all the apt xml stuff - not just the pip packages.
-from lxml import etree
+# Project imports
+from buildxml import parse_build_xml
+from excerpts import Excerpt
+from logreader import BuildLog
+from logsources import load_log_sources
+from normalise import normalise
+from profiling import phase
+from scanner import load_rules
+from scanner import Scanner
+from scanner import ScanState
+from tracebacks import TracebackReader
 
 
 class FilterException(Exception):
     pass
 
 
+# One step in the chain of causes that triggered a build.
+Cause = collections.namedtuple('Cause', ['name', 'build_num', 'url'])
+
+
+class BuildRecord(collections.namedtuple('BuildRecord', [
+        'result', 'timestamp', 'job_name', 'build_num', 'branch', 'series',
+        'btype', 'trigger', 'build_hierachy', 'failures', 'building',
+        'scan_state', 'failure_rules', 'ruleset', 'origins'])):
+    """Build Record
+
+    What is kept of a Build once it has been parsed, this is what is cached
+    and reported on. build_hierachy is a tuple of Causes, failures is a
+    frozenset and scan_state is only set while the build is running, see
+    Build.scan_logs. failure_rules is a frozenset of (failure, rule name)
+    for the rules that found each failure, '' for failures no rule found,
+    and ruleset is the RuleSet.fingerprints the logs were scanned with, or
+    None if they weren't. See reclassify.py. origins is a frozenset of
+    (failure, logreader.Origin) for where in the logs each failure was
+    first found.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return ("{timestamp} {result} {job_name}/{build_num}"
+                " {branch}").format(
+            timestamp=self.timestamp.isoformat(),
+            job_name=self.job_name,
+            build_num=self.build_num,
+            result=self.result,
+            branch=self.branch)
+
+
+# Records made before failure_rules, ruleset and origins have none of them
+BuildRecord.__new__.__defaults__ = (frozenset(), None, frozenset())
+
+
 class Build(object):
     """Build Object
 
     Represents one RPC-AIO build. Contains functionality for intepreting
-    the build.xml, injected_vars and log files.
+    the build.xml, injected_vars and log files. previous is the
+    BuildRecord of a build that was running when it was last parsed, the
+    logs are scanned from where that left off. See record for the result.
+
+    build_log is scanned instead of the build's logs if given, such as an
+    excerpts.ExcerptLog. Otherwise once a failed build has finished excerpt
+    is the Excerpt of its logs, see excerpts.py, unless a window scan that
+    skipped part of them was enough. window is (head, tail) bytes to scan
+    the logs of a finished build with first, see scan_windows. log_sources
+    is the logsources.LogSources that says which logs are scanned, those
+    in logs.yaml if not given.
     """
-    def __init__(self, build_folder, job_name, build_num):
+    def __init__(self, build_folder, job_name, build_num, rules=None,
+                 previous=None, profile=None, build_log=None, window=None,
+                 log_sources=None):
         self.build_start = datetime.datetime.now()
-        self.stdlib_path_re = re.compile(
-            "/usr/lib/python[0-9]*.[0-9]*/[^ /]*\.pyc?")
-        self.uuid_re = re.compile("([0-9a-zA-Z]+-){4}[0-9a-zA-Z]+")
-        self.ip_re = re.compile("([0-9]+\.){3}[0-9]+")
-        self.colour_code_re = re.compile('(\[8mha:.*)?\[0m')
-        self.maas_tx_id_re = re.compile('\S*k1k.me\S*')
-        self.maas_entity_uri_re = re.compile(
-            '/\d+/entities(/[^/]*)?|/\d+/agent_tokens')
-        self.maas_httpd_tx_id_re = re.compile("'httpdTxnId': '[^']*'")
-        self.ansible_tmp_re = re.compile('ansible-tmp-[^/]*')
-        self.tree = etree.parse('{bf}/build.xml'.format(
-            bf=build_folder,
-            job_name=job_name,
-            build_num=build_num))
-        self.result = self.tree.find('./result').text
-        # jenkins uses miliseconds not seconds
-        self.timestamp = datetime.datetime.fromtimestamp(
-            float(self.tree.find('startTime').text)/1000)
         self.build_folder = build_folder
         self.job_name = job_name
         self.build_num = build_num
+        self.profile = profile
+        self.build_log = build_log
+        self.log_sources = log_sources or load_log_sources()
+        self.window = window
+        self.excerpt = None
+        with phase(profile, 'xml_parse'):
+            build_xml = self.read_build_xml()
         self.env_file = '{build_folder}/injectedEnvVars.txt'.format(
             build_folder=self.build_folder)
-        self.env_vars = self.read_env_file(self.env_file)
+        with phase(profile, 'env_parse'):
+            self.env_vars = self.read_env_file(self.env_file)
         self.raw_branch = self.env_vars.get('ghprbTargetBranch', '')
         if self.raw_branch == '':
             self.raw_branch = self.env_vars.get('RPC_RELEASE', '')
@@ -59,10 +106,37 @@ class Build(object):
             self.btype = 'multinode'
         else:
             self.btype = 'full'
-        self.get_parent_info()
+        with phase(profile, 'xml_parse'):
+            self.get_parent_info(build_xml.cause)
         self.failures = set()
+        self.failure_rules = set()
+        self.origins = {}
+        self.ruleset = None
+        self.scan_state = None
         if self.result != 'SUCCESS':
-            self.get_failure_info()
+            if previous is not None and previous.scan_state is not None:
+                self.failures = set(previous.failures)
+                self.failure_rules = set(previous.failure_rules)
+                self.origins = dict(previous.origins)
+                self.ruleset = previous.ruleset
+                # Copied as the scanner updates it, records don't change.
+                self.scan_state = copy.deepcopy(previous.scan_state)
+            self.get_failure_info(rules or load_rules())
+
+    def read_build_xml(self):
+        build_xml = parse_build_xml(
+            '{bf}/build.xml'.format(bf=self.build_folder))
+        # jenkins doesn't record a result until the build has finished
+        self.building = build_xml.result is None
+        self.result = build_xml.result
+        # jenkins uses miliseconds not seconds
+        self.timestamp = datetime.datetime.fromtimestamp(
+            float(build_xml.start_time)/1000)
+        self.duration = None
+        if build_xml.duration is not None:
+            self.duration = datetime.timedelta(
+                milliseconds=int(build_xml.duration))
+        return build_xml
 
     def normalise_failure(self, failure_string):
         """Remove identifiers from failures
@@ -70,25 +144,20 @@ class Build(object):
         This prevents multiple incidents of the same failure being counted as
         multiple failures
         """
+        return normalise(failure_string)
 
-        normalisers = [
-            (self.uuid_re, '**UUID**'),
-            (self.ip_re, '**IPv4**'),
-            (self.colour_code_re, ''),
-            (self.maas_tx_id_re, '**TX_ID**'),
-            (self.maas_entity_uri_re, '**Entity**'),
-            (self.maas_httpd_tx_id_re,
-                '**HTTP_TX_ID**'),
-            (self.ansible_tmp_re, 'ansible-tmp-**Removed**')
-        ]
-
-        for pattern, sub in normalisers:
-            failure_string = pattern.sub(sub, failure_string)
+    def add_failure(self, failure, rule='', origin=None):
+        """Add a failure to the build
 
-        return failure_string
-
-    def add_failure(self, failure):
-        self.failures.add(self.normalise_failure(failure))
+        rule is the name of the rule that found it and origin the
+        logreader.Origin of the line it was found on. Only the origin of
+        the first time a failure is found is kept.
+        """
+        failure = self.normalise_failure(failure)
+        self.failures.add(failure)
+        self.failure_rules.add((failure, rule))
+        if origin is not None:
+            self.origins.setdefault(failure, origin)
 
     def read_env_file(self, path):
         kvs = {}
@@ -100,12 +169,10 @@ class Build(object):
                 kvs[line[0].strip()] = line[1].strip()
         return kvs
 
-    def get_parent_info(self):
+    def get_parent_info(self, cause_elem):
         jenkins_base = "http://jenkins.propter.net/"
         self.trigger = "periodic"
         self.build_hierachy = []
-        cause_elem = self.tree.xpath(
-            '//causes | //causeBag/entry')[0].getchildren()[0]
 
         def normalise_job_name(name):
             # ensure that long names can be wrapped by inserting spaces
@@ -181,504 +248,157 @@ class Build(object):
                 job=self.job_name,
                 build_num=self.build_num)))
 
-    def get_failure_info(self):
-        def open_log(filename):
-            log_file = '{build_folder}/{filename}'.format(
-                build_folder=self.build_folder,
-                filename=filename)
-            lines = []
-            try:
-                with open(log_file, 'r') as f:
-                    lines = f.readlines()
-            except IOError:
-                return []
-
-            try:
-                post_build = lines.index(
-                    '[PostBuildScript] - Execution post build scripts.\n')
-                return lines[0: post_build]
-            except ValueError:
-                return lines
-
-        lines = []
-        lines += open_log('log')
-        lines += open_log('archive/artifacts/runcmd-bash.log')
-        lines += open_log('archive/artifacts/deploy.sh.log')
-
-        filters = [
-            # Generic Failures
-            self.timeout,
-            self.ssh_fail,
-            self.too_many_retries,
-            self.ansible_task_fail,
-            self.tempest_test_fail,
-            self.traceback,
-            self.cannot_find_role,
-            self.invalid_ansible_param,
-            self.jenkins_exception,
-            self.pip_cannot_find,
-
-            # Specific Failures
-            self.service_unavailable,
-            self.rebase_fail,
-            self.rsync_fail,
-            self.elasticsearch_plugin_install,
-            self.tempest_filter_fail,
-            self.tempest_testlist_fail,
-            self.compile_fail,
-            self.apt_fail,
-            self.holland_fail,
-            self.slave_died,
-            self.cirros_dhcp,
-            self.cirros_sshd,
-
-            # Heat related failures
-            self.create_fail,
-            self.archive_fail,
-            self.rate_limit
-        ]
-        timings = {}
-        if self.result in ['ABORTED', 'FAILURE']:
-            for lfilter in filters:
-                start_time = datetime.datetime.now()
-                lfilter(lines)
-                end_time = datetime.datetime.now()
-                delta = end_time - start_time
-                timings[lfilter] = delta
+    def get_failure_info(self, rules):
+        if self.building or self.result in ['ABORTED', 'FAILURE']:
+            self.scan_logs(rules)
+        else:
+            self.failures = set()
+            self.failure_rules = set()
+            self.origins = {}
+            self.scan_state = None
         fail_end = datetime.datetime.now()
         total_duration = fail_end - self.build_start
         if total_duration > datetime.timedelta(seconds=5):
             sys.stderr.write("Slow Job. {total_duration}\n".format(
                 total_duration=total_duration))
-            for lfilter, duration in timings.items():
-                if duration > datetime.timedelta(seconds=1):
-                    sys.stderr.write("    {lfilter}: {duration}\n".format(
-                        lfilter=lfilter.func_name,
-                        duration=duration
-                    ))
 
         if not self.failures:
             self.add_failure("Unknown Failure")
 
-    def holland_fail(self, lines):
-        match_re = re.compile("HOLLAND_RC=1")
-        for i, line in enumerate(lines):
-            match = match_re.search(line)
-            if match:
-                fail = lines[i-1]
-                self.add_failure("Holland failure: {fail}".format(
-                                 fail=fail))
-
-    def pip_cannot_find(self, lines):
-        match_re = re.compile("Could not find a version that satisfies "
-                              "the requirement ([^ ]*)")
-        for i, line in enumerate(lines):
-            match = match_re.search(line)
-            if match:
-                if not self.failure_ignored(i, lines):
-                    self.add_failure("Can't find pip package: {fail}".format(
-                                     fail=match.group(1)))
-
-    def apt_fail(self, lines):
-        match_re = re.compile(".: Failed to fetch (.*)")
-        for line in lines:
-            match = match_re.search(line)
-            if match:
-                self.add_failure("Apt Fetch Fail: {fail}".format(
-                                 fail=match.group(1)))
-                break
+    def logs(self):
+        """The logsources.Logs of this build, in the order they are scanned"""
+        return self.log_sources.logs(self.build_folder, self.job_name,
+                                     self.btype)
 
-    def compile_fail(self, lines):
-        match_re = re.compile("fatal error:(.*)")
-        for line in lines:
-            match = match_re.search(line)
-            if match:
-                self.add_failure("gcc fail: {fail}".format(
-                                 fail=match.group(1)))
-
-    def tempest_filter_fail(self, lines):
-        match_re = re.compile("'Filter (.*) failed\.")
-        for line in lines:
-            match = match_re.search(line)
-            if match:
-                self.add_failure("Openstack Tempest Gate test "
-                                 "set filter {fail} failed.".format(
-                                     fail=match.group(1)))
-
-    def tempest_testlist_fail(self, lines):
-        match_re = re.compile("exit_msg 'Failed to generate test list'")
-        for line in lines:
-            match = match_re.search(line)
-            if match:
-                self.add_failure("Openstack Tempest Gate: "
-                                 "failed to generate test list")
-
-    def jenkins_exception(self, lines):
-        match_re = re.compile("hudson\.[^ ]*Exception.*")
-        for line in lines:
-            match = match_re.search(line)
-            if match:
-                self.add_failure(match.group())
-
-    def invalid_ansible_param(self, lines):
-        match_re = re.compile("ERROR:.*is not a legal parameter in an "
-                              "Ansible task or handler")
-        for line in lines:
-            match = match_re.search(line)
-            if match:
-                self.add_failure(match.group())
-
-    def rate_limit(self, lines):
-        match_re = re.compile("Rate limit has been reached.")
-        for i, line in enumerate(lines):
-            match = match_re.search(line)
-            if match:
-                self.add_failure('Rate limit has been reached.')
-
-    def archive_fail(self, lines):
-        match_re = re.compile(
-            "Build step 'Archive the artifacts' "
-            "changed build result to FAILURE")
-        for i, line in enumerate(lines):
-            match = match_re.search(line)
-            if match:
-                self.add_failure('Failed on archiving artifacts')
-
-    def create_fail(self, lines):
-        match_re = re.compile(
-            'CREATE_FAILED  Resource CREATE failed:(?P<error>.*)$')
-        for i, line in enumerate(lines):
-            match = match_re.search(line)
-            if match:
-                self.add_failure('Heat Resource Fail: {error}'.format(
-                    error=match.groupdict()['error']))
-
-    def ansible_task_fail(self, lines):
-        match_re = re.compile('(fatal|failed):.*=>')
-        for i, line in enumerate(lines):
-            match = match_re.search(line)
-            if match:
-                previous_task = self.get_previous_task(i, lines)
-                if not self.failure_ignored(i, lines):
-                    self.add_failure('Task Failed: {task}'.format(
-                        task=previous_task))
-
-    def setup_tools_sql_alchemy(self, lines):
-        match_str = ("error in SQLAlchemy-Utils setup command: "
-                     "'extras_require' must be a dictionary")
-        for i, line in enumerate(lines):
-            if match_str in line:
-                previous_task = self.get_previous_task(i, lines)
-                self.add_failure(
-                    "Setup Tools / SQL Alchemy Fail. PrevTask: {task}".format(
-                        task=previous_task))
-                break
-
-    def maas_alarm(self, lines):
-        match_str = 'Checks and Alarms with failures:'
-        for i, line in enumerate(lines):
-            if match_str in line:
-                previous_task = self.get_previous_task(i, lines)
-                self.add_failure(
-                    "Maas Alarm in alert state. PrevTask: {task}".format(
-                        task=previous_task))
-                break
+    def scan_logs(self, rules):
+        """Scan the logs, from where the last scan stopped if possible
 
-    def dpkg_locked(self, lines):
-        match_str = 'dpkg status database is locked by another process'
-        alt_match_str = 'Could not get lock /var/lib/dpkg/lock'
-        for i, line in enumerate(lines):
-            if match_str in line or alt_match_str in line:
-                previous_task = self.get_previous_task(i, lines)
-                self.add_failure(
-                    "dpkg locked. PrevTask: {task}".format(
-                        task=previous_task))
-                break
-
-    def ceilometer_user_not_found(self, lines):
-        match_str = 'user [ ceilometer ] was not found'
-        for i, line in enumerate(lines):
-            if match_str in line:
-                previous_task = self.get_previous_task(i, lines)
-                self.add_failure(
-                    "user ceilometer not found. PrevTask: {task}".format(
-                        task=previous_task))
-                break
-
-    def cannot_find_role(self, lines):
-        match_str = 'cannot find role in'
-        for i, line in enumerate(lines):
-            if match_str in line:
-                previous_task = self.get_previous_task(i, lines)
-                self.add_failure(
-                    "Cannot find role. PrevTask: {task}".format(
-                        task=previous_task))
-                break
-
-    def secgroup_in_use(self, lines):
-        match_re = re.compile('Security Group [^ ]* in use')
-        for i, line in enumerate(lines):
-            match = match_re.search(line)
-            if match:
-                self.add_failure('Nova/Neutron Error: '
-                                 'Security Group ... in use')
-                break
-
-    def tempest_test_fail(self, lines):
-        match_re = re.compile('\{0\} (?P<test>tempest[^ ]*).*\.\.\. FAILED')
-        for i, line in enumerate(lines):
-            match = match_re.search(line)
-            if match:
-                test = match.groupdict()['test']
-                self.add_failure('Tempest Test Failed: {test}'.format(
-                    test=test))
-
-    def traceback(self, lines):
-        start_re = re.compile(
-            r'^(?P<prefix>.*)Traceback \(most recent call last\)')
-        exc_re = re.compile(r'^\S')
-        MAX_TB_LINES = 100
-
-        def normalise(line, prefix):
-            # prefixes may contain re specials such as [
-            # which need to be escaped.
-            escaped_prefix = re.escape(prefix)
-            # prefixes may also contain timestamps that need to be generalised
-            timestamped_prefix = re.sub('\d+', '\d+', escaped_prefix)
-            return re.sub('^' + timestamped_prefix, '', line)
-
-        skip_count = 0
-        for i, line in enumerate(lines):
-            if skip_count > 0:
-                skip_count -= 1
-                continue
-            match = start_re.search(line)
-            if not match or self.failure_ignored(i, lines):
-                continue
-            groups = match.groupdict()
-            prefix = groups['prefix']
-            # This inner loop is for reading each frame of the stack trace
-            j = 0
-            while True:
-                j += 1
-                line = normalise(lines[i+j], prefix)
-                # Hard to find the last line of a Traceback
-                # it may not even contain a :
-                exc_match = exc_re.match(line)
-                if exc_match:
-                    exc_type, _, exc_msg = line.partition(': ')
-                    skip_count = j
-                    break
-                elif j > MAX_TB_LINES:
-                    raise FilterException("Failed to find end of trace"
-                                          " {job}_{build}:{l}"
-                                          .format(
-                                              job=self.job_name,
-                                              build=self.build_num,
-                                              l=i))
-                else:
-                    continue
-
-            prev = self.get_previous_task(i, lines)
-            failure_string = (
-                "Traceback. {exc_type}: {exc_msg} Previous Task {prev}"
-                .format(
-                    exc_type=exc_type.strip(),
-                    exc_msg=exc_msg.strip(),
-                    prev=prev
-                )
-            )
-            self.add_failure(failure_string)
-
-    def elasticsearch_plugin_install(self, lines):
-        match_str = 'failed to download out of all possible locations...'
-        for i, line in enumerate(lines):
-            if match_str in line:
-                previous_task = self.get_previous_task(i, lines)
-                self.add_failure(
-                    "Elasticsearch Plugin Install Fail. "
-                    "PrevTask: {task}".format(
-                        task=previous_task))
-                break
-
-    def deploy_rc(self, lines):
-        match_re = re.compile("DEPLOY_RC=[123456789]")
-        remove_colour = re.compile('ha:[^ ]+AAA=+')
-        for i, line in enumerate(lines):
-            if match_re.search(line):
-                beforecontext = lines[i-1:i-4:-1]
-                for j, cline in enumerate(beforecontext):
-                    beforecontext[j] = remove_colour.sub('', cline)
-                self.add_failure("Unkown:" + " ".join(beforecontext))
-                break
-
-    def rsync_fail(self, lines):
-        match_re = re.compile('failed:.*rsync -avzlHAX')
-        for i, line in enumerate(lines):
-            if match_re.search(line):
-                previous_task = self.get_previous_task(i, lines)
-                self.add_failure(
-                    'Failure Running Rsync. PrevTask: {task}'.format(
-                        task=previous_task))
-                break
-
-    def ssh_fail(self, lines):
-        match_str = ("SSH Error: data could not be sent to the remote host. "
-                     "Make sure this host can be reached over ssh")
-        for line in lines:
-            if match_str in line:
-                self.add_failure(match_str.strip())
-                break
-
-    def rebase_fail(self, lines):
-        match_str = "Rebase failed, quitting\n"
+        While the build is running only complete lines are scanned and the
+        scanner state is kept, so the next parse can carry on from it, if
+        the rules haven't changed since. A finished build with a window
+        may only have its windows scanned, see scan_windows.
+        """
+        state = self.scan_state
+        build_log = self.build_log
+        if build_log is None:
+            logs = self.logs()
+            build_log = BuildLog(
+                [log.path for log in logs],
+                complete_lines=self.building,
+                scanned=state.ends if state else None,
+                names=[log.name for log in logs],
+                rules=[log.rules for log in logs])
+        with phase(self.profile, 'log_read'):
+            build_log.open()
         try:
-            lines.index(match_str)
-            self.add_failure("Merge Conflict: " + match_str.strip())
-        except ValueError:
-            return
-
-    def too_many_retries(self, lines):
-        match_str = 'msg: Task failed as maximum retries was encountered'
-        for i, line in enumerate(lines):
-            if match_str in line and '...ignoring' not in lines[i+1]:
-                previous_task = self.get_previous_task(i, lines)
-                self.add_failure(
-                    "Too many retries. PrevTask: {task}".format(
-                        task=previous_task))
-
-    def get_previous_task(self, line, lines, order=-1, get_line_num=False):
-        previous_task_re = re.compile(
-            'TASK:? \[((?P<role>.*)\|)?(?P<task>.*)\]')
-        previous_play_re = re.compile(
-            'PLAY \[(?P<play>.*)\]')
-        task_match = None
-        play_match = None
-        if order == -1:
-            end = 0
-        else:
-            end = len(lines)
-        for index in range(line, end, order):
-            if not task_match:
-                task_match = previous_task_re.search(lines[index])
-            if task_match and get_line_num:
-                return index
-            play_match = previous_play_re.search(lines[index])
-            if task_match and play_match:
-                task_groups = task_match.groupdict()
-                play_groups = play_match.groupdict()
-                # If we match the last task to be executed
-                # chances are the failure happened post-ansible,
-                # so the last task indicator isn't that useful.
-                if (task_groups['task'].strip()
-                        == 'Deploy RPC HAProxy configuration files'):
-                    return 'N/A'
-                if 'role' in task_groups and task_groups['role']:
-                    return '{play} / {role} / {task}'.format(
-                        role=task_groups['role'],
-                        play=play_groups['play'],
-                        task=task_groups['task'])
-                else:
-                    return '{play} / {task}'.format(
-                        play=play_groups['play'],
-                        task=task_groups['task'])
-
-        return ""
-
-    def failure_ignored(self, fail_line, lines):
-        next_task_line = self.get_previous_task(fail_line,
-                                                lines,
-                                                order=1,
-                                                get_line_num=True)
-
-        if next_task_line == "":
-            return False
-
-        for line in lines[fail_line:next_task_line]:
-            if '...ignoring' in line:
-                return True
-        return False
-
-    def service_unavailable(self, lines):
-        match_str = ('ERROR: Service Unavailable (HTTP 503)')
-        for i, line in enumerate(lines):
-            if match_str in line:
-                fail_line = i
+            if (state is None or self.ruleset != rules.fingerprints or
+                    not state.resumable(build_log)):
+                state = None
+                self.failures = set()
+                self.failure_rules = set()
+                self.origins = {}
+            self.failures.discard("Unknown Failure")
+            self.failure_rules.discard(("Unknown Failure", ''))
+            windowed = None
+            if (state is None and self.window and not self.building and
+                    self.build_log is None):
+                windowed = self.scan_windows(rules, build_log)
+            if windowed is not None:
+                state = windowed
+            else:
+                if state is None:
+                    state = ScanState()
+                    if self.build_log is None:
+                        state.excerpt = Excerpt(rules.literal_context)
+                with phase(self.profile, 'log_scan'):
+                    Scanner(rules, self, state, self.profile).scan(
+                        build_log, final=not self.building)
+        finally:
+            build_log.close()
+        self.scan_state = state if self.building else None
+        if not self.building:
+            self.excerpt = state.excerpt
+        self.ruleset = rules.fingerprints
+
+    def scan_windows(self, rules, build_log):
+        """Scan the head and tail windows of the logs
+
+        Returns the ScanState if that is enough. Failures are nearly always
+        near the end of a log, so most builds only need their windows
+        scanned. If the windows cover the whole of every log the scan was a
+        full one, and its Excerpt is kept. Otherwise no Excerpt is kept,
+        and if nothing was found, or a full_scan rule matched, the failures
+        found are dropped, the logs are opened again for a full scan and
+        None is returned.
+        """
+        state = ScanState()
+        state.excerpt = Excerpt(rules.literal_context)
+        scanner = Scanner(rules, self, state, self.profile,
+                          window=self.window)
+        with phase(self.profile, 'log_scan'):
+            scanner.scan(build_log)
+        if not scanner.skipped:
+            return state
+        if self.failures and not scanner.full_scan_hits:
+            state.excerpt = None
+            return state
+        self.failures = set()
+        self.failure_rules = set()
+        self.origins = {}
+        build_log.close()
+        with phase(self.profile, 'log_read'):
+            build_log.open()
+        return None
+
+    # Handlers for rules that need more than a message, see rules.yaml. Each
+    # is called by the Scanner with a scanner.Hit for the matching line.
+
+    def traceback(self, hit):
+        reader = TracebackReader(hit.match.group('prefix'))
+        # Read each frame of the stack trace until the exception
+        for line in hit.after:
+            if reader.feed(line):
+                exc_type, exc_msg = reader.exc_type, reader.exc_msg
                 break
         else:
-            # didn't find a match
-            return
-        previous_task = self.get_previous_task(fail_line, lines)
-        self.add_failure(
-            'Service Unavailable 503. PrevTask: {previous_task}'.format(
-                previous_task=previous_task))
-
-    def timeout(self, lines):
-        match_re = ('Build timed out \(after [0-9]* minutes\). '
-                    'Marking the build as aborted.')
-        pattern = re.compile(match_re)
-        for i, line in enumerate(lines):
-            if pattern.search(line):
-                previous_task = self.get_previous_task(i, lines)
-                self.add_failure(
-                    'Build Timeout: {previous_task}'.format(
-                        previous_task=previous_task))
-                break
-
-    def apt_mirror_fail(self, lines):
-        match_str = ("WARNING: The following packages cannot be "
-                     "authenticated!\n")
-        try:
-            i = lines.index(match_str)
-            previous_task = self.get_previous_task(i, lines)
-            self.add_failure("Apt Mirror Fail: {line} {task}".format(
-                line=match_str.strip(),
-                task=previous_task))
-        except ValueError:
-            return
-
-    def glance_504(self, lines):
-        match_str = ("glanceclient.exc.HTTPException: 504 Gateway Time-out: "
-                     "The server didn't respond in time. (HTTP N/A)\n")
-        try:
-            lines.index(match_str)
-            self.add_failure("Cirros upload fail: " + match_str.strip())
-        except ValueError:
-            return
-
-    def slave_died(self, lines):
-        match_re = ('Agent went offline during the build')
-        pattern = re.compile(match_re)
-        for i, line in enumerate(lines):
-            if pattern.search(line):
-                previous_task = self.get_previous_task(i, lines)
-                self.add_failure(
-                    'Slave Died / Agent went offline during the build: '
-                    '{previous_task}'.format(
-                        previous_task=previous_task))
-                break
-
-    def cirros_dhcp(self, lines):
-        match_re = ('No lease, failing')
-        pattern = re.compile(match_re)
-        for i, line in enumerate(lines):
-            if pattern.search(line):
-                self.add_failure('Cirros DHCP address acquisition fail')
-                break
-
-    def cirros_sshd(self, lines):
-        match_re = ('Starting dropbear sshd: FAIL')
-        pattern = re.compile(match_re)
-        for i, line in enumerate(lines):
-            if pattern.search(line):
-                self.add_failure('Cirros SSHd failed to start')
-                break
-
-    def __str__(self):
-        return ("{timestamp} {result} {job_name}/{build_num}"
-                " {branch}").format(
-            timestamp=self.timestamp.isoformat(),
+            # The trace was cut short, report where it had got to rather
+            # than losing the rest of the build's failures.
+            exc_type = 'Truncated'
+            exc_msg = reader.last_frame
+
+        self.add_failure(hit.rule.format(
+            hit,
+            exc_type=exc_type,
+            exc_msg=exc_msg), hit.rule.name, hit.origin)
+        # Don't look for another trace in the lines of this one.
+        return reader.lines
+
+    def deploy_rc(self, hit):
+        remove_colour = re.compile('ha:[^ ]+AAA=+')
+        beforecontext = list(reversed(hit.before))
+        for j, cline in enumerate(beforecontext):
+            beforecontext[j] = remove_colour.sub('', cline)
+        self.add_failure(hit.rule.format(
+            hit, context=" ".join(beforecontext)), hit.rule.name, hit.origin)
+
+    def record(self):
+        return BuildRecord(
+            result=self.result,
+            timestamp=self.timestamp,
             job_name=self.job_name,
             build_num=self.build_num,
-            result=self.result,
-            branch=self.branch)
+            branch=self.branch,
+            series=self.series,
+            btype=self.btype,
+            trigger=self.trigger,
+            build_hierachy=tuple(
+                Cause(**cause) for cause in self.build_hierachy),
+            failures=frozenset(self.failures),
+            building=self.building,
+            scan_state=self.scan_state,
+            failure_rules=frozenset(self.failure_rules),
+            ruleset=self.ruleset,
+            origins=frozenset(self.origins.items()))
+
+    def __str__(self):
+        return str(self.record())
@@ -0,0 +1,688 @@
+# Stdlib import
+import collections
+import datetime
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import traceback
+try:
+    from urllib.request import pathname2url
+except ImportError:
+    from urllib import pathname2url
+
+# Project imports
+from aggregates import build_names
+from aggregates import BuildRef
+from aggregates import hour_of
+from aggregates import hour_start
+from aggregates import periodic_key
+from aggregates import reported_failures
+from aggregates import TSF
+from build import BuildRecord
+from build import Cause
+from excerpts import Excerpt
+from logreader import Origin
+from histograms import bucket_sums
+from histograms import BUCKETS
+from histograms import window
+
+# Bump when the schema or anything pickled into it changes, an older cache
+# is emptied and every build is parsed again.
+SCHEMA_VERSION = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    result TEXT,
+    timestamp INTEGER NOT NULL,
+    job_name TEXT NOT NULL,
+    build_num TEXT NOT NULL,
+    branch TEXT,
+    series TEXT,
+    btype TEXT,
+    trigger TEXT,
+    building INTEGER NOT NULL,
+    scan_state BLOB,
+    ruleset_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS builds_timestamp ON builds (timestamp);
+CREATE INDEX IF NOT EXISTS builds_branch ON builds (branch);
+CREATE INDEX IF NOT EXISTS builds_result ON builds (result);
+CREATE INDEX IF NOT EXISTS builds_series ON builds (series);
+CREATE INDEX IF NOT EXISTS builds_btype ON builds (btype);
+CREATE INDEX IF NOT EXISTS builds_trigger ON builds (trigger);
+CREATE INDEX IF NOT EXISTS builds_job_name ON builds (job_name);
+CREATE TABLE IF NOT EXISTS failures (
+    id INTEGER PRIMARY KEY,
+    failure TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS build_failures (
+    build_id INTEGER NOT NULL,
+    failure_id INTEGER NOT NULL,
+    rules TEXT NOT NULL,
+    reported INTEGER NOT NULL,
+    source TEXT,
+    line INTEGER,
+    offset INTEGER,
+    PRIMARY KEY (build_id, failure_id)
+);
+CREATE INDEX IF NOT EXISTS build_failures_failure
+    ON build_failures (failure_id);
+CREATE TABLE IF NOT EXISTS rulesets (
+    id INTEGER PRIMARY KEY,
+    fingerprints TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS excerpts (
+    build_id INTEGER PRIMARY KEY,
+    excerpt BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hierarchy (
+    build_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    build_num TEXT,
+    url TEXT,
+    PRIMARY KEY (build_id, position)
+);
+CREATE TABLE IF NOT EXISTS failure_hours (
+    failure_id INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    oldest_build INTEGER NOT NULL,
+    newest_build INTEGER NOT NULL,
+    PRIMARY KEY (failure_id, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS build_hours (
+    name TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    successes INTEGER NOT NULL,
+    PRIMARY KEY (name, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS periodic_hours (
+    name TEXT NOT NULL,
+    result TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (name, result, hour)
+) WITHOUT ROWID;
+"""
+
+# Counters for each hour, see add_to_aggregates
+AGGREGATE_TABLES = ['failure_hours', 'build_hours', 'periodic_hours']
+# Tables of older schema versions, dropped along with the current ones
+OLD_TABLES = ['failure_days', 'build_days', 'periodic_days']
+
+BUILD_COLUMNS = ['key', 'result', 'timestamp', 'job_name', 'build_num',
+                 'branch', 'series', 'btype', 'trigger', 'building',
+                 'scan_state']
+# Columns that don't sort as their stored text does. Build numbers are
+# kept as jenkins names them, but 10 comes after 9.
+SORT_KEYS = {'build_num': 'CAST(build_num AS INTEGER)'}
+
+# What the summary needs to know of a cached build to decide whether to
+# parse or reclassify it, see BuildCache.index.
+CachedBuild = collections.namedtuple('CachedBuild',
+                                     ['building', 'result', 'ruleset'])
+
+# Most keys looked up by one query, SQLite's limit on parameters is 999.
+MAX_PARAMS = 500
+
+# Timestamps are naive local datetimes, stored as integer microseconds
+# from this so that they come back exactly as they went in.
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_micros(timestamp):
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + \
+        delta.microseconds
+
+
+def from_micros(micros):
+    return EPOCH + datetime.timedelta(microseconds=micros)
+
+
+def is_sqlite(path):
+    with open(path, 'rb') as f:
+        return f.read(16) == b'SQLite format 3\x00'
+
+
+def read_pickle_cache(path):
+    """BuildRecords from a cache written before BuildCache, if it is one
+
+    The pickle is removed either way so that the database can take its
+    place. Caches from before BuildRecord hold Build objects, those builds
+    are parsed again.
+    """
+    records = {}
+    try:
+        with open(path, 'rb') as f:
+            records = dict((key, build)
+                           for key, build in pickle.load(f).items()
+                           if isinstance(build, BuildRecord))
+    except Exception:
+        sys.stderr.write(
+            "Failed to read cache file: {cache}".format(cache=path))
+        traceback.print_exc(file=sys.stderr)
+    os.remove(path)
+    return records
+
+
+class BuildCache(object):
+    """Build Cache
+
+    BuildRecords kept between runs in a SQLite database, keyed by
+    "{job_name}_{build_num}". Builds, failures and the cause hierarchy of
+    each build are separate tables, indexed so that builds can be found by
+    time, branch, result or failure without loading the rest. Each failure
+    of a build has the names of the rules that found it and the Origin
+    where it was first found, and each build the id of the rule
+    fingerprints it was scanned with, see reclassify.py. A
+    run only writes the builds it parsed or reclassified and deletes builds
+    by age, see put, reclassify and expire. Nothing is written until
+    commit. The excerpts of failed builds are kept compressed, apart from
+    the records, see excerpts.py.
+
+    A cache opened readonly is never created, converted or emptied, a
+    missing cache or one of another SCHEMA_VERSION is a ValueError.
+
+    The summary tables are kept up to date as builds are added too, as
+    counts for each hour, the local hour a build started. Reading them,
+    see failcount, buildcount and periodichistogram, doesn't need a pass
+    over every build, and their histograms can be of hours, days or weeks.
+    """
+    def __init__(self, path, readonly=False):
+        self.path = path
+        # Days, as dates, that finished builds were put or reclassified on
+        # since the cache was opened. The builds of other days are as they
+        # were when the cache was last committed.
+        self.changed_days = set()
+        if readonly:
+            self.open_readonly(path)
+            return
+        legacy = {}
+        if os.path.exists(path) and not is_sqlite(path):
+            legacy = read_pickle_cache(path)
+        self.db = sqlite3.connect(path)
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            for table in ['builds', 'failures', 'build_failures',
+                          'rulesets', 'excerpts', 'hierarchy'] + \
+                    AGGREGATE_TABLES + \
+                    OLD_TABLES:
+                self.db.execute('DROP TABLE IF EXISTS {table}'.format(
+                    table=table))
+            self.db.execute('PRAGMA user_version = {version}'.format(
+                version=SCHEMA_VERSION))
+        self.db.executescript(SCHEMA)
+        for key, record in legacy.items():
+            self.put(key, record)
+        self.db.commit()
+
+    def open_readonly(self, path):
+        if not os.path.isfile(path) or not is_sqlite(path):
+            raise ValueError("No build cache at {path}".format(path=path))
+        self.db = sqlite3.connect(
+            'file:{path}?mode=ro'.format(
+                path=pathname2url(os.path.abspath(path))),
+            uri=True)
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.db.close()
+            raise ValueError(
+                "Build cache {path} is version {version}, not "
+                "{expected}, run build-summary-gh.py to rebuild it".format(
+                    path=path, version=version, expected=SCHEMA_VERSION))
+
+    def put(self, key, record, excerpt=None):
+        """Add the BuildRecord for key, and its Excerpt if it has one
+
+        Finished builds don't change, if one is already cached it is left
+        as it is. A build that was running when it was cached is replaced.
+        """
+        self.delete_builds('SELECT id FROM builds WHERE key = ? AND building',
+                           (key,))
+        scan_state = None
+        if record.scan_state is not None:
+            scan_state = sqlite3.Binary(pickle.dumps(
+                record.scan_state, pickle.HIGHEST_PROTOCOL))
+        cursor = self.db.execute(
+            'INSERT OR IGNORE INTO builds ({columns}, ruleset_id)'
+            ' VALUES ({marks}, ?)'.format(
+                columns=', '.join(BUILD_COLUMNS),
+                marks=', '.join(['?'] * len(BUILD_COLUMNS))),
+            (key, record.result, to_micros(record.timestamp),
+             record.job_name, record.build_num, record.branch,
+             record.series, record.btype, record.trigger,
+             int(record.building), scan_state,
+             self.ruleset_id(record.ruleset)))
+        if not cursor.rowcount:
+            return
+        build_id = cursor.lastrowid
+        self.add_failures(build_id, record)
+        if excerpt is not None:
+            self.db.execute(
+                'INSERT INTO excerpts (build_id, excerpt) VALUES (?, ?)',
+                (build_id, sqlite3.Binary(excerpt.dumps())))
+        self.db.executemany(
+            'INSERT OR IGNORE INTO hierarchy (build_id, position, name,'
+            ' build_num, url) VALUES (?, ?, ?, ?, ?)',
+            [(build_id, position) + tuple(cause)
+             for position, cause in enumerate(record.build_hierachy)])
+        # Running builds are only cached so that their logs don't need to
+        # be scanned from the start next time.
+        if not record.building:
+            self.add_to_aggregates(build_id, record)
+            self.changed_days.add(record.timestamp.date())
+
+    def add_failures(self, build_id, record):
+        """Add the failures of a build, the rules that found them and where"""
+        reported = reported_failures(record.failures) - set(
+            ['Unknown Failure'])
+        rules = collections.defaultdict(set)
+        for failure, rule in record.failure_rules:
+            if rule:
+                rules[failure].add(rule)
+        origins = dict(record.origins)
+        # Each failure string is stored once, builds refer to it by id.
+        self.db.executemany(
+            'INSERT OR IGNORE INTO failures (failure) VALUES (?)',
+            [(failure,) for failure in record.failures])
+        self.db.executemany(
+            'INSERT OR IGNORE INTO build_failures (build_id, failure_id,'
+            ' rules, reported, source, line, offset)'
+            ' SELECT ?, id, ?, ?, ?, ?, ? FROM failures WHERE failure = ?',
+            [(build_id, ' '.join(sorted(rules[failure])),
+              int(failure in reported)) +
+             tuple(origins.get(failure, (None, None, None))) + (failure,)
+             for failure in record.failures])
+
+    def excerpt(self, key):
+        """The Excerpt of the build for key, None if it doesn't have one"""
+        row = self.db.execute(
+            'SELECT excerpt FROM excerpts JOIN builds'
+            ' ON builds.id = excerpts.build_id WHERE key = ?',
+            (key,)).fetchone()
+        if row is None:
+            return None
+        return Excerpt.loads(bytes(row[0]))
+
+    def ruleset_id(self, fingerprints):
+        """The id of a RuleSet.fingerprints, added if it is new"""
+        if fingerprints is None:
+            return None
+        text = json.dumps(fingerprints)
+        self.db.execute(
+            'INSERT OR IGNORE INTO rulesets (fingerprints) VALUES (?)',
+            (text,))
+        return self.db.execute(
+            'SELECT id FROM rulesets WHERE fingerprints = ?',
+            (text,)).fetchone()[0]
+
+    def reclassify(self, key, record):
+        """Replace the failures of a cached finished build with record's
+
+        The failure counters of the build's hour are counted again for the
+        failures it had and has now, from the builds that have them.
+        """
+        row = self.db.execute(
+            'SELECT id, timestamp FROM builds WHERE key = ? AND NOT building',
+            (key,)).fetchone()
+        if row is None:
+            return self.put(key, record)
+        build_id, timestamp = row
+        select = ('SELECT failure_id FROM build_failures'
+                  ' WHERE build_id = ? AND reported')
+        failure_ids = set(self.db.execute(select, (build_id,)))
+        self.db.execute('DELETE FROM build_failures WHERE build_id = ?',
+                        (build_id,))
+        self.add_failures(build_id, record)
+        self.db.execute('UPDATE builds SET ruleset_id = ? WHERE id = ?',
+                        (self.ruleset_id(record.ruleset), build_id))
+        failure_ids.update(self.db.execute(select, (build_id,)))
+        self.recount_failures([failure_id for failure_id, in failure_ids],
+                              hour_of(from_micros(timestamp)))
+        self.changed_days.add(from_micros(timestamp).date())
+
+    def recount_failures(self, failure_ids, hour):
+        """Count the failure_hours rows of failure_ids in hour again"""
+        start = to_micros(hour_start(hour))
+        builds = ('FROM build_failures f JOIN builds b ON b.id = f.build_id'
+                  ' WHERE f.failure_id = :failure AND f.reported'
+                  ' AND NOT b.building'
+                  ' AND b.timestamp >= :start AND b.timestamp < :end')
+        for failure_id in failure_ids:
+            params = dict(failure=failure_id, hour=hour, start=start,
+                          end=start + 3600 * 10 ** 6)
+            self.db.execute(
+                'DELETE FROM failure_hours'
+                ' WHERE failure_id = :failure AND hour = :hour', params)
+            # Ties go to the build added first, as in add_to_aggregates
+            self.db.execute(
+                """INSERT INTO failure_hours (failure_id, hour, count,
+                                               oldest_build, newest_build)
+                   SELECT * FROM (
+                       SELECT :failure, :hour, COUNT(*) AS count,
+                           (SELECT b.id {builds}
+                            ORDER BY b.timestamp, b.id LIMIT 1),
+                           (SELECT b.id {builds}
+                            ORDER BY b.timestamp DESC, b.id LIMIT 1)
+                       {builds})
+                   WHERE count > 0""".format(builds=builds), params)
+
+    def add_to_aggregates(self, build_id, record):
+        """Count a finished build in the summary tables"""
+        hour = hour_of(record.timestamp)
+        failures = reported_failures(record.failures) - set(
+            ['Unknown Failure'])
+        self.db.executemany(
+            'INSERT OR IGNORE INTO failure_hours (failure_id, hour, count,'
+            ' oldest_build, newest_build)'
+            ' SELECT id, ?, 0, ?, ? FROM failures WHERE failure = ?',
+            [(hour, build_id, build_id, failure) for failure in failures])
+        # Builds are compared by timestamp, ties go to the build added first
+        self.db.executemany(
+            """UPDATE failure_hours SET
+                count = count + 1,
+                oldest_build = CASE WHEN :timestamp < (
+                        SELECT timestamp FROM builds WHERE id = oldest_build)
+                    THEN :build ELSE oldest_build END,
+                newest_build = CASE WHEN :timestamp > (
+                        SELECT timestamp FROM builds WHERE id = newest_build)
+                    THEN :build ELSE newest_build END
+            WHERE hour = :hour AND failure_id =
+                (SELECT id FROM failures WHERE failure = :failure)
+            """,
+            [dict(timestamp=to_micros(record.timestamp), build=build_id,
+                  hour=hour, failure=failure)
+             for failure in failures])
+        success = int(record.result == 'SUCCESS')
+        for name in build_names(record):
+            self.db.execute(
+                'INSERT OR IGNORE INTO build_hours (name, hour, total,'
+                ' successes) VALUES (?, ?, 0, 0)', (name, hour))
+            self.db.execute(
+                'UPDATE build_hours SET total = total + 1,'
+                ' successes = successes + ? WHERE name = ? AND hour = ?',
+                (success, name, hour))
+        if record.trigger == 'periodic':
+            name, result = periodic_key(record)
+            self.db.execute(
+                'INSERT OR IGNORE INTO periodic_hours (name, result, hour,'
+                ' count) VALUES (?, ?, ?, 0)', (name, result, hour))
+            self.db.execute(
+                'UPDATE periodic_hours SET count = count + 1'
+                ' WHERE name = ? AND result = ? AND hour = ?',
+                (name, result, hour))
+
+    def delete_builds(self, select, params=()):
+        # select is a query for the ids of the builds to delete
+        for table in ['build_failures', 'excerpts', 'hierarchy']:
+            self.db.execute(
+                'DELETE FROM {table} WHERE build_id IN ({select})'.format(
+                    table=table, select=select), params)
+        self.db.execute('DELETE FROM builds WHERE id IN ({select})'.format(
+            select=select), params)
+
+    def expire(self, age_limit):
+        """Delete builds that started before age_limit
+
+        Failures that no build has any more are deleted too. age_limit is a
+        midnight, so that whole days are dropped from the aggregates.
+        """
+        self.delete_builds('SELECT id FROM builds WHERE timestamp < ?',
+                           (to_micros(age_limit),))
+        self.db.execute(
+            'DELETE FROM failures WHERE id NOT IN'
+            ' (SELECT failure_id FROM build_failures)')
+        self.db.execute(
+            'DELETE FROM rulesets WHERE id NOT IN'
+            ' (SELECT ruleset_id FROM builds WHERE ruleset_id IS NOT NULL)')
+        for table in AGGREGATE_TABLES:
+            self.db.execute(
+                'DELETE FROM {table} WHERE hour < ?'.format(table=table),
+                (hour_of(age_limit),))
+
+    def load(self):
+        """All cached builds, as a dict of key -> BuildRecord"""
+        return self.records('SELECT id FROM builds')
+
+    def days(self):
+        """The days that cached finished builds started on, as dates"""
+        return set(
+            EPOCH.date() + datetime.timedelta(days=day)
+            for day, in self.db.execute(
+                'SELECT DISTINCT timestamp / ? FROM builds'
+                ' WHERE NOT building', (86400 * 10 ** 6,)))
+
+    def load_days(self, days):
+        """BuildRecords of the finished builds that started on days, by key"""
+        records = {}
+        for day in days:
+            start = datetime.datetime.combine(day, datetime.time())
+            records.update(self.records(
+                'SELECT id FROM builds WHERE NOT building'
+                ' AND timestamp >= ? AND timestamp < ?',
+                (to_micros(start),
+                 to_micros(start + datetime.timedelta(days=1)))))
+        return records
+
+    def index(self):
+        """key -> CachedBuild of every cached build
+
+        Enough to tell which builds need to be parsed or reclassified
+        without loading their failures, see get for the BuildRecords of
+        those that do.
+        """
+        rulesets = self.rulesets()
+        return dict(
+            (key, CachedBuild(bool(building), result,
+                              rulesets.get(ruleset_id)))
+            for key, building, result, ruleset_id in self.db.execute(
+                'SELECT key, building, result, ruleset_id FROM builds'))
+
+    def get(self, keys):
+        """BuildRecords of the cached builds of keys, by key"""
+        keys = list(keys)
+        records = {}
+        for start in range(0, len(keys), MAX_PARAMS):
+            chunk = keys[start:start + MAX_PARAMS]
+            records.update(self.records(
+                'SELECT id FROM builds WHERE key IN ({marks})'.format(
+                    marks=', '.join(['?'] * len(chunk))),
+                chunk))
+        return records
+
+    def rulesets(self):
+        """ruleset id -> RuleSet.fingerprints"""
+        return dict(
+            (ruleset_id, tuple(tuple(pair) for pair in json.loads(text)))
+            for ruleset_id, text in self.db.execute(
+                'SELECT id, fingerprints FROM rulesets'))
+
+    def records(self, select, params=()):
+        """BuildRecords of the builds whose ids select returns, by key"""
+        rulesets = self.rulesets()
+        failures = collections.defaultdict(set)
+        failure_rules = collections.defaultdict(set)
+        origins = collections.defaultdict(set)
+        # Only the failure strings of the selected builds are read.
+        for build_id, failure, rules, source, line, offset in \
+                self.db.execute(
+                    'SELECT f.build_id, s.failure, f.rules, f.source,'
+                    ' f.line, f.offset FROM build_failures f'
+                    ' JOIN failures s ON s.id = f.failure_id'
+                    ' WHERE f.build_id IN ({select})'.format(select=select),
+                    params):
+            failures[build_id].add(failure)
+            failure_rules[build_id].update(
+                (failure, rule) for rule in rules.split() or [''])
+            if source is not None:
+                origins[build_id].add(
+                    (failure, Origin(source, line, offset)))
+        hierarchy = collections.defaultdict(list)
+        for row in self.db.execute(
+                'SELECT build_id, name, build_num, url FROM hierarchy'
+                ' WHERE build_id IN ({select})'
+                ' ORDER BY build_id, position'.format(select=select),
+                params):
+            hierarchy[row[0]].append(Cause(*row[1:]))
+        records = {}
+        for row in self.db.execute(
+                'SELECT id, ruleset_id, {columns} FROM builds'
+                ' WHERE id IN ({select})'.format(
+                    columns=', '.join(BUILD_COLUMNS), select=select),
+                params):
+            values = dict(zip(BUILD_COLUMNS, row[2:]))
+            key = values.pop('key')
+            values['timestamp'] = from_micros(values['timestamp'])
+            values['building'] = bool(values['building'])
+            if values['scan_state'] is not None:
+                values['scan_state'] = pickle.loads(
+                    bytes(values['scan_state']))
+            records[key] = BuildRecord(
+                build_hierachy=tuple(hierarchy[row[0]]),
+                failures=frozenset(failures[row[0]]),
+                failure_rules=frozenset(failure_rules[row[0]]),
+                ruleset=rulesets.get(row[1]),
+                origins=frozenset(origins[row[0]]),
+                **values)
+        return records
+
+    def query(self, fields=None, jobs=(), failures=(), since=None,
+              until=None, order_by='timestamp', descending=True,
+              limit=None):
+        """Find cached builds, returns a list of (key, BuildRecord)
+
+        fields maps builds columns, eg result or branch, to the values
+        wanted. jobs are globs for job names, any may match. failures are
+        functions that are passed each distinct failure and return True
+        for those wanted, a build must have a failure that matches each.
+        since and until limit the start time. The indexes on the builds
+        columns and on failures mean that only matching builds are read.
+        """
+        where = []
+        params = []
+        for column, values in sorted((fields or {}).items()):
+            if column not in BUILD_COLUMNS:
+                raise ValueError("Unknown field: {column}".format(
+                    column=column))
+            where.append('{column} IN ({marks})'.format(
+                column=column, marks=', '.join(['?'] * len(values))))
+            params.extend(values)
+        if jobs:
+            where.append('({globs})'.format(globs=' OR '.join(
+                ['job_name GLOB ?'] * len(jobs))))
+            params.extend(jobs)
+        if since is not None:
+            where.append('timestamp >= ?')
+            params.append(to_micros(since))
+        if until is not None:
+            where.append('timestamp < ?')
+            params.append(to_micros(until))
+        if failures:
+            strings = list(self.db.execute(
+                'SELECT id, failure FROM failures'))
+            for match in failures:
+                # ids are integers from the database, safe to inline.
+                where.append(
+                    'id IN (SELECT build_id FROM build_failures'
+                    ' WHERE failure_id IN ({ids}))'.format(ids=', '.join(
+                        str(failure_id) for failure_id, failure in strings
+                        if match(failure))))
+        if order_by not in BUILD_COLUMNS:
+            raise ValueError("Unknown field: {column}".format(
+                column=order_by))
+        select = ('SELECT {{columns}} FROM builds{where}'
+                  ' ORDER BY {order}{desc}, id{limit}').format(
+            where=' WHERE ' + ' AND '.join(where) if where else '',
+            order=SORT_KEYS.get(order_by, order_by),
+            desc=' DESC' if descending else '',
+            limit=' LIMIT {0:d}'.format(limit) if limit else '')
+        found = list(self.db.execute(select.format(columns='key'), params))
+        records = self.records(select.format(columns='id'), params)
+        return [(key, records[key]) for key, in found]
+
+    def failcount(self, today, days, bucket='day'):
+        """failure -> count, histogram and oldest and newest builds
+
+        histogram is the number of builds in each bucket of the last days,
+        ending with today, bucket is a name from BUCKETS.
+        """
+        start, buckets = window(today, days, BUCKETS[bucket])
+        failures = dict(self.db.execute('SELECT id, failure FROM failures'))
+        histograms = bucket_sums(
+            self.db.execute(
+                'SELECT failure_id, hour, count FROM failure_hours'
+            ).fetchall(),
+            start, BUCKETS[bucket], buckets)
+        failcount = {}
+        for failure_id, count in self.db.execute(
+                'SELECT failure_id, SUM(count) FROM failure_hours'
+                ' GROUP BY failure_id'):
+            failcount[failure_id] = dict(count=count,
+                                         histogram=histograms[failure_id])
+        # The oldest build is in the first hour of each failure, the newest
+        # in the last. SQLite takes the other columns from the row that
+        # MIN or MAX picked.
+        for end, aggregate, column in [('oldest', 'MIN', 'oldest_build'),
+                                       ('newest', 'MAX', 'newest_build')]:
+            for failure_id, job_name, build_num, timestamp in self.db.execute(
+                    """SELECT d.failure_id, b.job_name, b.build_num,
+                              b.timestamp
+                       FROM (SELECT failure_id, {aggregate}(hour),
+                                    {column} AS build_id
+                             FROM failure_hours GROUP BY failure_id) d
+                       JOIN builds b ON b.id = d.build_id""".format(
+                        aggregate=aggregate, column=column)):
+                d = failcount[failure_id]
+                d[end] = from_micros(timestamp)
+                d[end + '_job'] = build_num
+                d[end + '_bobj'] = BuildRef(job_name, build_num, d[end])
+        return collections.OrderedDict(sorted(
+            (failures[failure_id], d) for failure_id, d in failcount.items()))
+
+    def buildcount(self, today, days):
+        """name -> TSF of the builds of the last days, ending with today"""
+        buildcount = collections.defaultdict(TSF)
+        for name, total, successes in self.db.execute(
+                'SELECT name, SUM(total), SUM(successes) FROM build_hours'
+                ' WHERE hour >= ? GROUP BY name',
+                ((today.toordinal() - days + 1) * 24,)):
+            buildcount[name] = TSF(total, successes)
+        return buildcount
+
+    def periodichistogram(self, today, days, bucket='day'):
+        """Periodic build results for each bucket of the last days
+
+        '{series}_{btype}_{trigger}_{result}' -> a list of build counts,
+        negative for anything but SUCCESS, and
+        '{series}_{btype}_{trigger}_stats' -> {'max': the largest count}.
+        """
+        start, buckets = window(today, days, BUCKETS[bucket])
+        periodichistogram = bucket_sums(
+            self.db.execute(
+                """SELECT name || '_' || result, hour,
+                          CASE WHEN result = 'SUCCESS' THEN count
+                               ELSE -count END
+                   FROM periodic_hours""").fetchall(),
+            start, BUCKETS[bucket], buckets)
+        for name, result in self.db.execute(
+                'SELECT DISTINCT name, result FROM periodic_hours'):
+            stats = periodichistogram.setdefault(
+                '{base}_stats'.format(base=name), dict(max=0))
+            histogram = periodichistogram['{base}_{result}'.format(
+                base=name, result=result)]
+            stats['max'] = max([stats['max']] +
+                               [abs(count) for count in histogram])
+        return periodichistogram
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
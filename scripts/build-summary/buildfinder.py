@@ -0,0 +1,80 @@
+# Stdlib import
+import fnmatch
+import os
+import re
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    # python 2, from the scandir package
+    from scandir import scandir
+
+build_path_re = re.compile(
+    '^(?P<build_folder>.*/(?P<job_name>[^/]+)/'
+    'builds/(?P<build_num>[0-9]+))/')
+
+
+def build_key(job_name, build_num):
+    return "{job_name}_{build_num}".format(
+        job_name=job_name,
+        build_num=build_num)
+
+
+def match_build_paths(paths):
+    """Builds from paths to their build.xml files
+
+    Yields (key, build_folder, job_name, build_num), paths that aren't in a
+    jenkins builds folder are ignored.
+    """
+    for path in paths:
+        match = build_path_re.search(path)
+        if match:
+            groups = match.groupdict()
+            yield (build_key(groups['job_name'], groups['build_num']),
+                   groups['build_folder'],
+                   groups['job_name'],
+                   groups['build_num'])
+
+
+def find_builds(jobs_root, job_patterns, age_limit, skip=None):
+    """Walk a jenkins jobs folder for builds that need to be parsed
+
+    Jobs are the folders in jobs_root whose name matches any of the
+    job_patterns globs. Yields (key, build_folder, job_name, build_num) in
+    the same order as a shell glob of their build.xml files would.
+
+    Folders are pruned by mtime before any file is opened. A builds folder
+    that hasn't changed since age_limit only has builds that started
+    before then, and the same goes for a build folder. skip is called with
+    the key and build number of each build, and those it returns True for
+    are passed over without a stat, eg builds that are already cached.
+    """
+    oldest = time.mktime(age_limit.timetuple())
+    jobs = sorted((entry for entry in scandir(jobs_root)
+                   if any(fnmatch.fnmatchcase(entry.name, pattern)
+                          for pattern in job_patterns)),
+                  key=lambda entry: entry.name)
+    for job in jobs:
+        builds_folder = os.path.join(job.path, 'builds')
+        try:
+            if os.stat(builds_folder).st_mtime < oldest:
+                continue
+            builds = sorted((entry for entry in scandir(builds_folder)
+                             if entry.name.isdigit()),
+                            key=lambda entry: entry.name)
+        except OSError:
+            continue
+        for build in builds:
+            key = build_key(job.name, build.name)
+            if skip is not None and skip(key, int(build.name)):
+                continue
+            try:
+                # follows symlinks, older jenkins link numbers to dated
+                # build folders.
+                if not build.is_dir() or build.stat().st_mtime < oldest:
+                    continue
+            except OSError:
+                continue
+            if os.path.exists(os.path.join(build.path, 'build.xml')):
+                yield key, build.path, job.name, build.name
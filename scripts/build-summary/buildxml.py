@@ -0,0 +1,73 @@
+# Stdlib import
+import collections
+import copy
+
+# 3rd Party imports
+from lxml import etree
+
+# What Build needs from a build.xml. Values are the element text, or None
+# if the element wasn't found. cause is a copy of the first cause element,
+# its upstreamCauses included, see Build.get_parent_info.
+BuildXML = collections.namedtuple(
+    'BuildXML', ['result', 'start_time', 'duration', 'cause'])
+
+# Children of <build> that are read, by BuildXML field
+FIELDS = {
+    'result': 'result',
+    'startTime': 'start_time',
+    'duration': 'duration',
+}
+
+
+def is_cause_container(elem):
+    # Causes are in <causes> or, for newer jenkins, <causeBag><entry>
+    if elem.tag == 'causes':
+        return True
+    parent = elem.getparent()
+    return (elem.tag == 'entry' and parent is not None and
+            parent.tag == 'causeBag')
+
+
+def parse_build_xml(path):
+    """Read a build.xml without building a tree of it
+
+    Actions such as test results can make a build.xml very large, and
+    jenkins writes them before the elements needed here. Elements are
+    cleared as soon as they have been read, and parsing stops once
+    everything in BuildXML has been found. A build that is still running
+    has no result, so for those the whole file is read.
+    """
+    values = dict.fromkeys(BuildXML._fields)
+    found = set()
+    # The cause container is kept until it ends, so its cause can be copied.
+    container = None
+    depth = 0
+    with open(path, 'rb') as xml:
+        for event, elem in etree.iterparse(xml, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if ('cause' not in found and container is None and
+                        is_cause_container(elem)):
+                    container = elem
+                continue
+            depth -= 1
+            if elem is container:
+                values['cause'] = copy.deepcopy(elem[0])
+                found.add('cause')
+                container = None
+            elif container is not None:
+                continue
+            # depth 1 is a child of <build>, test results have durations too
+            elif depth == 1 and elem.tag in FIELDS:
+                values[FIELDS[elem.tag]] = elem.text
+                found.add(FIELDS[elem.tag])
+            if len(found) == len(values):
+                break
+            # Drop this element and everything before it, only its
+            # ancestors are left.
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+    return BuildXML(**values)
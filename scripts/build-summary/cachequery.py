@@ -1,7 +1,29 @@
+import csv
+import json
+import re
+import sys
+
 import click
-import pickle
 
-from build import Build
+from buildcache import BuildCache
+
+# Options that are matched exactly, each is named after its builds column
+FIELDS = ['result', 'branch', 'series', 'btype', 'trigger']
+SORT_FIELDS = ['timestamp', 'result', 'job_name', 'build_num', 'branch',
+               'series', 'btype', 'trigger']
+OUTPUT_FIELDS = ['key', 'timestamp', 'result', 'job_name', 'build_num',
+                 'branch', 'series', 'btype', 'trigger', 'failures']
+
+
+def output_row(key, build):
+    row = dict((field, getattr(build, field, None))
+               for field in OUTPUT_FIELDS)
+    row['key'] = key
+    row['timestamp'] = build.timestamp.isoformat()
+    row['failures'] = sorted(build.failures)
+    row['origins'] = dict((failure, origin._asdict())
+                          for failure, origin in build.origins)
+    return row
 
 
 @click.group()
@@ -9,17 +31,71 @@ def cli():
     pass
 
 
-@cli.command()
+@cli.command(help='Find cached builds. Options can be given more than once, '
+                  'builds matching any of the values of an option are '
+                  'found, and all the options must match.')
 @click.option('--cache-file', default='test-cache')
-@click.option('--query')
-def query(cache_file, query):
-    with open(cache_file, 'rb') as f:
-        key, criteria = query.split('=')
-        buildobjs = pickle.load(f)
-        for name, build in buildobjs.items():
-            item = getattr(build, key, '')
-            if criteria in item:
-                print(build, item)
+@click.option('--result', multiple=True)
+@click.option('--branch', multiple=True)
+@click.option('--series', multiple=True)
+@click.option('--btype', multiple=True)
+@click.option('--trigger', multiple=True)
+@click.option('--job', multiple=True, help='Glob for the job name')
+@click.option('--failure', multiple=True,
+              help='Text in one of the build\'s failures')
+@click.option('--failure-re', multiple=True,
+              help='Regex to search the build\'s failures for')
+@click.option('--since', type=click.DateTime(),
+              help='Only builds that started at or after this time')
+@click.option('--until', type=click.DateTime(),
+              help='Only builds that started before this time')
+@click.option('--sort', default='timestamp', type=click.Choice(SORT_FIELDS))
+@click.option('--ascending', is_flag=True,
+              help='Sort ascending, default is newest first')
+@click.option('--limit', default=0, help='Most builds to output, 0 for all')
+@click.option('--format', 'output_format', default='text',
+              type=click.Choice(['text', 'json', 'csv']))
+def query(cache_file, result, branch, series, btype, trigger, job, failure,
+          failure_re, since, until, sort, ascending, limit, output_format):
+    values = dict(result=result, branch=branch, series=series, btype=btype,
+                  trigger=trigger)
+    fields = dict((field, values[field]) for field in FIELDS
+                  if values[field])
+    # Default arguments bind each text and pattern to its own function.
+    failures = [lambda f, text=text: text in f for text in failure]
+    failures.extend(lambda f, pattern=re.compile(pattern): pattern.search(f)
+                    for pattern in failure_re)
+    try:
+        build_cache = BuildCache(cache_file, readonly=True)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    builds = build_cache.query(fields=fields, jobs=job, failures=failures,
+                               since=since, until=until, order_by=sort,
+                               descending=not ascending, limit=limit)
+    build_cache.close()
+
+    if output_format == 'json':
+        json.dump([output_row(key, build) for key, build in builds],
+                  sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    elif output_format == 'csv':
+        writer = csv.DictWriter(sys.stdout, OUTPUT_FIELDS)
+        writer.writeheader()
+        for key, build in builds:
+            row = output_row(key, build)
+            row['failures'] = '; '.join(row['failures'])
+            del row['origins']
+            writer.writerow(row)
+    else:
+        for key, build in builds:
+            print(build)
+            origins = dict(build.origins)
+            for failure in sorted(build.failures):
+                origin = origins.get(failure)
+                print("    {failure}{origin}".format(
+                    failure=failure,
+                    origin=" ({source}:{line})".format(**origin._asdict())
+                    if origin else ''))
 
 
 cli()
@@ -0,0 +1,131 @@
+# Stdlib import
+import collections
+import random
+import re
+import zlib
+
+# # Near Duplicate Failure Clustering
+# normalise only removes identifiers it knows about, failures that differ
+# by a hostname, a counter or a word are still separate rows. Failures are
+# grouped by the Jaccard similarity of their shingles: the words and pairs
+# of words in them, with any word that contains a digit or looks like a
+# hex id replaced by 0.
+# Comparing every pair doesn't scale, so pairs to compare are found with
+# MinHash signatures and locality sensitive hashing: failures whose
+# signatures agree on all the rows of any band share a bucket. Only
+# failures that share a bucket are compared.
+
+word_re = re.compile(r'\w+')
+id_re = re.compile(r'\d|^[0-9a-f]{8,}$')
+
+
+def shingles(failure):
+    """The set of hashed shingles of a failure"""
+    words = ['0' if id_re.search(word) else word
+             for word in word_re.findall(failure)]
+    grams = set(words)
+    grams.update(' '.join(pair) for pair in zip(words, words[1:]))
+    # crc32 rather than hash, so that clusters are the same every run.
+    return frozenset(zlib.crc32(gram.encode('utf-8')) & 0xffffffff
+                     for gram in grams)
+
+
+def jaccard(a, b):
+    return len(a & b) / float(len(a | b))
+
+
+class MinHasher(object):
+    """MinHash Signatures
+
+    Each row of a signature is the least shingle hash after xoring all of
+    them with that row's seed, which permutes the hashes.
+    """
+    def __init__(self, bands=8, rows=4, seed=0):
+        self.bands = bands
+        self.rows = rows
+        rand = random.Random(seed)
+        self.seeds = [rand.getrandbits(32) for _ in range(bands * rows)]
+
+    def signature(self, hashes):
+        return [min(map(seed.__xor__, hashes)) for seed in self.seeds]
+
+    def band_keys(self, hashes):
+        signature = self.signature(hashes)
+        return [(band, tuple(signature[band * self.rows:
+                                       (band + 1) * self.rows]))
+                for band in range(self.bands)]
+
+
+def cluster(failures, threshold, hasher=None):
+    """Group failures whose similarity is at least threshold
+
+    Returns a list of clusters, each a sorted list of failures. Each failure
+    is compared with one failure from each of the clusters in the LSH
+    buckets it falls in, so the work is near linear in the number of
+    distinct sets of shingles. The default 8 bands of 4 rows find most
+    pairs with a similarity over 0.6.
+    """
+    hasher = hasher or MinHasher()
+    failures = sorted(set(failures))
+    sets = [shingles(failure) for failure in failures]
+    parents = list(range(len(failures)))
+
+    def root(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    # Failures that only differ by ids have the same shingles, only the
+    # first of them needs a signature.
+    seen = {}
+    buckets = {}
+    for i, hashes in enumerate(sets):
+        if not hashes:
+            continue
+        first = seen.setdefault(hashes, i)
+        if first != i:
+            parents[i] = first
+            continue
+        for key in hasher.band_keys(hashes):
+            bucket = buckets.setdefault(key, [])
+            for other in bucket:
+                a, b = root(other), root(i)
+                if a != b and jaccard(sets[other], hashes) >= threshold:
+                    parents[max(a, b)] = min(a, b)
+            # A bucket only needs one failure from each cluster.
+            if all(root(other) != root(i) for other in bucket):
+                bucket.append(i)
+    clusters = collections.defaultdict(list)
+    for i, failure in enumerate(failures):
+        clusters[root(i)].append(failure)
+    return [clusters[i] for i in sorted(clusters)]
+
+
+def cluster_failcount(failcount, threshold, hasher=None):
+    """Merge the failcount rows of similar failures
+
+    A cluster's row is under its most common failure and has the summed
+    count and histogram, the oldest and newest builds of any member, and
+    variants, a list of [failure, count] for each member, most common
+    first. A build with two members of a cluster counts for both.
+    """
+    merged = {}
+    for members in cluster(failcount, threshold, hasher):
+        variants = sorted(([failure, failcount[failure]['count']]
+                           for failure in members),
+                          key=lambda v: (-v[1], v[0]))
+        d = dict(failcount[variants[0][0]])
+        d['histogram'] = list(d['histogram'])
+        for failure, _ in variants[1:]:
+            other = failcount[failure]
+            d['count'] += other['count']
+            d['histogram'] = [
+                a + b for a, b in zip(d['histogram'], other['histogram'])]
+            for end, better in [('oldest', min), ('newest', max)]:
+                if better(d[end], other[end]) != d[end]:
+                    for field in [end, end + '_job', end + '_bobj']:
+                        d[field] = other[field]
+        d['variants'] = variants if len(variants) > 1 else []
+        merged[variants[0][0]] = d
+    return collections.OrderedDict(sorted(merged.items()))
@@ -0,0 +1,250 @@
+# Stdlib import
+import json
+import zlib
+
+# Project imports
+from logreader import BuildLog
+from logreader import Origin
+from logreader import Segment
+from scanner import line_end
+
+# # Build Log Excerpts
+# The first scan of a failed build keeps the lines of its logs that rules
+# can be run against again, so that a build can be reclassified without
+# reading its logs, see reclassify.py. These are the lines containing any
+# literal of the RuleSet, which includes the task and play headers, the
+# context the rules with each literal need around them, and the last lines
+# of each log before the post build scripts. The lines keep their offsets in
+# the build log and their line numbers, so rules find the same failures in
+# the excerpt as they do in the logs, with the same Origins, as long as the
+# excerpt covers them.
+
+# Lines kept from the end of each log
+TAIL_LINES = 50
+
+
+def deltas(values):
+    return [value - previous
+            for previous, value in zip([0] + values, values)]
+
+
+def running_sum(values):
+    total = 0
+    for value in values:
+        total += value
+        yield total
+
+
+class Excerpt(object):
+    """Excerpt
+
+    Lines of a build's logs, filled in by the Scanner as it scans them.
+    lines maps the offset of each line in the build log to (line number,
+    raw line), sources are (name, base, end) of each log. context maps
+    each literal to the lines of (before, after) context kept around the
+    lines that contain it. A scan of a log that is still being written can
+    stop short of the after context of a line, wanted is the number of
+    lines the next scan needs to add from the start of what it scans, by
+    source index. searched maps the name of each log that was only scanned
+    with some of the rules to the literals of those rules, see
+    logsources.py.
+    """
+    # Lines before the end of a segment the Scanner keeps for set_tail
+    tail_lines = TAIL_LINES
+
+    def __init__(self, context):
+        self.context = dict(context)
+        self.lines = {}
+        self.sources = []
+        self.tails = {}
+        self.wanted = {}
+        self.searched = {}
+
+    def covers(self, rule, source=None):
+        """Does the excerpt have every line rule can match, with context?
+
+        Only in the log named source, if given.
+        """
+        searched = self.searched.get(source)
+        if searched is not None and not set(rule.literals) <= set(searched):
+            return False
+        for literal in rule.literals:
+            before, after = self.context.get(literal.encode('utf-8'),
+                                             (-1, -1))
+            if before < rule.before or after < rule.after:
+                return False
+        return True
+
+    def add_line(self, offset, raw, number):
+        self.lines[offset] = (number, raw)
+
+    def add_context(self, index, raw, buf, start, limit, base, number):
+        """Add the context the literals in raw need around a line
+
+        The line is line number, buf[start:], and base is the offset of buf
+        in the build log.
+        """
+        before = after = 0
+        for literal, (lines_before, lines_after) in self.context.items():
+            if literal in raw:
+                before = max(before, lines_before)
+                after = max(after, lines_after)
+        self.add_preceding(self.lines, buf, start, base, number - 1, before)
+        self.add_following(index, buf, line_end(buf, start, limit), limit,
+                           base, number + 1, after)
+
+    @staticmethod
+    def add_preceding(lines, buf, start, base, number, count):
+        """Add to lines up to count lines before buf[start]
+
+        The last of them is line number.
+        """
+        line_start = start
+        for added in range(count):
+            if line_start <= 0:
+                break
+            prev_start = buf.rfind(b'\n', 0, line_start - 1) + 1
+            lines[base + prev_start] = (number - added,
+                                        buf[prev_start:line_start])
+            line_start = prev_start
+
+    def add_following(self, index, buf, start, limit, base, number, count):
+        """Add count lines from buf[start:limit], the first is number"""
+        line_start = start
+        for added in range(count):
+            if line_start >= limit:
+                self.wanted[index] = max(self.wanted.get(index, 0),
+                                         count - added)
+                return
+            next_start = line_end(buf, line_start, limit)
+            self.lines[base + line_start] = (number + added,
+                                             buf[line_start:next_start])
+            line_start = next_start
+
+    def resume(self, index, buf, begin, end, base, number):
+        """Add the lines a previous scan wanted, from buf[begin:end]"""
+        self.add_following(index, buf, begin, end, base, number,
+                           self.wanted.pop(index, 0))
+
+    def set_tail(self, index, buf, end, base, lines):
+        """The last lines of a source end at buf[end], after lines lines"""
+        if end and buf[end - 1:end] != b'\n':
+            # The last line doesn't end with a newline
+            lines += 1
+        self.tails[index] = {}
+        self.add_preceding(self.tails[index], buf, end, base, lines,
+                           TAIL_LINES)
+
+    def all_lines(self):
+        lines = dict(self.lines)
+        for tail in self.tails.values():
+            lines.update(tail)
+        return lines
+
+    def dumps(self):
+        """The excerpt, compressed
+
+        Offsets and line numbers are stored as the difference from the
+        previous line's, which compress better.
+        """
+        lines = self.all_lines()
+        offsets = sorted(lines)
+        numbers = [lines[offset][0] for offset in offsets]
+        header = json.dumps(dict(
+            sources=self.sources,
+            searched=self.searched,
+            offsets=deltas(offsets),
+            numbers=deltas(numbers),
+            lengths=[len(lines[offset][1]) for offset in offsets],
+            context=sorted([literal.decode('utf-8'), before, after]
+                           for literal, (before, after)
+                           in self.context.items())))
+        return zlib.compress(header.encode('utf-8') + b'\n' + b''.join(
+            lines[offset][1] for offset in offsets))
+
+    @classmethod
+    def loads(cls, data):
+        header, data = zlib.decompress(data).split(b'\n', 1)
+        header = json.loads(header.decode('utf-8'))
+        excerpt = cls((literal.encode('utf-8'), (before, after))
+                      for literal, before, after in header['context'])
+        excerpt.sources = [tuple(source) for source in header['sources']]
+        # Excerpts kept before logs had rule subsets don't have searched
+        excerpt.searched = header.get('searched', {})
+        pos = 0
+        for offset, number, length in zip(
+                running_sum(header['offsets']),
+                running_sum(header['numbers']), header['lengths']):
+            excerpt.lines[offset] = (number, data[pos:pos + length])
+            pos += length
+        return excerpt
+
+
+class ExcerptSource(object):
+    """Excerpt Source
+
+    The lines an Excerpt has of one log, joined up in one buffer that is
+    scanned like a LogSource. origins maps the offset of each line in buf
+    to its Origin in the log. If the log's first line isn't in the excerpt
+    buf starts with an empty line, so that the first line in buf isn't
+    taken to be the first of the log. rules are as for LogSource.
+    """
+    streamed = False
+
+    def __init__(self, name, base, end, lines, rules=None):
+        self.name = name
+        self.path = name
+        self.rules = rules
+        self.base = 0
+        self.origins = {}
+        parts = []
+        pos = 0
+        if lines and lines[0][0] != base:
+            parts.append(b'\n')
+            pos = 1
+        for offset, (number, raw) in lines:
+            self.origins[pos] = Origin(name, number, offset - base)
+            parts.append(raw)
+            pos += len(raw)
+        self.buf = b''.join(parts)
+        self.end = len(self.buf)
+
+    def open(self, complete_lines=False, scanned=0):
+        return self
+
+    def close(self):
+        pass
+
+    def segments(self, begin, before, after):
+        yield Segment(self.buf, begin, self.end, self.end, 0)
+
+    def origin(self, offset, line):
+        return self.origins[offset]
+
+
+class ExcerptLog(BuildLog):
+    """Excerpt Log
+
+    A BuildLog of the lines in an Excerpt. Offsets in it are of the
+    joined up lines, not of the build log, see ExcerptSource. rules maps
+    the name of each log to the names of the rules it is scanned with,
+    all of them if it isn't in rules.
+    """
+    def __init__(self, excerpt, rules=None):
+        rules = rules or {}
+        lines = sorted(excerpt.all_lines().items())
+        self.sources = [
+            ExcerptSource(name, base, end,
+                          [(offset, line) for offset, line in lines
+                           if base <= offset < base + end],
+                          rules.get(name))
+            for name, base, end in excerpt.sources]
+        self.complete_lines = False
+        self.scanned = [0] * len(self.sources)
+
+    def open(self):
+        base = 0
+        for source in self.sources:
+            source.base = base
+            base += source.end
+        return self
@@ -0,0 +1,65 @@
+# Stdlib import
+import collections
+
+# 3rd Party imports
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# # Time Bucket Histograms
+# The sparklines are histograms of the hourly counters in the build cache,
+# summed into buckets of a whole number of hours. With NumPy the counters
+# are summed with one bincount over every key, without it they are summed
+# one at a time.
+
+# Bucket widths, in hours
+BUCKETS = collections.OrderedDict([('hour', 1), ('day', 24), ('week', 168)])
+
+
+def window(today, days, width):
+    """(first hour, number of buckets) of the last days, ending with today
+
+    The last bucket ends at the end of today, the first starts early
+    enough that the buckets cover days.
+    """
+    buckets = -(-days * 24 // width)
+    end = (today.toordinal() + 1) * 24
+    return end - buckets * width, buckets
+
+
+def bucket_sums(rows, start, width, buckets):
+    """key -> the sum of the counts in each bucket
+
+    rows is a sequence of (key, hour, count), bucket 0 starts at hour start
+    and each is width hours. Every key is in the result, even those that
+    only have counts outside the buckets.
+    """
+    if not rows:
+        return {}
+    if numpy is not None:
+        return numpy_bucket_sums(rows, start, width, buckets)
+    sums = {}
+    for key, hour, count in rows:
+        histogram = sums.get(key)
+        if histogram is None:
+            histogram = sums[key] = [0] * buckets
+        bucket = (hour - start) // width
+        if 0 <= bucket < buckets:
+            histogram[bucket] += count
+    return sums
+
+
+def numpy_bucket_sums(rows, start, width, buckets):
+    keys, hours, counts = zip(*rows)
+    # Keys are coded as their index in the sorted unique keys, so that the
+    # key and bucket of each count is one index into a flat histogram.
+    unique, codes = numpy.unique(numpy.asarray(keys), return_inverse=True)
+    bins = (numpy.asarray(hours, dtype=numpy.int64) - start) // width
+    inside = (bins >= 0) & (bins < buckets)
+    sums = numpy.bincount(
+        codes.ravel()[inside] * buckets + bins[inside],
+        weights=numpy.asarray(counts, dtype=numpy.int64)[inside],
+        minlength=len(unique) * buckets)
+    sums = sums.round().astype(numpy.int64).reshape(len(unique), buckets)
+    return dict(zip(unique.tolist(), sums.tolist()))
@@ -0,0 +1,396 @@
+# Stdlib import
+import collections
+import mmap
+import os
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Anything after this line is output from post build scripts rather than the
+# build itself, so it is not scanned for failures.
+POST_BUILD_MARKER = b'[PostBuildScript] - Execution post build scripts.\n'
+
+# Part of a log for the Scanner: lines starting in buf[start:end] are
+# scanned, context may be read from anywhere in buf[:limit]. offset is the
+# offset of buf[0] in the log.
+Segment = collections.namedtuple(
+    'Segment', ['buf', 'start', 'end', 'limit', 'offset'])
+
+# Where a line is in a build's logs: the name of the log, the line number,
+# from 1, and the offset of the start of the line in the log.
+Origin = collections.namedtuple('Origin', ['source', 'line', 'offset'])
+
+
+class ReaderPool(object):
+    """Reader Pool
+
+    Runs the functions it is given on at most size threads at once, in the
+    order they were given. Sources are given in the order they are
+    scanned, so the one being scanned is always running, or next to run.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._waiting = collections.deque()
+        self._running = 0
+
+    def submit(self, function):
+        with self._lock:
+            if self._running >= self.size:
+                self._waiting.append(function)
+                return
+            self._running += 1
+        thread = threading.Thread(target=self._work, args=(function,))
+        thread.daemon = True
+        thread.start()
+
+    def _work(self, function):
+        while function is not None:
+            function()
+            with self._lock:
+                if self._waiting:
+                    function = self._waiting.popleft()
+                else:
+                    function = None
+                    self._running -= 1
+
+
+class LogSource(object):
+    """Log Source
+
+    One log file, memory mapped so that it can be searched without reading
+    it into python objects. buf supports find/rfind and slicing, only the
+    region [0, end) is scanned, end being the start of the post build
+    marker line if there is one. name is what the log is called in
+    Origins, path if not given. rules are the names of the rules the log
+    is scanned with, None for all of them.
+    """
+    streamed = False
+
+    def __init__(self, path, name=None, rules=None):
+        self.path = path
+        self.name = name or path
+        self.rules = rules
+        self.buf = b''
+        self.end = 0
+        self._file = None
+
+    def open(self, complete_lines=False, scanned=0):
+        """Map the file and find end
+
+        If complete_lines is set a partial last line, from a log that is
+        still being written, is left out. scanned is how much of the log a
+        previous scan read, the post build marker can't be before it.
+        """
+        try:
+            self._file = open(self.path, 'rb')
+        except IOError:
+            return self
+        size = os.fstat(self._file.fileno()).st_size
+        if size:
+            self.buf = mmap.mmap(self._file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            if hasattr(mmap, 'MADV_WILLNEED'):
+                # Have the kernel read the log in while earlier ones are
+                # scanned, python 3.8+ only.
+                self.buf.madvise(mmap.MADV_WILLNEED)
+        self.end = self.find_cutoff(scanned)
+        if complete_lines:
+            self.end = self.buf.rfind(b'\n', 0, self.end) + 1
+        return self
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+        self.buf = b''
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def segments(self, begin, before, after):
+        """The whole of [begin, end) is one segment"""
+        yield Segment(self.buf, begin, self.end, self.end, 0)
+
+    def origin(self, offset, line):
+        """Origin of line number line, which starts at offset"""
+        return Origin(self.name, line, offset)
+
+    def find_cutoff(self, start=0):
+        if self.buf[:len(POST_BUILD_MARKER)] == POST_BUILD_MARKER:
+            return 0
+        if start > len(self.buf):
+            # The file has shrunk, it can't be resumed so look at all of it.
+            start = 0
+        marker = self.buf.find(b'\n' + POST_BUILD_MARKER, max(start - 1, 0))
+        if marker == -1:
+            return len(self.buf)
+        return marker + 1
+
+
+def _open_gz(path):
+    import gzip
+    return gzip.open(path, 'rb')
+
+
+def _open_bz2(path):
+    import bz2
+    return bz2.BZ2File(path, 'rb')
+
+
+def _open_xz(path):
+    try:
+        import lzma
+    except ImportError:
+        # python 2, from the backports.lzma package
+        from backports import lzma
+    return lzma.open(path, 'rb')
+
+
+def _open_zst(path):
+    # Only needed for zstd compressed logs
+    import zstandard
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+
+
+# Compressed variants of a log that are looked for if it doesn't exist.
+DECOMPRESSORS = collections.OrderedDict([
+    ('.gz', _open_gz),
+    ('.bz2', _open_bz2),
+    ('.xz', _open_xz),
+    ('.zst', _open_zst),
+])
+
+
+class StreamSource(object):
+    """Stream Source
+
+    A compressed log file. It is decompressed by a thread into line aligned
+    blocks, so that several logs can be decompressed at once, and the
+    Scanner is given a Segment for each block. Each segment also holds
+    enough lines either side of the block for context. At most a few
+    blocks are held in memory, the inflated log never is. end is only known
+    once the whole log has been read. Offsets in Origins are of the
+    inflated log. The thread is from pool, a ReaderPool, if one is set when
+    the source is opened.
+    """
+    streamed = True
+    block_size = 2 ** 20
+    # Blocks decompressed ahead of the scanner
+    queue_size = 4
+
+    def __init__(self, path, opener, name=None, rules=None):
+        self.path = path
+        self.name = name or path
+        self.rules = rules
+        self.opener = opener
+        self.pool = None
+        self.buf = b''
+        self.end = 0
+        self._blocks = None
+        self._done = None
+        self._stop = threading.Event()
+
+    def open(self, complete_lines=False, scanned=0):
+        # Compressed logs are finished, complete_lines and scanned don't
+        # apply.
+        self._stop = threading.Event()
+        self._done = threading.Event()
+        self._blocks = queue.Queue(self.queue_size)
+        (self.pool or ReaderPool(1)).submit(self._read)
+        return self
+
+    def close(self):
+        if self._done is None:
+            return
+        self._stop.set()
+        # Unblock the thread if it is waiting for room in the queue.
+        while not self._done.is_set():
+            try:
+                self._blocks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._done = None
+
+    def _read(self):
+        try:
+            if not self._stop.is_set():
+                self._decompress()
+        finally:
+            self._done.set()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decompress(self):
+        try:
+            log = self.opener(self.path)
+            try:
+                partial = b''
+                while True:
+                    data = log.read(self.block_size)
+                    if not data:
+                        break
+                    data = partial + data
+                    split = data.rfind(b'\n') + 1
+                    if not split:
+                        partial = data
+                        continue
+                    block, partial = data[:split], data[split:]
+                    cutoff = self._find_cutoff(block)
+                    if cutoff is not None:
+                        partial = b''
+                        block = block[:cutoff]
+                    if block and not self._put(block):
+                        return
+                    if cutoff is not None:
+                        break
+                if partial:
+                    self._put(partial[:self._find_cutoff(partial)])
+            finally:
+                log.close()
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(None)
+
+    @staticmethod
+    def _find_cutoff(block):
+        """Offset of the post build marker in a line aligned block"""
+        if block.startswith(POST_BUILD_MARKER):
+            return 0
+        marker = block.find(b'\n' + POST_BUILD_MARKER)
+        if marker == -1:
+            return None
+        return marker + 1
+
+    def _next_block(self):
+        block = self._blocks.get()
+        if isinstance(block, Exception):
+            raise block
+        return block
+
+    def segments(self, begin, before, after):
+        """Segments of the log, with before and after lines of context"""
+        carry = b''
+        offset = 0
+        ahead = collections.deque()
+        done = False
+        block = self._next_block()
+        while block is not None:
+            # Read ahead until there are enough lines for after context.
+            ahead_lines = sum(b.count(b'\n') for b in ahead)
+            while not done and ahead_lines < after:
+                next_block = self._next_block()
+                if next_block is None:
+                    done = True
+                else:
+                    ahead.append(next_block)
+                    ahead_lines += next_block.count(b'\n')
+            buf = carry + block + b''.join(ahead)
+            start = len(carry)
+            end = start + len(block)
+            yield Segment(buf, start, end, len(buf), offset - start)
+            self.end = offset + len(block)
+            # Keep the last lines of this block for the next one's before
+            # context.
+            carry_start = end
+            for _ in range(before):
+                if carry_start <= 0:
+                    break
+                carry_start = buf.rfind(b'\n', 0, carry_start - 1) + 1
+            carry = buf[carry_start:end]
+            offset += len(block)
+            if ahead:
+                block = ahead.popleft()
+            elif done:
+                block = None
+            else:
+                block = self._next_block()
+
+    def origin(self, offset, line):
+        return Origin(self.name, line, offset)
+
+
+def log_exists(path):
+    """Is there a log at path, or a compressed copy of one?"""
+    return os.path.exists(path) or any(
+        os.path.exists(path + suffix) for suffix in DECOMPRESSORS)
+
+
+def log_source(path, name=None, rules=None):
+    """A LogSource for path, or a StreamSource for a compressed copy"""
+    if not os.path.exists(path):
+        for suffix, opener in DECOMPRESSORS.items():
+            if os.path.exists(path + suffix):
+                return StreamSource(path + suffix, opener, name or path,
+                                    rules)
+    return LogSource(path, name, rules)
+
+
+class BuildLog(object):
+    """Build Log
+
+    The logs of one build, scanned as though they were concatenated. Each
+    source is given a base offset so that offsets are unique across the
+    whole build log, the base of a source after a compressed one is only
+    known once the Scanner has read it. complete_lines and scanned, the per
+    source ends of a previous scan, are passed on to LogSource.open. names
+    are the names of the logs in Origins, their paths if not given, and
+    rules the names of the rules each is scanned with, None for all.
+
+    Compressed sources are decompressed by up to readers threads, so that
+    the next few are read while the Scanner works through one.
+    """
+    readers = 4
+
+    def __init__(self, paths, complete_lines=False, scanned=None,
+                 names=None, rules=None):
+        self.sources = [log_source(path, name, source_rules)
+                        for path, name, source_rules in zip(
+                            paths, names or [None] * len(paths),
+                            rules or [None] * len(paths))]
+        self.complete_lines = complete_lines
+        if scanned is None or len(scanned) != len(self.sources):
+            scanned = [0] * len(self.sources)
+        self.scanned = scanned
+
+    def open(self):
+        base = 0
+        pool = ReaderPool(self.readers)
+        for source, scanned in zip(self.sources, self.scanned):
+            if source.streamed:
+                source.pool = pool
+            source.open(self.complete_lines, scanned)
+            source.base = base
+            base += source.end
+        return self
+
+    def close(self):
+        for source in self.sources:
+            source.close()
+
+    def search(self, pattern):
+        """Does pattern, a compiled bytes regex, match anywhere in the log?
+
+        Reads compressed sources to the end or the first match, the log
+        must be opened again to be scanned.
+        """
+        for source in self.sources:
+            for segment in source.segments(0, 0, 0):
+                if pattern.search(segment.buf, segment.start, segment.end):
+                    return True
+        return False
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,145 @@
+# Stdlib import
+import collections
+import fnmatch
+import glob
+import os
+
+# Project imports
+from logreader import DECOMPRESSORS
+from scanner import load_entries
+
+# # Log Sources
+# Which logs of a build are scanned for failures, and with which rules, are
+# declared in logs.yaml, see the comments in the file for its format. Most
+# jobs only have the console log and the logs of the two scripts the build
+# runs, but multinode and ceph jobs archive logs of each host, that are
+# only worth scanning with the rules that can match them.
+#
+# Log sources aren't part of the rule fingerprints, so changing them doesn't
+# make cached builds be reclassified, see reclassify.py.
+
+# Log sources shipped with build-summary
+LOG_SOURCES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'logs.yaml')
+
+# One log of a build: name is its path relative to the build folder, which
+# is what it is called in Origins, and rules the names of the rules it is
+# scanned with, None for all of them.
+Log = collections.namedtuple('Log', ['name', 'path', 'rules'])
+
+
+class LogSpec(object):
+    """Log Spec
+
+    One entry of logs.yaml, see there for the meaning of each argument.
+    """
+    def __init__(self, path, btypes=None, jobs=None, rules=None,
+                 enabled=True):
+        if os.path.isabs(path):
+            raise ValueError("Log {path} must be relative to the build "
+                             "folder".format(path=path))
+        self.path = path
+        self.btypes = btypes
+        self.jobs = jobs
+        self.rules = frozenset(rules) if rules is not None else None
+        self.enabled = enabled
+
+    def applies(self, job_name, btype):
+        if not self.enabled:
+            return False
+        if self.btypes is not None and btype not in self.btypes:
+            return False
+        if self.jobs is not None and not any(
+                fnmatch.fnmatch(job_name, job) for job in self.jobs):
+            return False
+        return True
+
+    def matches(self, name):
+        """Is the log called name one of this entry's?
+
+        As with glob, wildcards don't match across a /.
+        """
+        if not glob.has_magic(self.path):
+            return name == self.path
+        parts = self.path.split('/')
+        segments = name.split('/')
+        return len(parts) == len(segments) and all(
+            fnmatch.fnmatchcase(segment, part)
+            for segment, part in zip(segments, parts))
+
+    def names(self, build_folder):
+        """Paths of the logs in build_folder, relative to it
+
+        A plain path is always scanned, even if the log doesn't exist, so
+        that a running build's logs keep their places. A glob only matches
+        logs that exist, or a compressed copy of one.
+        """
+        if not glob.has_magic(self.path):
+            return [self.path]
+        names = set()
+        for suffix in [''] + list(DECOMPRESSORS):
+            for path in glob.glob(os.path.join(build_folder,
+                                               self.path + suffix)):
+                if os.path.isfile(path):
+                    names.add(os.path.relpath(
+                        path[:len(path) - len(suffix)], build_folder))
+        return sorted(names)
+
+
+class LogSources(object):
+    """Log Sources
+
+    The enabled entries of a log sources file, in order.
+    """
+    def __init__(self, specs):
+        self.specs = [spec for spec in specs if spec.enabled]
+
+    def logs(self, build_folder, job_name, btype):
+        """Logs to scan for a build, in the order they are scanned
+
+        A log matched by more than one entry is scanned once, with the
+        rules of the first.
+        """
+        logs = collections.OrderedDict()
+        for spec in self.specs:
+            if not spec.applies(job_name, btype):
+                continue
+            for name in spec.names(build_folder):
+                if name not in logs:
+                    logs[name] = Log(name, os.path.join(build_folder, name),
+                                     spec.rules)
+        return list(logs.values())
+
+    def rules(self, name, job_name, btype):
+        """Names of the rules the log called name is scanned with
+
+        None for all of them, or no rules if no entry has it any more. The
+        log doesn't need to exist, so that excerpts can be reclassified.
+        """
+        for spec in self.specs:
+            if spec.applies(job_name, btype) and spec.matches(name):
+                return spec.rules
+        return frozenset()
+
+    def check_rules(self, ruleset):
+        """Raise ValueError if an entry names a rule ruleset doesn't have
+
+        Disabled rules may be named. An unknown name would otherwise just
+        never match anything.
+        """
+        for spec in self.specs:
+            unknown = sorted((spec.rules or frozenset()) - ruleset.names)
+            if unknown:
+                raise ValueError("Log {path}: unknown rules {rules}".format(
+                    path=spec.path, rules=', '.join(unknown)))
+
+
+_log_sources = {}
+
+
+def load_log_sources(path=LOG_SOURCES_FILE):
+    """Load LogSources from a yaml or json file, once per process"""
+    if path not in _log_sources:
+        _log_sources[path] = LogSources(LogSpec(**entry)
+                                        for entry in load_entries(path))
+    return _log_sources[path]
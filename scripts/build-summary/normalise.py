@@ -0,0 +1,64 @@
+# Stdlib import
+import collections
+import re
+
+# Identifiers that are replaced in failures, in the order they are applied.
+# Order matters, a later pattern may match across the replacement for an
+# earlier one, eg '1.2.3.4:x.k1k.me' is all one **TX_ID**.
+NORMALISERS = [
+    (re.compile("([0-9a-zA-Z]+-){4}[0-9a-zA-Z]+"), '**UUID**'),
+    (re.compile(r"([0-9]+\.){3}[0-9]+"), '**IPv4**'),
+    (re.compile(r'(\[8mha:.*)?\[0m'), ''),
+    (re.compile(r'\S*k1k.me\S*'), '**TX_ID**'),
+    (re.compile(r'/\d+/entities(/[^/]*)?|/\d+/agent_tokens'), '**Entity**'),
+    (re.compile("'httpdTxnId': '[^']*'"), '**HTTP_TX_ID**'),
+    (re.compile('ansible-tmp-[^/]*'), 'ansible-tmp-**Removed**'),
+]
+
+# Matches if any of NORMALISERS would. Most failures contain no
+# identifiers, one search is enough to know they are left as they are.
+identifier_re = re.compile('|'.join(
+    '(?:{pattern})'.format(pattern=pattern.pattern)
+    for pattern, _ in NORMALISERS))
+
+
+class LRUCache(object):
+    """LRU Cache
+
+    Maps keys to values, dropping the least recently used once there are
+    more than size.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.items = collections.OrderedDict()
+
+    def get(self, key):
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            return None
+        self.items[key] = value
+        return value
+
+    def put(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+
+# The same failures come up in many builds, the cache is shared by every
+# build parsed in this process.
+_cache = LRUCache(10000)
+
+
+def normalise(failure):
+    """Remove identifiers from a failure, see NORMALISERS"""
+    normalised = _cache.get(failure)
+    if normalised is None:
+        normalised = failure
+        if identifier_re.search(failure):
+            for pattern, sub in NORMALISERS:
+                normalised = pattern.sub(sub, normalised)
+        _cache.put(failure, normalised)
+    return normalised
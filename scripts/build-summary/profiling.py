@@ -0,0 +1,93 @@
+# Stdlib import
+import contextlib
+import time
+
+
+class Profile(object):
+    """Profile
+
+    Where the time goes in a summary run: wall time for each phase, time
+    and hits for each rule, and the time taken by each build. Builds parsed
+    in a worker process get their own Profile, which is sent back and
+    merged in with add. Phases can nest, eg log_scan includes the candidate
+    line search timed as log_read and the time of each rule. Log bytes
+    that were scanned, and that were skipped by a windowed scan, are
+    counted for the run and for each build.
+    """
+    def __init__(self):
+        self.phases = {}
+        # rule name -> [seconds, hits]
+        self.rules = {}
+        # (seconds, key) for each build
+        self.builds = []
+        # [scanned, skipped] bytes
+        self.bytes = [0, 0]
+        # key -> [scanned, skipped] bytes for each build
+        self.build_bytes = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_rule(self, name, seconds, hits=0):
+        totals = self.rules.setdefault(name, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += hits
+
+    def add_bytes(self, scanned, skipped=0):
+        self.bytes[0] += scanned
+        self.bytes[1] += skipped
+
+    def add(self, other, key=None):
+        """Merge in the Profile of one build, or of another run"""
+        for name, seconds in other.phases.items():
+            self.add_time(name, seconds)
+        for name, (seconds, hits) in other.rules.items():
+            self.add_rule(name, seconds, hits)
+        self.builds.extend(other.builds)
+        self.add_bytes(*other.bytes)
+        self.build_bytes.update(other.build_bytes)
+        if key is not None:
+            self.builds.append((other.phases.get('build', 0.0), key))
+            self.build_bytes[key] = list(other.bytes)
+
+    def report(self, top=10):
+        return {
+            'phases': self.phases,
+            'rules': dict(
+                (name, {'seconds': seconds, 'hits': hits})
+                for name, (seconds, hits) in self.rules.items()),
+            'builds': len(self.builds),
+            'slowest_builds': [
+                {'build': key, 'seconds': seconds}
+                for seconds, key in sorted(self.builds, reverse=True)[:top]],
+            'bytes': {'scanned': self.bytes[0], 'skipped': self.bytes[1]},
+            'build_bytes': dict(
+                (key, {'scanned': scanned, 'skipped': skipped})
+                for key, (scanned, skipped) in self.build_bytes.items()),
+        }
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+def phase(profile, name):
+    """profile.phase(name), or a context that does nothing for no profile"""
+    if profile is None:
+        return _null_phase
+    return profile.phase(name)
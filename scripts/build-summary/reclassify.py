@@ -0,0 +1,181 @@
+# Stdlib import
+import os
+
+# Project imports
+from build import Build
+from excerpts import ExcerptLog
+from logreader import BuildLog
+from logreader import log_exists
+from logsources import load_log_sources
+from scanner import RuleSet
+
+# # Reclassifying Cached Builds
+# Each cached build records the fingerprint of every rule its logs were
+# scanned with, and which rule found each of its failures. When rules.yaml
+# changes, only the rules that changed or were added are run again, and
+# only over the logs of failed builds that contain one of their literals.
+# Failures found by changed or removed rules are dropped first, failures
+# found by unchanged rules are kept as they are.
+#
+# The changed rules that the build's excerpt has every line they could
+# match for, and the context they need, are run over that rather than the
+# logs, see excerpts.py. Jenkins may have deleted the logs by then, they are
+# only read for the rules the excerpt doesn't cover. Each log is scanned
+# with the rules the current log sources give it, see logsources.py.
+
+# Builds whose logs are scanned, see Build.get_failure_info
+SCANNED_RESULTS = ('FAILURE', 'ABORTED')
+
+
+def changed_rules(ruleset, record):
+    """Rules of ruleset that changed since record was scanned
+
+    Returns (rules to run again, names of rules whose failures are out of
+    date) for the cached BuildRecord record, given the current RuleSet.
+    """
+    if record.building or record.result not in SCANNED_RESULTS:
+        return [], set()
+    if record.ruleset == ruleset.fingerprints:
+        return [], set()
+    previous = dict(record.ruleset or ())
+    changed = [rule for rule in ruleset.rules
+               if previous.get(rule.name) != rule.fingerprint]
+    stale = set(previous) - set(name for name, _ in ruleset.fingerprints)
+    stale.update(rule.name for rule in changed)
+    return changed, stale
+
+
+def needs_reclassify(ruleset, record):
+    changed, stale = changed_rules(ruleset, record)
+    return bool(changed or stale)
+
+
+def log_position(origin, names):
+    """Sort key for Origins, in the order names, of the logs, are scanned"""
+    source = names.index(origin.source) if origin.source in names \
+        else len(names)
+    return source, origin.offset
+
+
+def excerpt_covers(excerpt, log_rules, rule):
+    """Can rule be run over excerpt rather than the logs?
+
+    log_rules maps the name of each log to the names of the rules it is
+    scanned with, None for all of them.
+    """
+    for name, names in log_rules.items():
+        if ((names is None or rule.name in names) and
+                not excerpt.covers(rule, name)):
+            return False
+    return True
+
+
+def scan_build(build_folder, record, rules, profile, log_sources,
+               build_log):
+    """Build of record scanned with rules, None if there is nothing to find
+
+    build_log is scanned, it is the build's logs if None.
+    """
+    subset = RuleSet(rules)
+    if build_log is None:
+        logs = log_sources.logs(build_folder, record.job_name, record.btype)
+        log = BuildLog([log.path for log in logs],
+                       names=[log.name for log in logs],
+                       rules=[log.rules for log in logs])
+    else:
+        log = build_log
+    with log:
+        if not log.search(subset.rule_prefilter):
+            return None
+    return Build(build_folder=build_folder,
+                 job_name=record.job_name,
+                 build_num=record.build_num,
+                 rules=subset,
+                 profile=profile,
+                 build_log=build_log,
+                 log_sources=log_sources)
+
+
+def missing_logs(build_folder, record, excerpt, logs):
+    """Names of the logs of the build that were scanned but are gone now
+
+    With an excerpt those are the logs that had anything in them when they
+    were scanned. Without one, the first of logs, the console log, and
+    those that failures were found in.
+    """
+    if excerpt is not None:
+        names = set(name for name, _, end in excerpt.sources if end)
+    else:
+        names = set(origin.source for _, origin in record.origins)
+        names.update(log.name for log in logs[:1])
+    return sorted(name for name in names
+                  if not log_exists(os.path.join(build_folder, name)))
+
+
+def reclassify(build_folder, ruleset, record, profile=None, excerpt=None,
+               log_sources=None):
+    """record with its failures brought up to date with ruleset
+
+    excerpt is the build's excerpts.Excerpt, if it has one. log_sources is
+    the logsources.LogSources to scan, those in logs.yaml if not given.
+
+    If rules that the excerpt doesn't cover need logs that are missing,
+    those rules keep their failures and fingerprints, so the build still
+    needs reclassifying, see needs_reclassify.
+    """
+    changed, stale = changed_rules(ruleset, record)
+    log_sources = log_sources or load_log_sources()
+    names = []
+    covered = []
+    scans = []
+    if changed and excerpt is not None:
+        names = [name for name, _, _ in excerpt.sources]
+        log_rules = dict(
+            (name, log_sources.rules(name, record.job_name, record.btype))
+            for name in names)
+        covered = [rule for rule in changed
+                   if excerpt_covers(excerpt, log_rules, rule)]
+        if covered:
+            scans.append((covered, ExcerptLog(excerpt, log_rules)))
+    uncovered = [rule for rule in changed if rule not in covered]
+    unscanned = set()
+    if uncovered:
+        logs = log_sources.logs(build_folder, record.job_name, record.btype)
+        if missing_logs(build_folder, record, excerpt, logs):
+            unscanned = set(rule.name for rule in uncovered)
+            stale -= unscanned
+        else:
+            scans.append((uncovered, None))
+            names.extend(log.name for log in logs if log.name not in names)
+    failure_rules = set(
+        (failure, rule) for failure, rule in record.failure_rules
+        if rule not in stale and failure != 'Unknown Failure')
+    kept = set(failure for failure, _ in failure_rules)
+    origins = dict((failure, origin) for failure, origin in record.origins
+                   if failure in kept)
+    for rules, build_log in scans:
+        build = scan_build(build_folder, record, rules, profile,
+                           log_sources, build_log)
+        if build is None:
+            continue
+        failure_rules.update(
+            (failure, rule) for failure, rule in build.failure_rules
+            if failure != 'Unknown Failure')
+        # The first time a failure was found may be by a kept rule or a
+        # changed one.
+        for failure, origin in build.origins.items():
+            if (failure not in origins or
+                    log_position(origin, names) <
+                    log_position(origins[failure], names)):
+                origins[failure] = origin
+    if not failure_rules:
+        failure_rules.add(('Unknown Failure', ''))
+    previous = dict(record.ruleset or ())
+    return record._replace(
+        failures=frozenset(failure for failure, _ in failure_rules),
+        failure_rules=frozenset(failure_rules),
+        ruleset=tuple(
+            (name, previous[name] if name in unscanned else fingerprint)
+            for name, fingerprint in ruleset.fingerprints
+            if name not in unscanned or name in previous),
+        origins=frozenset(origins.items()))
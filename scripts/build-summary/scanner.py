@@ -0,0 +1,662 @@
+# Stdlib import
+import collections
+import hashlib
+import json
+import os
+import re
+import time
+
+# Project imports
+from taskindex import decode
+from profiling import phase
+from taskindex import TaskIndex
+
+
+# Rules shipped with build-summary, see the comments in the file for its
+# format.
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'rules.yaml')
+
+
+class Rule(object):
+    """Failure Rule
+
+    Describes one failure that can be found in a build log, see rules.yaml
+    for the meaning of each argument. literals are plain strings, at least
+    one of which must be present in any line that pattern can match. They
+    are used to cheaply reject lines before the full pattern is tried.
+
+    Rules without a handler add their formatted message as a failure. A
+    handler is the name of a Build method that is called with each Hit
+    instead, if it returns an int the rule is not tried again for that many
+    lines.
+
+    fingerprint is a hash of everything that decides what the rule finds,
+    builds record the fingerprints of the rules they were scanned with so
+    that they can be reclassified when a rule changes, see reclassify.py.
+    Changes to a handler's code are not part of it, nor is full_scan, which
+    only decides how much of a log is scanned, see Scanner.
+    """
+    def __init__(self, name, message, pattern=None, literals=None,
+                 string=None, handler=None, first_only=False,
+                 previous_task=False, ignoring=None, before=0, after=0,
+                 enabled=True, full_scan=False):
+        if string is not None:
+            pattern = re.escape(string)
+            literals = [string]
+        if pattern is None or not literals:
+            raise ValueError("Rule {name} needs a string or a pattern and "
+                             "literals".format(name=name))
+        if ignoring not in (None, 'task', 'next_line'):
+            raise ValueError("Rule {name}: unknown ignoring {ignoring}"
+                             .format(name=name, ignoring=ignoring))
+        self.name = name
+        self.message = message
+        self.pattern = re.compile(pattern)
+        self.literals = tuple(literals)
+        self.handler = handler
+        self.first_only = first_only
+        self.previous_task = previous_task
+        self.ignoring = ignoring
+        self.before = before
+        self.after = max(after, 1) if ignoring == 'next_line' else after
+        self.enabled = enabled
+        self.full_scan = full_scan
+        self.fingerprint = hashlib.sha1(json.dumps(dict(
+            message=message, pattern=pattern, literals=list(literals),
+            handler=handler, first_only=first_only,
+            previous_task=previous_task, ignoring=ignoring, before=before,
+            after=after), sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    def candidate(self, line):
+        for literal in self.literals:
+            if literal in line:
+                return True
+        return False
+
+    def match(self, line):
+        if self.candidate(line):
+            return self.pattern.search(line)
+        return None
+
+    def ignored(self, hit, task_index):
+        if self.ignoring == 'task':
+            return task_index.ignored(hit.offset)
+        elif self.ignoring == 'next_line':
+            return any('...ignoring' in line for line in hit.after[:1])
+        return False
+
+    def format(self, hit, **extra):
+        match = hit.match
+        fields = match.groupdict()
+        fields.update(
+            match=match.group(),
+            line=hit.line,
+            previous_line=hit.before[-1] if hit.before else '',
+            previous_task=hit.previous_task)
+        fields.update(extra)
+        return self.message.format(match.group(), *match.groups(), **fields)
+
+
+def load_entries(path):
+    """Read the entries of a yaml or json rules or log sources file"""
+    with open(path) as entries_file:
+        if path.endswith('.json'):
+            return json.load(entries_file)
+        # Only needed for yaml files
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("PyYAML is needed to read {path}, install it"
+                              " or use a json file".format(path=path))
+        return yaml.safe_load(entries_file)
+
+
+_rulesets = {}
+
+
+def load_rules(path=RULES_FILE):
+    """Load a RuleSet from a yaml or json file
+
+    Rule sets are cached, so each file is only read and its patterns
+    compiled once per process.
+    """
+    if path not in _rulesets:
+        _rulesets[path] = RuleSet(Rule(**entry)
+                                  for entry in load_entries(path))
+    return _rulesets[path]
+
+
+class RuleSet(object):
+    """Rule Set
+
+    The enabled rules plus the literals used to find candidate lines. Lines
+    that don't contain any of literals can't match any rule or be a task
+    marker, so they are never decoded or looked at from python.
+    rule_prefilter only contains the rule literals, it keeps the many task
+    header lines away from decoding and the per-rule checks. fingerprints
+    is a sorted tuple of (name, fingerprint) for the rules, and
+    literal_context maps each rule literal to the most lines of context
+    before and after any rule with that literal needs. names are the
+    names of all the rules, enabled or not.
+    """
+    def __init__(self, rules):
+        self._subsets = {}
+        rules = list(rules)
+        self.names = frozenset(rule.name for rule in rules)
+        self.rules = [rule for rule in rules if rule.enabled]
+        literals = []
+        for rule in self.rules:
+            literals.extend(rule.literals)
+        # Longest first so that the alternation doesn't stop at a shorter
+        # literal that is a prefix of a longer one.
+        self.rule_prefilter = re.compile(b'|'.join(
+            re.escape(literal.encode('utf-8'))
+            for literal in sorted(set(literals), key=len, reverse=True)))
+        self.literals = sorted(
+            set(literal.encode('utf-8')
+                for literal in literals + list(TaskIndex.literals)))
+        # Most lines of context any rule needs
+        self.before = max([rule.before for rule in self.rules] + [0])
+        self.after = max([rule.after for rule in self.rules] + [0])
+        self.fingerprints = tuple(sorted(
+            (rule.name, rule.fingerprint) for rule in self.rules))
+        self.literal_context = {}
+        for rule in self.rules:
+            for literal in rule.literals:
+                before, after = self.literal_context.get(
+                    literal.encode('utf-8'), (0, 0))
+                self.literal_context[literal.encode('utf-8')] = (
+                    max(before, rule.before), max(after, rule.after))
+
+    def subset(self, names):
+        """RuleSet of the rules named in names
+
+        For logs that are only scanned with some of the rules, see
+        logsources.py.
+        """
+        names = frozenset(names)
+        if names not in self._subsets:
+            self._subsets[names] = RuleSet(
+                rule for rule in self.rules if rule.name in names)
+        return self._subsets[names]
+
+
+class Hit(object):
+    """Hit
+
+    A line matched by a rule. offset is the offset of the start of the line
+    in the build log, before and after are the decoded lines either side of
+    it, in log order, as requested by the rule. origin is the
+    logreader.Origin of the line.
+    """
+    def __init__(self, rule, offset, line, match, previous_task,
+                 before, after, after_offsets, origin=None):
+        self.rule = rule
+        self.offset = offset
+        self.origin = origin
+        self.line = line
+        self.match = match
+        self.previous_task = previous_task
+        self.before = before
+        self.after = after
+        self.after_offsets = after_offsets
+
+
+# Bytes of a memory mapped log copied at a time to count its lines
+COUNT_BLOCK = 2 ** 20
+
+
+def count_lines(buf, start, end):
+    """Number of newlines in buf[start:end]"""
+    if isinstance(buf, bytes):
+        return buf.count(b'\n', start, end)
+    # mmaps don't have count
+    lines = 0
+    for pos in range(start, end, COUNT_BLOCK):
+        lines += buf[pos:min(pos + COUNT_BLOCK, end)].count(b'\n')
+    return lines
+
+
+def line_end(buf, start, end):
+    newline = buf.find(b'\n', start, end)
+    if newline == -1:
+        return end
+    return newline + 1
+
+
+class ScanState(object):
+    """Scan State
+
+    Where a Scanner got to in a build log, kept with the build so that a
+    later scan of a log that is still being written only reads what has
+    been appended. ends are the per source offsets scanned up to, lines
+    the number of lines before them and names the names of the sources.
+    Rules are referred to by name so that the state can be pickled.
+
+    Hits that can't be decided yet, because their context runs off the end
+    of the log or there is no task after them to bound '...ignoring', are
+    kept in pending as (rule name, offset, previous task, line number) and
+    tried again by the next scan.
+
+    If excerpt is an excerpts.Excerpt the scanner adds the lines it looks
+    at to it.
+    """
+    # States pickled before there were excerpts or source names don't have
+    # them
+    excerpt = None
+    names = None
+
+    def __init__(self):
+        self.ends = []
+        self.lines = []
+        self.task_index = TaskIndex()
+        # first_only rules that have matched
+        self.done = set()
+        # rule name -> offset of the first line the rule may match again
+        self.resume = {}
+        self.pending = []
+
+    def resumable(self, build_log):
+        """Can a scan of build_log carry on from this state?
+
+        Logs are only appended to, and only the last one with any content
+        can grow, otherwise the offsets in this state no longer line up.
+        """
+        if len(build_log.sources) != len(self.ends):
+            return False
+        if self.names is not None and self.names != [
+                source.name for source in build_log.sources]:
+            return False
+        if any(source.streamed for source in build_log.sources):
+            return False
+        grown = False
+        for source, end in zip(build_log.sources, self.ends):
+            if source.end < end or (grown and end):
+                return False
+            if end and source.buf[end - 1:end] != b'\n':
+                return False
+            if source.end > end:
+                grown = True
+        return True
+
+
+class Scanner(object):
+    """Scanner
+
+    Runs every rule in a RuleSet over a BuildLog, or the subset of it a
+    source's rules name. Candidate lines are found by searching each
+    segment of each source for the literals of its rules, so
+    the bulk of a log is only ever touched by find and only candidate lines
+    are decoded. The same pass fills in task_index, failures are added to
+    target once the whole log has been read so that rules can ask the index
+    about tasks after their match.
+
+    A scan starts from where state says the last one stopped, see
+    ScanState. If a profiling.Profile is given the time spent finding
+    candidate lines, the time and hits of each rule and the bytes scanned
+    are added to it.
+
+    If window is (head, tail) only lines starting in the first head bytes
+    or the last tail bytes of each log are scanned, the lines between are
+    only counted, and searched backwards for the task a failure at the
+    start of the tail window would be in, see skip_segment. skipped
+    is the number of bytes that weren't scanned, and full_scan_hits the
+    names of full_scan rules that matched. Window scans aren't resumable.
+    """
+    def __init__(self, ruleset, target, state=None, profile=None,
+                 window=None):
+        self.ruleset = ruleset
+        self.target = target
+        self.state = state or ScanState()
+        self.task_index = self.state.task_index
+        self.profile = profile
+        self.window = window
+        self.skipped = 0
+        self.full_scan_hits = set()
+
+    @staticmethod
+    def candidate_lines(buf, start, end, literals):
+        """Sorted offsets of lines in buf[start:end] containing any literal"""
+        starts = set()
+        for literal in literals:
+            pos = buf.find(literal, start, end)
+            while pos != -1:
+                starts.add(buf.rfind(b'\n', 0, pos) + 1)
+                # One hit per line is enough, carry on from the next line.
+                pos = buf.find(b'\n', pos, end)
+                if pos != -1:
+                    pos = buf.find(literal, pos, end)
+        return sorted(starts)
+
+    @staticmethod
+    def context(buf, start, end, before, after):
+        before_lines = []
+        line_start = start
+        while len(before_lines) < before and line_start > 0:
+            prev_start = buf.rfind(b'\n', 0, line_start - 1) + 1
+            before_lines.insert(0, decode(buf[prev_start:line_start]))
+            line_start = prev_start
+        after_lines = []
+        after_offsets = []
+        line_start = line_end(buf, start, end)
+        while len(after_lines) < after and line_start < end:
+            next_start = line_end(buf, line_start, end)
+            after_lines.append(decode(buf[line_start:next_start]))
+            after_offsets.append(line_start)
+            line_start = next_start
+        return before_lines, after_lines, after_offsets
+
+    def hit(self, rule, buf, limit, base, start, line, match,
+            previous_task, origin):
+        """Hit for the line at buf[start:], base is the offset of buf"""
+        before, after, after_offsets = self.context(
+            buf, start, limit, rule.before, rule.after)
+        return Hit(rule, base + start, line, match, previous_task,
+                   before, after, [base + o for o in after_offsets], origin)
+
+    def pending_hits(self, build_log):
+        """Rebuild the hits a previous scan couldn't decide"""
+        rules = dict((rule.name, rule) for rule in self.ruleset.rules)
+        hits = []
+        for name, offset, previous_task, number in self.state.pending:
+            rule = rules.get(name)
+            if rule is None:
+                continue
+            for source in build_log.sources:
+                if source.base <= offset < source.base + source.end:
+                    break
+            start = offset - source.base
+            line = decode(source.buf[start:line_end(
+                source.buf, start, source.end)])
+            hits.append(self.hit(rule, source.buf, source.end, source.base,
+                                 start, line, rule.pattern.search(line),
+                                 previous_task, source.origin(start, number)))
+        return hits
+
+    @staticmethod
+    def windows(segments, head, tail):
+        """(segment, scan) for the pieces of a source's segments
+
+        Pieces are whole lines, scan is True for those in the first head
+        or the last tail bytes. The end of a compressed source is only
+        known once it has been read, so the segments that may be in the
+        tail are held until then.
+        """
+        held = collections.deque()
+        held_bytes = 0
+        for segment in segments:
+            head_end = head - segment.offset
+            if head_end > segment.start:
+                split = segment.end
+                if head_end < segment.end:
+                    split = line_end(segment.buf, head_end - 1, segment.end)
+                yield segment._replace(end=split), True
+                segment = segment._replace(start=split)
+            if segment.start >= segment.end:
+                continue
+            held.append(segment)
+            held_bytes += segment.end - segment.start
+            while held and held_bytes - (held[0].end - held[0].start) >= tail:
+                piece = held.popleft()
+                held_bytes -= piece.end - piece.start
+                yield piece, False
+        if not held:
+            return
+        first = held.popleft()
+        tail_start = held_bytes - tail + first.start
+        if tail_start > first.start:
+            split = line_end(first.buf, tail_start - 1, first.end)
+            yield first._replace(end=split), False
+            first = first._replace(start=split)
+        yield first, True
+        for piece in held:
+            yield piece, True
+
+    @staticmethod
+    def last_line(buf, start, end, literals):
+        """Offset of the last header line in buf[start:end], -1 if none
+
+        A header line has one of literals followed by a ], as
+        TaskIndex.add checks.
+        """
+        found = -1
+        for literal in literals:
+            pos = buf.rfind(literal, start, end)
+            while pos > found:
+                line_start = buf.rfind(b'\n', 0, pos) + 1
+                if buf.find(b']', pos, line_end(buf, pos, end)) != -1:
+                    found = line_start
+                    break
+                pos = buf.rfind(literal, start, pos)
+        return found
+
+    @staticmethod
+    def first_line(buf, start, end, literals):
+        """Offset of the first header line in buf[start:end], -1 if none
+
+        As last_line, from the start of buf[start:end].
+        """
+        found = -1
+        for literal in literals:
+            pos = buf.find(literal, start, end)
+            while pos != -1 and (found == -1 or pos < found):
+                line_start = buf.rfind(b'\n', 0, pos) + 1
+                next_start = line_end(buf, pos, end)
+                if buf.find(b']', pos, next_start) != -1:
+                    found = line_start
+                    break
+                pos = buf.find(literal, next_start, end)
+        return found
+
+    def skip_segment(self, segment, base):
+        """Count the lines of a segment that isn't scanned
+
+        Its last task header, and the play headers either side of that,
+        are added to task_index, so that it describes the task a failure
+        after the segment is in as it would if the segment were scanned.
+        So are its first task header and the '...ignoring' markers before
+        that, so that failures before the segment are ignored as they
+        would be.
+        """
+        buf, start, end = segment.buf, segment.start, segment.end
+        task_literals = (b'TASK [', b'TASK: [')
+        task = self.last_line(buf, start, end, task_literals)
+        headers = [task, self.last_line(buf, start, end, (b'PLAY [',))]
+        if task != -1 and headers[1] > task:
+            headers.append(self.last_line(buf, start, task, (b'PLAY [',)))
+        first_task = self.first_line(buf, start, end, task_literals)
+        headers.append(first_task)
+        ignore_end = end if first_task == -1 else first_task
+        pos = buf.find(b'...ignoring', start, ignore_end)
+        while pos != -1:
+            headers.append(buf.rfind(b'\n', 0, pos) + 1)
+            pos = buf.find(b'...ignoring', line_end(buf, pos, ignore_end),
+                           ignore_end)
+        for header in sorted(set(headers) - set([-1])):
+            self.task_index.add(base + header,
+                                buf[header:line_end(buf, header, end)])
+        self.skipped += end - start
+        return count_lines(buf, start, end)
+
+    def undecided(self, hit):
+        """Could more of the log change what is done with hit?"""
+        rule = hit.rule
+        return (len(hit.after) < rule.after
+                or (rule.ignoring == 'task'
+                    and self.task_index.next_task_offset(hit.offset) is None))
+
+    def dispatch(self, hit):
+        """Add hit's failure to target, returns lines to skip"""
+        rule = hit.rule
+        if rule.handler is None:
+            self.target.add_failure(rule.format(hit), rule.name, hit.origin)
+            return 0
+        return getattr(self.target, rule.handler)(hit)
+
+    def source_rules(self, source):
+        """The RuleSet source is scanned with"""
+        if source.rules is None:
+            return self.ruleset
+        return self.ruleset.subset(source.rules)
+
+    def scan_segment(self, segment, source, index, ruleset, active, lines):
+        """(hits, lines) for one segment of the index'th source of a log
+
+        Rules in active, of ruleset, are tried against each candidate line,
+        first_only rules are removed from it once they have matched. lines
+        is the number of lines in the source before the segment, and is
+        returned with those of the segment added.
+        """
+        profile = self.profile
+        excerpt = self.state.excerpt
+        rule_prefilter = ruleset.rule_prefilter.search
+        buf = segment.buf
+        end = segment.end
+        base = source.base + segment.offset
+        with phase(profile, 'log_read'):
+            candidates = self.candidate_lines(buf, segment.start, end,
+                                              ruleset.literals)
+        hits = []
+        counted = segment.start
+        for start in candidates:
+            lines += count_lines(buf, counted, start)
+            counted = start
+            raw = buf[start:line_end(buf, start, end)]
+            self.task_index.add(base + start, raw)
+            if excerpt is not None:
+                excerpt.add_line(base + start, raw, lines + 1)
+            if not rule_prefilter(raw):
+                continue
+            if excerpt is not None:
+                excerpt.add_context(index, raw, buf, start, segment.limit,
+                                    base, lines + 1)
+            line = decode(raw)
+            for rule in list(active):
+                if profile is None:
+                    match = rule.match(line)
+                else:
+                    rule_start = time.time()
+                    match = rule.match(line)
+                    profile.add_rule(rule.name, time.time() - rule_start,
+                                     1 if match else 0)
+                if not match:
+                    continue
+                previous_task = ''
+                if rule.previous_task:
+                    previous_task = self.task_index.previous_task()
+                hits.append(self.hit(
+                    rule, buf, segment.limit, base, start, line, match,
+                    previous_task,
+                    source.origin(segment.offset + start, lines + 1)))
+                if rule.first_only:
+                    active.remove(rule)
+                    self.state.done.add(rule.name)
+        with phase(profile, 'log_read'):
+            lines += count_lines(buf, counted, end)
+        return hits, lines
+
+    def scan(self, build_log, final=True):
+        """Scan build_log from where the last scan stopped
+
+        If final is False the log is still being written, hits that more
+        of the log could change are left in state.pending rather than
+        being added to target.
+        """
+        state = self.state
+        profile = self.profile
+        excerpt = state.excerpt
+        hits = self.pending_hits(build_log)
+        scanned = state.ends or [0] * len(build_log.sources)
+        scanned_lines = state.lines or [0] * len(build_log.sources)
+        state.lines = []
+        base = 0
+        scanned_bytes = 0
+        for index, (source, begin) in enumerate(
+                zip(build_log.sources, scanned)):
+            # The length of a compressed source is only known once it has
+            # been read, so bases are set as the sources are scanned.
+            source.base = base
+            lines = scanned_lines[index] if begin else 0
+            if not begin:
+                self.task_index.start_source(base)
+            ruleset = self.source_rules(source)
+            active = [rule for rule in ruleset.rules
+                      if rule.name not in state.done]
+            if excerpt is not None:
+                if ruleset is not self.ruleset:
+                    excerpt.searched[source.name] = sorted(set(
+                        literal for rule in ruleset.rules
+                        for literal in rule.literals))
+                if begin:
+                    excerpt.resume(index, source.buf, begin, source.end,
+                                   base, lines + 1)
+            before = ruleset.before
+            if excerpt is not None:
+                # The last segment of a compressed source must hold the
+                # lines set_tail keeps.
+                before = max(before, excerpt.tail_lines)
+            segments = source.segments(begin, before, ruleset.after)
+            if self.window:
+                segments = self.windows(segments, *self.window)
+            else:
+                segments = ((segment, True) for segment in segments)
+            last = None
+            while True:
+                with phase(profile, 'log_read'):
+                    segment, scan = next(segments, (None, False))
+                if segment is None:
+                    break
+                if not scan:
+                    lines += self.skip_segment(
+                        segment, source.base + segment.offset)
+                    continue
+                segment_hits, lines = self.scan_segment(
+                    segment, source, index, ruleset, active, lines)
+                hits.extend(segment_hits)
+                scanned_bytes += segment.end - segment.start
+                last = segment
+            if excerpt is not None and last is not None:
+                excerpt.set_tail(index, last.buf, last.end,
+                                 source.base + last.offset, lines)
+            state.lines.append(lines)
+            base += source.end
+        state.ends = [source.end for source in build_log.sources]
+        state.names = [source.name for source in build_log.sources]
+        if profile is not None:
+            profile.add_bytes(scanned_bytes, self.skipped)
+        if excerpt is not None:
+            excerpt.sources = [(source.name, source.base, source.end)
+                               for source in build_log.sources]
+
+        # Rules with an undecided hit, their later hits must wait too so
+        # that they are handled in order.
+        waiting = set()
+        state.pending = []
+        for hit in hits:
+            rule = hit.rule
+            if rule.full_scan and self.skipped:
+                self.full_scan_hits.add(rule.name)
+            if rule.name in waiting or (not final and self.undecided(hit)):
+                waiting.add(rule.name)
+                state.pending.append(
+                    (rule.name, hit.offset, hit.previous_task,
+                     hit.origin.line))
+                continue
+            if (state.resume.get(rule.name, 0) > hit.offset
+                    or rule.ignored(hit, self.task_index)):
+                continue
+            if profile is not None:
+                rule_start = time.time()
+            skip = self.dispatch(hit)
+            if profile is not None:
+                profile.add_rule(rule.name, time.time() - rule_start)
+            if skip:
+                state.resume[rule.name] = hit.after_offsets[skip - 1] + 1
+
+        # Later scans only ask about offsets after the first pending hit.
+        if state.pending:
+            self.task_index.forget(state.pending[0][1])
+        elif build_log.sources:
+            last = build_log.sources[-1]
+            self.task_index.forget(last.base + last.end)
@@ -0,0 +1,152 @@
+# Stdlib import
+import collections
+import hashlib
+import json
+import os
+
+# # Summary Data Shards
+# The summary page's tables are filled in by the browser from JSON files in
+# a data folder, rather than being rendered into the page. Builds are split
+# into a file for each day, so a day that hasn't changed is neither
+# rewritten nor fetched again: each file's URL carries a hash of its
+# content. MANIFEST lists the files and hashes that were written, so that
+# unchanged ones are skipped and old ones removed next time. The summary
+# only reads the builds of the days that changed, the shards of the other
+# days are kept as the manifest lists them.
+
+MANIFEST = 'shards.json'
+
+
+def dumps(data):
+    # sorted and compact so that the same data always hashes the same.
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def write_file(path, text):
+    # Write then rename, so the web server never serves half a file.
+    tmp_path = '{path}.tmp'.format(path=path)
+    with open(tmp_path, 'wb') as f:
+        f.write(text.encode('utf-8'))
+    os.rename(tmp_path, path)
+
+
+def failure_rows(failcount):
+    rows = []
+    for failure, fail in failcount.items():
+        rows.append([fail['count'],
+                     failure,
+                     fail['histogram'],
+                     str(fail['oldest']),
+                     fail['oldest_job'],
+                     str(fail['newest']),
+                     str(fail['newest_bobj'].timestamp),
+                     fail['oldest_bobj'].job_name,
+                     fail['newest_bobj'].job_name,
+                     fail['newest_job'],
+                     fail.get('variants', [])])
+    return rows
+
+
+def build_rows(buildobjs):
+    """Rows of the builds table, by day
+
+    Each failure is [failure, log name, line number, offset], or just
+    [failure] if where it was found isn't known.
+    """
+    days = collections.defaultdict(list)
+    for build in buildobjs:
+        origins = dict(build.origins)
+        days[build.timestamp.date().isoformat()].append(
+            [str(build.timestamp),
+             build.result,
+             build.branch,
+             [[cause.url, cause.name, cause.build_num]
+              for cause in build.build_hierachy],
+             [[failure] + list(origins.get(failure, ()))
+              for failure in sorted(build.failures)],
+             build.job_name,
+             build.build_num])
+    for rows in days.values():
+        rows.sort()
+    return days
+
+
+def periodic_cells(buildcount, periodichistogram, buckets):
+    """Success rate and histograms for each periodic build type
+
+    {series}_{btype}_{trigger} -> p, the success percentage of the last
+    two days, s and f, the SUCCESS and FAILURE histograms of buckets
+    counts, and max.
+    """
+    def cell(name):
+        return cells.setdefault(
+            name, dict(p=0, s=[0] * buckets, f=[0] * buckets, max=0))
+    cells = {}
+    for name, tsf in buildcount.items():
+        cell(name)['p'] = tsf.s_percent
+    for name, value in periodichistogram.items():
+        if name.endswith('_stats'):
+            cell(name[:-len('_stats')])['max'] = value['max']
+        elif name.endswith('_SUCCESS'):
+            cell(name[:-len('_SUCCESS')])['s'] = value
+        elif name.endswith('_FAILURE'):
+            cell(name[:-len('_FAILURE')])['f'] = value
+    return cells
+
+
+class ShardWriter(object):
+    """Shard Writer
+
+    Writes named JSON shards to data_dir, skipping those whose content
+    hasn't changed since the last run. Shards whose data is known not to
+    have changed can be kept without making their content at all. url
+    returns the URL of a shard relative to the page, with its hash so that
+    browsers cache it until it changes.
+    """
+    def __init__(self, data_dir, url_prefix):
+        self.data_dir = data_dir
+        self.url_prefix = url_prefix
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        self.previous = {}
+        try:
+            with open(os.path.join(data_dir, MANIFEST)) as f:
+                self.previous = json.load(f)
+        except (IOError, ValueError):
+            pass
+        self.hashes = {}
+        self.written = 0
+
+    def write(self, name, data):
+        text = dumps(data)
+        digest = content_hash(text)
+        self.hashes[name] = digest
+        path = os.path.join(self.data_dir, name)
+        if self.previous.get(name) != digest or not os.path.exists(path):
+            write_file(path, text)
+            self.written += 1
+
+    def keep(self, name):
+        """Keep the shard the last run wrote, False if there isn't one"""
+        path = os.path.join(self.data_dir, name)
+        if name not in self.previous or not os.path.exists(path):
+            return False
+        self.hashes[name] = self.previous[name]
+        return True
+
+    def url(self, name):
+        return '{prefix}{name}?h={hash}'.format(
+            prefix=self.url_prefix, name=name, hash=self.hashes[name])
+
+    def finish(self):
+        """Write the manifest, remove shards not written or kept"""
+        for name in set(self.previous) - set(self.hashes):
+            path = os.path.join(self.data_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+        write_file(os.path.join(self.data_dir, MANIFEST),
+                   dumps(self.hashes))
@@ -0,0 +1,144 @@
+# Stdlib import
+import array
+import bisect
+import re
+
+
+def decode(raw):
+    return raw.decode('utf-8', 'replace')
+
+
+class TaskIndex(object):
+    """Task Index
+
+    Sorted offsets of the ansible TASK headers and '...ignoring' markers in
+    a log. It is filled in by the Scanner as it reads the log, so finding
+    whether a failure was ignored is a bisect rather than a rescan of the
+    log. The scanner also asks for the previous task as it finds each
+    failure, so only the most recent TASK and PLAY header lines are kept.
+    A build's logs share an index, each starts with start_source so that
+    tasks and markers of one log aren't applied to failures in another.
+    """
+    # Strings that must be present in any line add() is interested in. The
+    # Scanner includes them in its prefilter.
+    literals = ('TASK: [', 'TASK [', 'PLAY [', '...ignoring')
+
+    task_re = re.compile(r'TASK:? \[((?P<role>.*)\|)?(?P<task>.*)\]')
+    play_re = re.compile(r'PLAY \[(?P<play>.*)\]')
+
+    # Indexes pickled before each log was indexed on its own don't have
+    # these. starts are the offsets the logs start at, start the last.
+    start = 0
+    starts = ()
+
+    def __init__(self):
+        self.task_offsets = array.array('l')
+        self.ignore_offsets = array.array('l')
+        self.play = None
+        self.task = None
+        self.task_play = None
+        self._previous_task = None
+        self.start = 0
+        self.starts = ()
+
+    def start_source(self, offset):
+        """Start indexing the log that starts at offset
+
+        Its first task is unknown until it has a TASK header of its own.
+        """
+        self.play = None
+        self.task = None
+        self.task_play = None
+        self._previous_task = None
+        self.start = offset
+        self.starts += (offset,)
+
+    def add(self, offset, raw):
+        """Record any markers in raw, lines must be added in order
+
+        raw is the undecoded line, it is only decoded if a failure needs to
+        know the task. The header checks are cheap equivalents of
+        task_re/play_re matching, the header literal followed by a ]
+        somewhere later in the line. The first line of a log is never used
+        as the task or play.
+        """
+        play = raw.find(b'PLAY [')
+        if play != -1 and raw.find(b']', play) != -1 and offset != self.start:
+            self.play = raw
+        task = raw.find(b'TASK [')
+        colon_task = raw.find(b'TASK: [')
+        if colon_task != -1 and (task == -1 or colon_task < task):
+            task = colon_task
+        if task != -1 and raw.find(b']', task) != -1:
+            self.task_offsets.append(offset)
+            if offset != self.start:
+                self.task = raw
+                self.task_play = self.play
+                self._previous_task = None
+        if b'...ignoring' in raw:
+            self.ignore_offsets.append(offset)
+
+    def previous_task(self):
+        """Describe the last task started at or before the current line"""
+        if self._previous_task is None:
+            self._previous_task = self._describe(self.task, self.task_play)
+        return self._previous_task
+
+    def _describe(self, task, play):
+        if task is None or play is None:
+            return ""
+        task_groups = self.task_re.search(decode(task)).groupdict()
+        play = self.play_re.search(decode(play)).group('play')
+        # If we match the last task to be executed
+        # chances are the failure happened post-ansible,
+        # so the last task indicator isn't that useful.
+        if (task_groups['task'].strip()
+                == 'Deploy RPC HAProxy configuration files'):
+            return 'N/A'
+        if task_groups['role']:
+            return '{play} / {role} / {task}'.format(
+                role=task_groups['role'],
+                play=play,
+                task=task_groups['task'])
+        else:
+            return '{play} / {task}'.format(
+                play=play,
+                task=task_groups['task'])
+
+    def next_task_offset(self, offset):
+        """Offset of the first task at or after offset, or None
+
+        Tasks in a later log don't count.
+        """
+        pos = bisect.bisect_left(self.task_offsets, offset)
+        if pos == len(self.task_offsets):
+            return None
+        next_start = bisect.bisect_right(self.starts, offset)
+        if (next_start < len(self.starts) and
+                self.starts[next_start] <= self.task_offsets[pos]):
+            return None
+        return self.task_offsets[pos]
+
+    def ignored(self, offset):
+        """Was the failure at offset followed by ...ignoring?
+
+        Only markers before the next task count, if there is no next task
+        the failure is not ignored.
+        """
+        next_task_offset = self.next_task_offset(offset)
+        if next_task_offset is None:
+            return False
+        ignore_pos = bisect.bisect_left(self.ignore_offsets, offset)
+        return (ignore_pos < len(self.ignore_offsets)
+                and self.ignore_offsets[ignore_pos] < next_task_offset)
+
+    def forget(self, offset):
+        """Drop markers before offset
+
+        Used when the index is kept between scans of a growing log, nothing
+        is asked about offsets before the first undecided failure.
+        """
+        pos = bisect.bisect_left(self.task_offsets, offset)
+        self.task_offsets = self.task_offsets[pos:]
+        pos = bisect.bisect_left(self.ignore_offsets, offset)
+        self.ignore_offsets = self.ignore_offsets[pos:]
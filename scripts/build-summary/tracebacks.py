@@ -0,0 +1,46 @@
+# Stdlib import
+import re
+
+
+class TracebackReader(object):
+    """Traceback Reader
+
+    Finds the exception at the end of a python traceback. It is fed the
+    lines after the 'Traceback (most recent call last)' line one at a time
+    and says when it has reached the end, so each line is only looked at
+    once. prefix is whatever came before 'Traceback' on the first line, it
+    is removed from the start of each line before looking for the end. The
+    pattern for it is compiled once per traceback.
+    """
+    # Hard to find the last line of a Traceback
+    # it may not even contain a :
+    exc_re = re.compile(r'^\S')
+
+    def __init__(self, prefix):
+        # prefixes may contain re specials such as [
+        # which need to be escaped.
+        escaped_prefix = re.escape(prefix)
+        # prefixes may also contain timestamps that need to be generalised
+        timestamped_prefix = re.sub(r'\d+', lambda m: r'\d+', escaped_prefix)
+        self.prefix_re = re.compile('^' + timestamped_prefix)
+        self.lines = 0
+        self.last_frame = ''
+        self.exc_type = None
+        self.exc_msg = None
+
+    @property
+    def done(self):
+        return self.exc_type is not None
+
+    def feed(self, line):
+        """Read the next line of the trace, returns True at the end"""
+        self.lines += 1
+        line = self.prefix_re.sub('', line, 1)
+        if self.exc_re.match(line):
+            exc_type, _, exc_msg = line.partition(': ')
+            self.exc_type = exc_type.strip()
+            self.exc_msg = exc_msg.strip()
+            return True
+        if line.lstrip().startswith('File '):
+            self.last_frame = line.strip()
+        return False